@@ -0,0 +1,143 @@
+import threading
+import time
+from typing import Iterable, Iterator
+
+from resutil.storage import Storage
+from resutil.storage.storage import (
+    ZIP_SUFFIX,
+    MANIFEST_SUFFIX,
+    experiment_name_from_object_name,
+)
+
+
+class MemoryStorage(Storage):
+    """In-process stand-in for a remote storage.
+
+    Every request waits `latency` seconds, and transferring n bytes takes
+    n / `bandwidth` more seconds (per connection, None means unlimited).
+    """
+
+    def __init__(
+        self,
+        storage_config: dict = None,
+        project_name: str = "bench",
+        latency: float = 0.0,
+        bandwidth: float = None,
+        max_workers: int = 10,
+    ):
+        super().__init__(storage_config or {}, project_name)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.max_workers = max_workers
+        self.stream_chunk_size = 8 * 1024 * 1024
+        self.objects = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def _request(self, size=0):
+        with self.lock:
+            self.requests += 1
+        delay = self.latency
+        if self.bandwidth is not None:
+            delay += size / self.bandwidth
+        if delay > 0:
+            time.sleep(delay)
+
+    def get_info(self) -> dict:
+        return {"project_dir": self.project_dir}
+
+    def upload_experiment_stream(self, ex_name: str, chunks: Iterable[bytes]):
+        self._request()
+        data = bytearray()
+        for chunk in chunks:
+            self._request_bytes(len(chunk))
+            data += chunk
+        with self.lock:
+            self.objects[ex_name + ZIP_SUFFIX] = bytes(data)
+        self.index.add(ex_name, {"format": "zip", "size": len(data)})
+
+    def upload_experiment(self, zip_path: str):
+        ex_name = zip_path.split("/")[-1][: -len(ZIP_SUFFIX)]
+        with open(zip_path, "rb") as f:
+            self.upload_experiment_stream(ex_name, [f.read()])
+
+    def download_experiment_stream(self, ex_name: str) -> Iterator[bytes]:
+        self._request()
+        data = self.objects[ex_name + ZIP_SUFFIX]
+        for i in range(0, len(data), self.stream_chunk_size):
+            chunk = data[i : i + self.stream_chunk_size]
+            self._request_bytes(len(chunk))
+            yield chunk
+
+    def download_experiment(self, zip_path: str):
+        ex_name = zip_path.split("/")[-1][: -len(ZIP_SUFFIX)]
+        with open(zip_path, "wb") as f:
+            for chunk in self.download_experiment_stream(ex_name):
+                f.write(chunk)
+
+    def _request_bytes(self, size):
+        if self.bandwidth is not None:
+            time.sleep(size / self.bandwidth)
+
+    def _list_experiments(self) -> dict:
+        self._request()
+        experiments = {}
+        with self.lock:
+            for key, data in self.objects.items():
+                if "/" in key:
+                    continue
+                ex_name = experiment_name_from_object_name(key)
+                if ex_name is not None:
+                    format = "chunked" if key.endswith(MANIFEST_SUFFIX) else "zip"
+                    experiments[ex_name] = {"format": format, "size": len(data)}
+        return experiments
+
+    def remove_experiment(self, ex_name: str):
+        self._request()
+        with self.lock:
+            for suffix in (ZIP_SUFFIX, MANIFEST_SUFFIX):
+                self.objects.pop(ex_name + suffix, None)
+        self.index.remove(ex_name)
+
+    def change_comment(self, ex_name, new_comment):
+        self._request()
+        new_ex_name = f"{ex_name.split('_')[0]}_{ex_name.split('_')[1]}_{new_comment}"
+        with self.lock:
+            for suffix in (ZIP_SUFFIX, MANIFEST_SUFFIX):
+                if ex_name + suffix in self.objects:
+                    self.objects[new_ex_name + suffix] = self.objects.pop(
+                        ex_name + suffix
+                    )
+        self.index.rename(ex_name, new_ex_name)
+
+    def put_object(self, key: str, data: bytes):
+        self._request(len(data))
+        with self.lock:
+            self.objects[key] = data
+
+    def get_object(self, key: str) -> bytes:
+        with self.lock:
+            data = self.objects.get(key)
+        if data is None:
+            self._request()
+            raise FileNotFoundError(f"{key} does not exist")
+        self._request(len(data))
+        return data
+
+    def exist_object(self, key: str) -> bool:
+        self._request()
+        return key in self.objects
+
+    def list_objects(self, prefix: str) -> list[str]:
+        self._request()
+        with self.lock:
+            return [
+                k
+                for k in self.objects
+                if k.startswith(prefix) and "/" not in k[len(prefix) :]
+            ]
+
+    def delete_object(self, key: str):
+        self._request()
+        with self.lock:
+            del self.objects[key]
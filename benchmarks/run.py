@@ -0,0 +1,288 @@
+"""Benchmarks of the packaging, transfer and listing hot paths.
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --compare results.json
+
+Transfers run against MemoryStorage, an in-process storage whose latency
+and bandwidth are set with --latency and --bandwidth. Results are written
+as JSON so that runs on different commits can be compared.
+"""
+
+from contextlib import redirect_stdout
+from os.path import join, dirname, abspath
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from resutil import core
+from resutil.archive import zip_directory, unzip_file
+
+from memory_storage import MemoryStorage
+from trees import SHAPES, make_tree, tree_size
+
+MiB = 1024 * 1024
+
+
+def ex_name(i, comment):
+    return f"bench{i:02d}_20240101T{i:06d}_{comment}"
+
+
+class Bench:
+    def __init__(self, args, work_dir):
+        self.args = args
+        self.work_dir = work_dir
+        self.results = []
+
+    def storage(self):
+        bandwidth = None if self.args.bandwidth is None else self.args.bandwidth * MiB
+        return MemoryStorage(latency=self.args.latency, bandwidth=bandwidth)
+
+    def measure(self, name, func, setup=None, size=None):
+        if self.args.filter and not any(f in name for f in self.args.filter):
+            return
+        times = []
+        for _ in range(self.args.repeat):
+            state = setup() if setup is not None else None
+            with redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                func(state)
+                times.append(time.perf_counter() - start)
+        result = {
+            "name": name,
+            "seconds": statistics.median(times),
+            "min_seconds": min(times),
+            "runs": len(times),
+        }
+        if size is not None:
+            result["bytes"] = size
+            result["mib_per_second"] = size / MiB / result["seconds"]
+        self.results.append(result)
+        print(f"{name:45s} {result['seconds']:9.4f} s", file=sys.stderr)
+
+    def fresh_dir(self, name):
+        path = join(self.work_dir, name)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+        return path
+
+    def run(self):
+        scale = self.args.scale
+        src_dir = self.fresh_dir("src")
+        for i, shape_name in enumerate(SHAPES):
+            make_tree(join(src_dir, ex_name(i, shape_name)), shape_name, scale)
+
+        for i, shape_name in enumerate(SHAPES):
+            name = ex_name(i, shape_name)
+            ex_dir = join(src_dir, name)
+            size = tree_size(ex_dir)
+            zip_path = join(self.work_dir, f"{name}.zip")
+
+            self.measure(
+                f"zip_directory/{shape_name}",
+                lambda _: zip_directory(ex_dir, zip_path),
+                size=size,
+            )
+            self.measure(
+                f"unzip_file/{shape_name}",
+                lambda dst: unzip_file(zip_path, dst),
+                setup=lambda: self.fresh_dir("unzipped"),
+                size=size,
+            )
+            self.measure(
+                f"upload/{shape_name}",
+                lambda storage: core.upload(name, src_dir, storage),
+                setup=self.storage,
+                size=size,
+            )
+
+            def upload_one():
+                storage = self.storage()
+                with redirect_stdout(io.StringIO()):
+                    core.upload(name, src_dir, storage)
+                return storage, self.fresh_dir("dst")
+
+            self.measure(
+                f"download/{shape_name}",
+                lambda state: core.download(name, state[1], state[0]),
+                setup=upload_one,
+                size=size,
+            )
+
+        self.run_many()
+        self.run_dependencies()
+        self.run_listing()
+
+    def run_many(self):
+        # the same small experiment many times
+        n = max(2, int(20 * self.args.scale))
+        many_dir = self.fresh_dir("many")
+        for i in range(n):
+            make_tree(join(many_dir, ex_name(i, "many")), "deep_nesting", 0.25)
+        ex_names = [ex_name(i, "many") for i in range(n)]
+        size = sum(tree_size(join(many_dir, e)) for e in ex_names)
+
+        self.measure(
+            "upload_all",
+            lambda storage: core.upload_all(ex_names, many_dir, storage),
+            setup=self.storage,
+            size=size,
+        )
+
+        def upload_many():
+            storage = self.storage()
+            with redirect_stdout(io.StringIO()):
+                for e in ex_names:
+                    core.upload(e, many_dir, storage)
+            return storage, self.fresh_dir("dst")
+
+        self.measure(
+            "download_all",
+            lambda state: core.download_all(ex_names, state[1], state[0]),
+            setup=upload_many,
+            size=size,
+        )
+
+    def run_dependencies(self):
+        # diamond-shaped dependency graphs: each root depends on two
+        # experiments that share a common base
+        deps_dir = self.fresh_dir("deps")
+        n = max(1, int(5 * self.args.scale))
+        roots = []
+        all_ex_names = []
+        for i in range(n):
+            base = ex_name(4 * i, "base")
+            left = ex_name(4 * i + 1, "left")
+            right = ex_name(4 * i + 2, "right")
+            root = ex_name(4 * i + 3, "root")
+            make_tree(join(deps_dir, base), "many_small_files", 0.05)
+            make_tree(join(deps_dir, left), "deep_nesting", 0.1, [f"results/{base}"])
+            make_tree(join(deps_dir, right), "deep_nesting", 0.1, [f"results/{base}"])
+            make_tree(join(deps_dir, root), "deep_nesting", 0.1, [left, right])
+            roots.append(root)
+            all_ex_names += [base, left, right, root]
+        size = sum(tree_size(join(deps_dir, e)) for e in all_ex_names)
+
+        self.measure(
+            "upload_experiments/dependency_closure",
+            lambda storage: core.upload_experiments(roots, deps_dir, storage),
+            setup=self.storage,
+            size=size,
+        )
+
+        def upload_deps():
+            storage = self.storage()
+            with redirect_stdout(io.StringIO()):
+                core.upload_experiments(roots, deps_dir, storage)
+            return storage, self.fresh_dir("dst")
+
+        self.measure(
+            "download_experiments/dependency_closure",
+            lambda state: core.download_experiments(roots, state[1], state[0]),
+            setup=upload_deps,
+            size=size,
+        )
+
+    def run_listing(self):
+        n = max(10, int(5000 * self.args.scale))
+
+        def populated():
+            storage = self.storage()
+            for i in range(n):
+                storage.objects[ex_name(i % 100, f"listed{i}") + ".zip"] = b""
+            return storage
+
+        self.measure(
+            "get_all_experiment_names/uncached",
+            lambda storage: storage.get_all_experiment_names(),
+            setup=populated,
+        )
+
+        def cached():
+            storage = populated()
+            storage.get_all_experiment_names()
+            return storage
+
+        self.measure(
+            "get_all_experiment_names/cached",
+            lambda storage: storage.get_all_experiment_names(),
+            setup=cached,
+        )
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=dirname(abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new):
+    old_results = {r["name"]: r for r in old["results"]}
+    print(f"{'benchmark':45s} {'before':>9s} {'after':>9s} {'ratio':>7s}")
+    for result in new["results"]:
+        before = old_results.get(result["name"])
+        if before is None:
+            continue
+        ratio = result["seconds"] / before["seconds"] if before["seconds"] else 0
+        print(
+            f"{result['name']:45s} {before['seconds']:9.4f} "
+            f"{result['seconds']:9.4f} {ratio:6.2f}x"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=float, default=1.0, help="size of trees")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--bandwidth", type=float, help="MiB/s per connection")
+    parser.add_argument("--filter", nargs="*", help="run only matching benchmarks")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of a previous run")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        bench = Bench(args, work_dir)
+        bench.run()
+
+    output = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "parameters": {
+            "scale": args.scale,
+            "repeat": args.repeat,
+            "latency": args.latency,
+            "bandwidth": args.bandwidth,
+        },
+        "results": bench.results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+from os.path import join
+import os
+import random
+
+import yaml
+
+MiB = 1024 * 1024
+
+# name -> function(root, scale) creating an experiment tree
+SHAPES = {}
+
+
+def shape(func):
+    SHAPES[func.__name__] = func
+    return func
+
+
+def _text(rng, size):
+    # compressible, log-like content
+    words = [b"epoch", b"loss", b"accuracy", b"lr", b"step", b"0.125", b"0.9871"]
+    out = bytearray()
+    while len(out) < size:
+        out += rng.choice(words) + b" " + str(rng.random()).encode() + b"\n"
+    return bytes(out[:size])
+
+
+def _random(rng, size):
+    # incompressible content
+    return rng.getrandbits(8 * size).to_bytes(size, "little")
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+@shape
+def many_small_files(root, scale=1.0):
+    rng = random.Random(0)
+    for i in range(max(1, int(2000 * scale))):
+        _write(join(root, f"logs/{i // 100:03d}/{i:05d}.txt"), _text(rng, 4096))
+
+
+@shape
+def few_huge_files(root, scale=1.0):
+    rng = random.Random(1)
+    size = max(1, int(64 * MiB * scale))
+    _write(join(root, "metrics.csv"), _text(rng, size))
+    _write(join(root, "weights.bin"), _random(rng, size))
+
+
+@shape
+def deep_nesting(root, scale=1.0):
+    rng = random.Random(2)
+    path = root
+    for depth in range(max(1, int(40 * scale))):
+        path = join(path, f"level{depth}")
+        for i in range(5):
+            _write(join(path, f"file{i}.json"), _text(rng, 2048))
+
+
+@shape
+def compressed_blobs(root, scale=1.0):
+    rng = random.Random(3)
+    for i, ext in enumerate([".pt", ".npz", ".png", ".parquet"] * 2):
+        _write(join(root, f"blob{i}{ext}"), _random(rng, max(1, int(8 * MiB * scale))))
+
+
+def make_tree(root, shape_name, scale=1.0, dependencies=()):
+    SHAPES[shape_name](root, scale)
+    with open(join(root, "resutil-exp.yaml"), "w") as f:
+        yaml.dump({"dependency": [str(d) for d in dependencies]}, f)
+
+
+def tree_size(root):
+    size = 0
+    for dir_path, dirs, files in os.walk(root):
+        for file in files:
+            size += os.path.getsize(join(dir_path, file))
+    return size
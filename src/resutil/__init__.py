@@ -1,4 +1,5 @@
 from .main import main
+from .experiment import open_experiment, RemoteExperiment, DirectoryExperiment
 
 
 @main
@@ -0,0 +1,782 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
+import io
+import os
+import queue
+import struct
+import threading
+import time
+import zipfile
+import zlib
+
+from . import metrics
+
+STREAM_CHUNK_SIZE = 8 * 1024 * 1024
+STREAM_MAX_QUEUED_CHUNKS = 4
+# End of a remote archive fetched up front, the end of central directory
+# record with the longest comment and zip64 records fit in it
+RANGED_TAIL_SIZE = 64 * 1024 + 22 + 76
+
+DEFAULT_COMPRESSION_LEVEL = 6
+# Formats that are already compressed. Deflating them burns CPU for nothing.
+DEFAULT_STORE_EXTENSIONS = [
+    ".pt",
+    ".pth",
+    ".ckpt",
+    ".npz",
+    ".png",
+    ".jpg",
+    ".jpeg",
+    ".gif",
+    ".webp",
+    ".parquet",
+    ".zip",
+    ".gz",
+    ".bz2",
+    ".xz",
+    ".zst",
+    ".7z",
+    ".mp3",
+    ".mp4",
+]
+COMPRESS_BLOCK_SIZE = 1024 * 1024
+# Deflate window, the last bytes of a block prime the compression of the next
+DEFLATE_WINDOW_SIZE = 32 * 1024
+
+ZIP64_LIMIT = (1 << 31) - 1
+ZIP_FILECOUNT_LIMIT = (1 << 16) - 1
+ZIP_VERSION = 20
+ZIP64_VERSION = 45
+CREATE_SYSTEM = 0 if os.name == "nt" else 3
+
+LOCAL_HEADER_SIGNATURE = 0x04034B50
+DATA_DESCRIPTOR_SIGNATURE = 0x08074B50
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+CENTRAL_DIR_SIGNATURE = 0x02014B50
+CENTRAL_DIR_HEADER = struct.Struct("<IBBBBHHHHIIIHHHHHII")
+END_SIGNATURE = 0x06054B50
+ZIP64_END_SIGNATURE = 0x06064B50
+ZIP64_LOCATOR_SIGNATURE = 0x07064B50
+ZIP64_EXTRA_ID = 0x0001
+DECOMPRESS_PIECE_SIZE = 1024 * 1024
+
+
+@dataclass
+class ArchiveOptions:
+    compression_level: int = DEFAULT_COMPRESSION_LEVEL
+    store_extensions: list[str] = field(
+        default_factory=lambda: list(DEFAULT_STORE_EXTENSIONS)
+    )
+    # number of compression threads, defaults to the number of CPUs
+    workers: Optional[int] = None
+    block_size: int = COMPRESS_BLOCK_SIZE
+
+    def __post_init__(self):
+        if not 0 <= self.compression_level <= 9:
+            raise ValueError("compression_level must be between 0 and 9")
+        self.store_extensions = [e.lower() for e in self.store_extensions]
+
+    def method(self, arcname: str) -> int:
+        if self.compression_level == 0:
+            return zipfile.ZIP_STORED
+        if os.path.splitext(arcname)[1].lower() in self.store_extensions:
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
+
+archive_options = ArchiveOptions()
+
+
+def set_archive_options(config: Optional[dict]):
+    # `config` is the `archive` section of resutil-conf.yaml
+    global archive_options
+    archive_options = ArchiveOptions(**(config or {}))
+
+
+def _iter_files(folder_path):
+    # Sorted, so that the same tree always gives the same archive and an
+    # interrupted upload can be resumed
+    for root, dirs, files in os.walk(folder_path):
+        dirs.sort()
+        for file in sorted(files):
+            file_path = os.path.join(root, file)
+            arcname = os.path.relpath(file_path, start=folder_path)
+            yield file_path, arcname
+
+
+def zip_directory(folder_path, zip_path, options=None):
+    with open(zip_path, "wb") as f:
+        _write_zip(f, folder_path, options or archive_options)
+
+
+def unzip_file(zip_path, extract_to):
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        zip_ref.extractall(extract_to)
+
+
+def _dos_date_time(mtime):
+    year, month, day, hour, minute, second = time.localtime(mtime)[:6]
+    if year < 1980:
+        year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+    dos_date = (year - 1980) << 9 | month << 5 | day
+    dos_time = hour << 11 | minute << 5 | second // 2
+    return dos_time, dos_date
+
+
+def _file_crc(path):
+    crc = 0
+    size = 0
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(STREAM_CHUNK_SIZE)
+            if not data:
+                return crc, size
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+
+
+def _compress_block(data, level, zdict, last):
+    # Raw deflate blocks ending with a sync flush can be concatenated into
+    # one stream, so blocks of a file are compressed independently
+    if zdict:
+        compressor = zlib.compressobj(
+            level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=zdict
+        )
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    compressed = compressor.compress(data)
+    compressed += compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    return compressed, data
+
+
+class _ZipEntry:
+    def __init__(self, arcname, st, method, zip64):
+        try:
+            self.name = arcname.encode("ascii")
+            self.flags = 0
+        except UnicodeEncodeError:
+            self.name = arcname.encode("utf-8")
+            self.flags = 0x800
+        self.method = method
+        self.dos_time, self.dos_date = _dos_date_time(st.st_mtime)
+        self.external_attr = (st.st_mode & 0xFFFF) << 16
+        self.zip64 = zip64
+        self.crc = 0
+        self.compressed_size = 0
+        self.file_size = 0
+        self.header_offset = 0
+
+
+class _ZipWriter:
+    """Writes zip members whose data is compressed elsewhere.
+
+    On seekable outputs the sizes and CRC in local headers are patched after
+    the data has been written. Otherwise deflated members are followed by a
+    data descriptor, and the CRC of stored members has to be known up front.
+    """
+
+    def __init__(self, fileobj, seekable):
+        self.fileobj = fileobj
+        self.seekable = seekable
+        self.base = fileobj.tell() if seekable else 0
+        self.offset = 0
+        self.entries = []
+        self.current = None
+
+    def _write(self, data):
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+    def begin(self, entry):
+        if not self.seekable and entry.method == zipfile.ZIP_DEFLATED:
+            entry.flags |= 0x08
+        entry.header_offset = self.offset
+        self.entries.append(entry)
+        self.current = entry
+        self._write(self._local_header(entry))
+
+    def write_data(self, compressed, raw):
+        entry = self.current
+        entry.crc = zlib.crc32(raw, entry.crc)
+        entry.file_size += len(raw)
+        entry.compressed_size += len(compressed)
+        self._write(compressed)
+
+    def end(self):
+        entry = self.current
+        self.current = None
+        size = max(entry.file_size, entry.compressed_size)
+        if not entry.zip64 and size > ZIP64_LIMIT:
+            raise zipfile.LargeZipFile("File size too large for a non zip64 member")
+        if entry.flags & 0x08:
+            if entry.zip64:
+                self._write(
+                    struct.pack(
+                        "<IIQQ",
+                        DATA_DESCRIPTOR_SIGNATURE,
+                        entry.crc,
+                        entry.compressed_size,
+                        entry.file_size,
+                    )
+                )
+            else:
+                self._write(
+                    struct.pack(
+                        "<IIII",
+                        DATA_DESCRIPTOR_SIGNATURE,
+                        entry.crc,
+                        entry.compressed_size,
+                        entry.file_size,
+                    )
+                )
+        elif self.seekable:
+            self.fileobj.seek(self.base + entry.header_offset)
+            self.fileobj.write(self._local_header(entry))
+            self.fileobj.seek(self.base + self.offset)
+
+    def _local_header(self, entry):
+        extra = b""
+        if entry.flags & 0x08:
+            crc = compressed_size = file_size = 0
+        else:
+            crc = entry.crc
+            compressed_size = entry.compressed_size
+            file_size = entry.file_size
+        if entry.zip64:
+            extra = struct.pack("<HHQQ", ZIP64_EXTRA_ID, 16, file_size, compressed_size)
+            compressed_size = file_size = 0xFFFFFFFF
+        return (
+            LOCAL_HEADER.pack(
+                LOCAL_HEADER_SIGNATURE,
+                ZIP64_VERSION if entry.zip64 else ZIP_VERSION,
+                entry.flags,
+                entry.method,
+                entry.dos_time,
+                entry.dos_date,
+                crc,
+                compressed_size,
+                file_size,
+                len(entry.name),
+                len(extra),
+            )
+            + entry.name
+            + extra
+        )
+
+    def close(self):
+        start_dir = self.offset
+        for entry in self.entries:
+            fields = []
+            file_size = entry.file_size
+            compressed_size = entry.compressed_size
+            header_offset = entry.header_offset
+            if file_size > ZIP64_LIMIT:
+                fields.append(file_size)
+                file_size = 0xFFFFFFFF
+            if compressed_size > ZIP64_LIMIT:
+                fields.append(compressed_size)
+                compressed_size = 0xFFFFFFFF
+            if header_offset > ZIP64_LIMIT:
+                fields.append(header_offset)
+                header_offset = 0xFFFFFFFF
+            extra = b""
+            if fields:
+                extra = struct.pack(
+                    f"<HH{len(fields)}Q", ZIP64_EXTRA_ID, 8 * len(fields), *fields
+                )
+            version = ZIP64_VERSION if entry.zip64 or fields else ZIP_VERSION
+            self._write(
+                CENTRAL_DIR_HEADER.pack(
+                    CENTRAL_DIR_SIGNATURE,
+                    version,
+                    CREATE_SYSTEM,
+                    version,
+                    0,
+                    entry.flags,
+                    entry.method,
+                    entry.dos_time,
+                    entry.dos_date,
+                    entry.crc,
+                    compressed_size,
+                    file_size,
+                    len(entry.name),
+                    len(extra),
+                    0,
+                    0,
+                    0,
+                    entry.external_attr,
+                    header_offset,
+                )
+                + entry.name
+                + extra
+            )
+
+        count = len(self.entries)
+        size_dir = self.offset - start_dir
+        if (
+            count > ZIP_FILECOUNT_LIMIT
+            or start_dir > ZIP64_LIMIT
+            or size_dir > ZIP64_LIMIT
+        ):
+            zip64_end_offset = self.offset
+            self._write(
+                struct.pack(
+                    "<IQHHIIQQQQ",
+                    ZIP64_END_SIGNATURE,
+                    44,
+                    ZIP64_VERSION,
+                    ZIP64_VERSION,
+                    0,
+                    0,
+                    count,
+                    count,
+                    size_dir,
+                    start_dir,
+                )
+            )
+            self._write(
+                struct.pack("<IIQI", ZIP64_LOCATOR_SIGNATURE, 0, zip64_end_offset, 1)
+            )
+            count = min(count, 0xFFFF)
+            size_dir = min(size_dir, 0xFFFFFFFF)
+            start_dir = min(start_dir, 0xFFFFFFFF)
+        self._write(
+            struct.pack(
+                "<IHHHHIIH", END_SIGNATURE, 0, 0, count, count, size_dir, start_dir, 0
+            )
+        )
+
+
+def _iter_tasks(folder_path, executor, options, seekable):
+    # Yields, in archive order, the work for the writer. Compression is
+    # submitted to `executor` when a task is yielded, so the tasks that are
+    # queued but not written yet are compressed in parallel.
+    for file_path, arcname in _iter_files(folder_path):
+        st = os.stat(file_path)
+        method = options.method(arcname)
+        arcname = arcname.replace(os.sep, "/")
+
+        if method == zipfile.ZIP_STORED:
+            entry = _ZipEntry(arcname, st, method, st.st_size > ZIP64_LIMIT)
+            crc = None if seekable else executor.submit(_file_crc, file_path)
+            yield "stored", (entry, file_path, crc)
+            continue
+
+        entry = _ZipEntry(arcname, st, method, st.st_size * 1.05 > ZIP64_LIMIT)
+        yield "begin", entry
+        with open(file_path, "rb") as f:
+            block = f.read(options.block_size)
+            zdict = b""
+            while True:
+                next_block = f.read(options.block_size)
+                yield "block", executor.submit(
+                    _compress_block,
+                    block,
+                    options.compression_level,
+                    zdict,
+                    not next_block,
+                )
+                if not next_block:
+                    break
+                zdict = block[-DEFLATE_WINDOW_SIZE:]
+                block = next_block
+        yield "end", None
+
+
+def _write_stored(writer, entry, file_path, crc):
+    if crc is not None:
+        # the local header can not be patched, it needs the CRC and size
+        expected = crc.result()
+        entry.crc, entry.file_size = expected
+        entry.compressed_size = entry.file_size
+    writer.begin(entry)
+    entry.crc = entry.file_size = entry.compressed_size = 0
+    with open(file_path, "rb") as f:
+        while True:
+            data = f.read(STREAM_CHUNK_SIZE)
+            if not data:
+                break
+            writer.write_data(data, data)
+    writer.end()
+    if crc is not None and (entry.crc, entry.file_size) != expected:
+        raise RuntimeError(f"{file_path} changed while it was being archived")
+
+
+def _write_zip(fileobj, folder_path, options):
+    seekable = getattr(fileobj, "seekable", lambda: False)()
+    writer = _ZipWriter(fileobj, seekable)
+    workers = options.workers or os.cpu_count() or 1
+    # number of tasks compressed ahead of the writer
+    window = 2 * workers
+
+    def handle(kind, item):
+        if kind == "stored":
+            _write_stored(writer, *item)
+        elif kind == "begin":
+            writer.begin(item)
+        elif kind == "block":
+            writer.write_data(*item.result())
+        else:
+            writer.end()
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    with metrics.phase("archive.zip", target=str(folder_path)) as phase:
+        try:
+            pending = deque()
+            for task in _iter_tasks(folder_path, executor, options, seekable):
+                pending.append(task)
+                if len(pending) > window:
+                    handle(*pending.popleft())
+            while pending:
+                handle(*pending.popleft())
+        finally:
+            executor.shutdown(cancel_futures=True)
+        writer.close()
+        phase.add(
+            bytes=sum(e.file_size for e in writer.entries), files=len(writer.entries)
+        )
+
+
+class StreamAborted(Exception):
+    pass
+
+
+class _QueueWriter:
+    # Unseekable file-like object handed to ZipFile. Output is cut into chunks
+    # and pushed into a bounded queue, so the zipping thread blocks when the
+    # consumer (the network) falls behind.
+    def __init__(self, chunk_queue, chunk_size, abort_event):
+        self.chunk_queue = chunk_queue
+        self.chunk_size = chunk_size
+        self.abort_event = abort_event
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.chunk_size:
+            self._put(bytes(self.buffer[: self.chunk_size]))
+            del self.buffer[: self.chunk_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close_stream(self):
+        if len(self.buffer) > 0:
+            self._put(bytes(self.buffer))
+            self.buffer = bytearray()
+
+    def _put(self, item):
+        while True:
+            if self.abort_event.is_set():
+                raise StreamAborted()
+            try:
+                self.chunk_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+
+def iter_zip_chunks(
+    folder_path,
+    chunk_size=STREAM_CHUNK_SIZE,
+    max_queued_chunks=STREAM_MAX_QUEUED_CHUNKS,
+    options=None,
+):
+    """Zip `folder_path` in a background thread and yield the archive as chunks.
+
+    At most `max_queued_chunks` chunks are buffered, so memory use is bounded
+    and compression overlaps with whatever consumes the chunks.
+    """
+    options = options or archive_options
+    chunk_queue = queue.Queue(maxsize=max_queued_chunks)
+    abort_event = threading.Event()
+    done = object()
+    errors = []
+
+    def produce():
+        writer = _QueueWriter(chunk_queue, chunk_size, abort_event)
+        try:
+            _write_zip(writer, folder_path, options)
+            writer.close_stream()
+        except StreamAborted:
+            return
+        except BaseException as e:
+            errors.append(e)
+        try:
+            writer._put(done)
+        except StreamAborted:
+            pass
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            chunk = chunk_queue.get()
+            if chunk is done:
+                break
+            yield chunk
+        if errors:
+            raise errors[0]
+    finally:
+        abort_event.set()
+        thread.join()
+
+
+class UnsupportedStreamError(Exception):
+    # The archive can not be extracted sequentially, extract it with
+    # unzip_file instead
+    pass
+
+
+class _ChunkReader:
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = bytearray()
+
+    def read_some(self, max_size):
+        if len(self.buffer) == 0:
+            for chunk in self.chunks:
+                if chunk:
+                    self.buffer += chunk
+                    break
+        data = bytes(self.buffer[:max_size])
+        del self.buffer[:max_size]
+        return data
+
+    def read_exact(self, size):
+        while len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                raise zipfile.BadZipFile("Unexpected end of archive")
+            self.buffer += chunk
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def peek(self, size):
+        data = self.read_exact(size)
+        self.unread(data)
+        return data
+
+    def unread(self, data):
+        self.buffer[0:0] = data
+
+    def drain(self):
+        self.buffer = bytearray()
+        for _ in self.chunks:
+            pass
+
+
+def _member_path(extract_to, name):
+    # Same sanitization as ZipFile.extract: no absolute paths or ".."
+    parts = [p for p in name.replace("\\", "/").split("/") if p not in ("", ".", "..")]
+    return os.path.join(extract_to, *parts)
+
+
+def _zip64_extra(extra):
+    # Returns the payload of the zip64 extra field, or None
+    offset = 0
+    while offset + 4 <= len(extra):
+        header_id, size = struct.unpack("<HH", extra[offset : offset + 4])
+        if header_id == ZIP64_EXTRA_ID:
+            return extra[offset + 4 : offset + 4 + size]
+        offset += 4 + size
+    return None
+
+
+def extract_zip_stream(chunks, extract_to, select=None):
+    """Extract a zip archive while its bytes arrive from `chunks`.
+
+    Members are read sequentially from their local headers, so no seekable
+    copy of the archive is needed. Raises UnsupportedStreamError for members
+    that can not be delimited without the central directory. With `select`,
+    only the members for which select(name) is true are extracted.
+    """
+    reader = _ChunkReader(chunks)
+    while True:
+        signature = struct.unpack("<I", reader.peek(4))[0]
+        if signature != LOCAL_HEADER_SIGNATURE:
+            # central directory: all members have been extracted
+            reader.drain()
+            return
+
+        (
+            _,
+            _,
+            flags,
+            method,
+            _,
+            _,
+            crc,
+            compressed_size,
+            file_size,
+            name_length,
+            extra_length,
+        ) = LOCAL_HEADER.unpack(reader.read_exact(LOCAL_HEADER.size))
+        raw_name = reader.read_exact(name_length)
+        extra = reader.read_exact(extra_length)
+        name = raw_name.decode("utf-8" if flags & 0x800 else "cp437")
+        zip64_extra = _zip64_extra(extra)
+        zip64 = zip64_extra is not None
+        has_descriptor = flags & 0x08
+        if zip64 and not has_descriptor and len(zip64_extra) >= 16:
+            file_size, compressed_size = struct.unpack("<QQ", zip64_extra[:16])
+
+        if flags & 0x01:
+            raise UnsupportedStreamError(f"{name} is encrypted")
+        if method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            raise UnsupportedStreamError(f"{name} uses compression method {method}")
+        if method == zipfile.ZIP_STORED and has_descriptor:
+            raise UnsupportedStreamError(f"Size of {name} is unknown")
+
+        selected = select is None or select(name)
+        if not selected and not has_descriptor:
+            # skip the data without decompressing it
+            remaining = compressed_size
+            while remaining > 0:
+                data = reader.read_some(min(remaining, STREAM_CHUNK_SIZE))
+                if not data:
+                    raise zipfile.BadZipFile("Unexpected end of archive")
+                remaining -= len(data)
+            continue
+
+        path = _member_path(extract_to, name)
+        if name.endswith("/"):
+            if selected:
+                os.makedirs(path, exist_ok=True)
+            continue
+        if selected:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        actual_crc = 0
+        with open(path if selected else os.devnull, "wb") as f:
+            if method == zipfile.ZIP_STORED:
+                remaining = compressed_size
+                while remaining > 0:
+                    data = reader.read_some(min(remaining, STREAM_CHUNK_SIZE))
+                    if not data:
+                        raise zipfile.BadZipFile("Unexpected end of archive")
+                    remaining -= len(data)
+                    actual_crc = zlib.crc32(data, actual_crc)
+                    f.write(data)
+            else:
+                decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                while not decompressor.eof:
+                    data = reader.read_some(STREAM_CHUNK_SIZE)
+                    if not data:
+                        raise zipfile.BadZipFile("Unexpected end of archive")
+                    while data and not decompressor.eof:
+                        piece = decompressor.decompress(data, DECOMPRESS_PIECE_SIZE)
+                        actual_crc = zlib.crc32(piece, actual_crc)
+                        f.write(piece)
+                        data = decompressor.unconsumed_tail
+                # the bytes following the member, unconsumed_tail may still
+                # hold a copy of them
+                reader.unread(decompressor.unused_data)
+
+        if has_descriptor:
+            if struct.unpack("<I", reader.peek(4))[0] == DATA_DESCRIPTOR_SIGNATURE:
+                reader.read_exact(4)
+            crc = struct.unpack("<I", reader.read_exact(4))[0]
+            reader.read_exact(16 if zip64 else 8)
+        if actual_crc != crc:
+            raise zipfile.BadZipFile(f"Bad CRC-32 for file {name}")
+
+
+class RangedFile(io.RawIOBase):
+    """Read-only seekable file whose bytes are fetched by `read_range`.
+
+    `read_range(offset, length)` returns the bytes of a remote archive, so
+    that zipfile can read the central directory and single members without
+    downloading the whole archive. Reads are extended up to `block_size`
+    bytes, but not beyond `read_ahead_limit`. The tail of the file, which
+    holds the central directory of small archives, is fetched at once.
+    """
+
+    def __init__(self, size, read_range, block_size=STREAM_CHUNK_SIZE):
+        self.size = size
+        self.read_range = read_range
+        self.block_size = block_size
+        self.read_ahead_limit = size
+        self.position = 0
+        tail = min(size, RANGED_TAIL_SIZE)
+        self.buffer_offset = size - tail
+        self.buffer = read_range(self.buffer_offset, tail) if tail > 0 else b""
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self.position = offset
+        return self.position
+
+    def read(self, size=-1):
+        end = self.size if size is None or size < 0 else self.position + size
+        end = min(end, self.size)
+        data = bytearray()
+        while self.position < end:
+            buffer_end = self.buffer_offset + len(self.buffer)
+            if self.buffer_offset <= self.position < buffer_end:
+                piece = self.buffer[
+                    self.position - self.buffer_offset : end - self.buffer_offset
+                ]
+                data += piece
+                self.position += len(piece)
+                continue
+            fetch_end = max(
+                end, min(self.position + self.block_size, self.read_ahead_limit)
+            )
+            fetch_end = min(fetch_end, self.size)
+            self.buffer = self.read_range(self.position, fetch_end - self.position)
+            self.buffer_offset = self.position
+            if not self.buffer:
+                raise zipfile.BadZipFile("Unexpected end of archive")
+        return bytes(data)
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[: len(data)] = data
+        return len(data)
+
+
+def extract_zip_members(fileobj, extract_to, select):
+    """Extract the members of a zip file for which select(name) is true.
+
+    Returns the names of the extracted members. With a RangedFile, only the
+    central directory and the selected members are fetched, runs of
+    adjacent selected members with one request.
+    """
+    extracted = []
+    with zipfile.ZipFile(fileobj) as zf:
+        infos = sorted(zf.infolist(), key=lambda info: info.header_offset)
+        # {index: end of the run of selected members it belongs to}
+        run_ends = {}
+        run_end = zf.start_dir
+        for i in reversed(range(len(infos))):
+            if select(infos[i].filename):
+                run_ends[i] = run_end
+            else:
+                run_end = infos[i].header_offset
+        for i, info in enumerate(infos):
+            if i not in run_ends:
+                continue
+            if isinstance(fileobj, RangedFile):
+                fileobj.read_ahead_limit = run_ends[i]
+            zf.extract(info, extract_to)
+            extracted.append(info.filename)
+    return extracted
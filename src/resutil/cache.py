@@ -0,0 +1,188 @@
+from contextlib import contextmanager
+from os.path import join, exists, expanduser
+from typing import Callable, Optional
+import hashlib
+import json
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: evictions are not serialized between processes
+    fcntl = None
+
+DEFAULT_CACHE_BYTES = 10 * 1024**3
+# Entries larger than this share of the cache are not kept, they would
+# evict most of it
+MAX_ENTRY_SHARE = 4
+# Temporary files older than this are left over from killed processes
+STALE_TMP_SECONDS = 24 * 60 * 60
+
+
+def default_cache_dir() -> str:
+    if os.environ.get("RESUTIL_CACHE_DIR"):
+        return os.environ["RESUTIL_CACHE_DIR"]
+    return join(os.environ.get("XDG_CACHE_HOME") or expanduser("~/.cache"), "resutil")
+
+
+def cache_key(storage, *names: str) -> str:
+    # Identifies the remote project dir, so that every results dir or
+    # checkout pulling from the same project shares its entries
+    identity = {"backend": type(storage).__name__, **storage.get_info()}
+    return "/".join([json.dumps(identity, sort_keys=True), *names])
+
+
+def archive_validator(metadata: dict) -> dict:
+    """Remote metadata that changes whenever the archive does.
+
+    Empty if the backend reports nothing usable, and such archives are not
+    cached.
+    """
+    validator = {}
+    for key in ("generation", "md5", "crc32c", "size", "mtime", "updated"):
+        if metadata.get(key) is not None:
+            validator[key] = metadata[key]
+    # Drive keeps the id of a file when it is updated
+    if validator and "id" in metadata:
+        validator["id"] = metadata["id"]
+    return validator
+
+
+class FileCache:
+    """Files kept under `root`, at most `max_bytes` in total.
+
+    Entries are looked up by key and served only if their `validator` (e.g.
+    the generation or checksum of the remote file) is unchanged: each
+    version of an entry is a file of its own. Reading an entry bumps its
+    mtime, and the least recently used entries are removed when the cache
+    grows beyond `max_bytes`. Entries are written to a temporary file and
+    renamed into place, so several processes can share the cache.
+    """
+
+    def __init__(self, root: str, max_bytes: Optional[int] = DEFAULT_CACHE_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    @property
+    def max_entry_bytes(self) -> Optional[int]:
+        return None if self.max_bytes is None else self.max_bytes // MAX_ENTRY_SHARE
+
+    def _paths(self, key: str, validator: dict):
+        identity = json.dumps([key, validator], sort_keys=True)
+        digest = hashlib.sha256(identity.encode("utf-8")).hexdigest()
+        base = join(self.root, digest[:2], digest)
+        return base + ".data", base + ".json"
+
+    def get(self, key: str, validator: dict) -> Optional[str]:
+        data_path, _ = self._paths(key, validator)
+        try:
+            os.utime(data_path)
+        except OSError:
+            # not cached, or evicted meanwhile
+            return None
+        return data_path
+
+    def put(self, key: str, validator: dict, write: Callable) -> str:
+        """Store the bytes `write(f)` writes to the file object `f`."""
+
+        def fill(path):
+            with open(path, "wb") as f:
+                write(f)
+
+        return self.put_path(key, validator, fill)
+
+    def put_path(self, key: str, validator: dict, fill: Callable) -> str:
+        """Store the file `fill(path)` creates at `path`."""
+        data_path, meta_path = self._paths(key, validator)
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        tmp_path = f"{data_path}.{os.getpid()}.{time.monotonic_ns()}.tmp"
+        try:
+            fill(tmp_path)
+            with open(meta_path, "w") as f:
+                json.dump({"key": key, "validator": validator}, f)
+            os.replace(tmp_path, data_path)
+        finally:
+            if exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict(keep=data_path)
+        return data_path
+
+    def entries(self) -> list:
+        # [(mtime, size, data path)] of all entries
+        entries = []
+        if not exists(self.root):
+            return entries
+        now = time.time()
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                if entry.name.endswith(".data"):
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+                elif (
+                    entry.name.endswith(".tmp")
+                    and now - st.st_mtime > STALE_TMP_SECONDS
+                ):
+                    _remove(entry.path)
+        return entries
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.root, exist_ok=True)
+        with open(join(self.root, ".lock"), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def evict(self, keep: Optional[str] = None):
+        # removes the least recently used entries but `keep`
+        if self.max_bytes is None:
+            return
+        with self._locked():
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, data_path in entries:
+                if total <= self.max_bytes:
+                    break
+                if data_path == keep:
+                    continue
+                # files opened by readers stay readable on POSIX, and can
+                # not be removed on Windows
+                if _remove(data_path):
+                    _remove(data_path[: -len(".data")] + ".json")
+                    total -= size
+
+
+def _remove(path) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
+
+
+# Cache used by pull and open_experiment, set by set_cache_options
+archive_cache: Optional[FileCache] = None
+
+
+def set_cache_options(config: Optional[dict] = None):
+    """Configure `archive_cache`.
+
+    `config` is the `cache` section of resutil-conf.yaml. RESUTIL_CACHE_DIR
+    and RESUTIL_CACHE_MAX_BYTES take precedence, and a size of 0 disables
+    the cache.
+    """
+    global archive_cache
+    config = config or {}
+    root = os.environ.get("RESUTIL_CACHE_DIR") or config.get("dir")
+    max_bytes = os.environ.get("RESUTIL_CACHE_MAX_BYTES") or config.get("max_bytes")
+    max_bytes = DEFAULT_CACHE_BYTES if max_bytes is None else int(max_bytes)
+    if max_bytes <= 0:
+        archive_cache = None
+        return
+    archive_cache = FileCache(expanduser(root or default_cache_dir()), max_bytes)
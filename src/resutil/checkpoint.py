@@ -0,0 +1,137 @@
+from os.path import join, exists
+import json
+import os
+import threading
+import time
+
+from rich import print
+
+from .storage import Storage
+from .chunkstore import ChunkStore
+from .core import upload
+from .ex_dir import get_state_dir
+
+
+def get_checkpoint_manifest_path(results_dir: str, ex_name: str) -> str:
+    return join(get_state_dir(results_dir), "checkpoints", f"{ex_name}.json")
+
+
+class Checkpointer:
+    """Incremental checkpoint uploads of one experiment.
+
+    Each checkpoint is pushed in the chunked format, reusing the manifest of
+    the previous checkpoint (kept in `<results_dir>/.resutil/checkpoints`) so
+    that only files added or changed since then are read and uploaded.
+    `finalize` turns the last checkpoint into a regular experiment in the
+    configured storage format.
+    """
+
+    def __init__(self, ex_name: str, results_dir: str, storage: Storage):
+        self.ex_name = ex_name
+        self.results_dir = results_dir
+        self.storage = storage
+        self.manifest_path = get_checkpoint_manifest_path(results_dir, ex_name)
+        self.chunk_store = ChunkStore(storage)
+        self.last_upload_time = None
+
+    @property
+    def queue_depth(self):
+        return 0
+
+    def load_manifest(self):
+        if not exists(self.manifest_path):
+            return None
+        with open(self.manifest_path, "r") as f:
+            return json.load(f)
+
+    def save(self):
+        previous = self.load_manifest()
+        manifest = self.chunk_store.push(
+            self.ex_name, join(self.results_dir, self.ex_name), previous=previous
+        )
+
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+        self.last_upload_time = time.time()
+
+    def finalize(self):
+        if self.storage.storage_format == "chunked":
+            print(f"🗂️ Uploading: [bold]{self.ex_name}[/bold]")
+            self.save()
+        else:
+            upload(self.ex_name, self.results_dir, self.storage)
+            # Only chunks first uploaded by this run's checkpoints are
+            # removed. Chunks that existed before may be shared with other
+            # experiments, including ones being pushed right now.
+            if self.chunk_store.uploaded_chunks:
+                print("🧹 Removing checkpoint chunks...")
+                self.chunk_store.remove_unreferenced_chunks(
+                    self.chunk_store.uploaded_chunks
+                )
+        if exists(self.manifest_path):
+            os.remove(self.manifest_path)
+
+
+class BackgroundUploader:
+    """Runs `Checkpointer.save` in a worker thread.
+
+    `request` returns immediately. Requests arriving while an upload is
+    running are coalesced into a single follow-up upload.
+    """
+
+    def __init__(self, checkpointer: Checkpointer):
+        self.checkpointer = checkpointer
+        self.condition = threading.Condition()
+        self.pending_requests = 0
+        self.uploading = False
+        self.closed = False
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    @property
+    def queue_depth(self):
+        # number of checkpoint requests not picked up by the worker yet
+        with self.condition:
+            return self.pending_requests
+
+    @property
+    def last_upload_time(self):
+        return self.checkpointer.last_upload_time
+
+    def request(self):
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("BackgroundUploader is already closed")
+            self.pending_requests += 1
+            self.condition.notify_all()
+
+    def close(self, flush=True):
+        with self.condition:
+            if not flush:
+                self.pending_requests = 0
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.pending_requests == 0 and not self.closed:
+                    self.condition.wait()
+                if self.pending_requests == 0:
+                    return
+                self.pending_requests = 0
+                self.uploading = True
+            try:
+                self.checkpointer.save()
+            except Exception as e:
+                self.error = e
+                print(f"⚠️ Failed to upload checkpoint: {e}")
+            finally:
+                with self.condition:
+                    self.uploading = False
+                    self.condition.notify_all()
@@ -0,0 +1,334 @@
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join
+import hashlib
+import json
+import os
+import zlib
+
+from .storage import Storage
+from .storage.storage import ZIP_SUFFIX, MANIFEST_SUFFIX
+
+CHUNK_PREFIX = ".chunks/"
+MANIFEST_FORMAT = "resutil-chunked"
+MANIFEST_VERSION = 1
+
+# Content-defined chunking parameters. A chunk ends after a position whose
+# rolling hash over the last CHUNK_WINDOW bytes has its low bits all zero,
+# at least CHUNK_MIN_SIZE bytes after the chunk start, or at CHUNK_MAX_SIZE.
+# As many low bits are checked as CHUNK_MIN_SIZE has, so chunks are about
+# twice CHUNK_MIN_SIZE on average. Since cut points depend on the content and
+# not on offsets, an insertion only changes the chunks around it.
+CHUNK_MIN_SIZE = 1024 * 1024
+CHUNK_MAX_SIZE = 8 * 1024 * 1024
+CHUNK_WINDOW = 64
+
+# Chunk payloads are prefixed with one byte telling whether they are deflated
+RAW_CHUNK = b"r"
+DEFLATED_CHUNK = b"z"
+
+
+def _gf_mul(a: int, b: int) -> int:
+    # product in GF(2^8) modulo x^8 + x^4 + x^3 + x^2 + 1, in which x (2)
+    # generates all non-zero elements
+    product = 0
+    while b:
+        if b & 1:
+            product ^= a
+        a <<= 1
+        if a & 0x100:
+            a ^= 0x11D
+        b >>= 1
+    return product
+
+
+# The hash of a window is an 8 bit Rabin-Karp hash,
+# sum(x^k * HASH_TABLE[data[i - k]] for k < CHUNK_WINDOW) in GF(2^8), and
+# the CRC-32 of the window for the other bits. The former can be computed
+# for all positions at once and rules out most of them, so that CRC-32 is
+# only computed for 1 in 256 positions.
+# fixed, so that cut points are the same on every machine
+HASH_TABLE = b"".join(
+    hashlib.sha256(f"resutil-chunk-{i}".encode()).digest() for i in range(8)
+)
+# multiplication by x^n for the powers of two below CHUNK_WINDOW
+_MUL_TABLES = {}
+_power = 2
+for _n in (1, 2, 4, 8, 16, 32):
+    _MUL_TABLES[_n] = bytes(_gf_mul(v, _power) for v in range(256))
+    _power = _gf_mul(_power, _power)
+
+
+def _window_hashes(data: bytes) -> bytes:
+    # Rabin-Karp hash at every position of `data`, where the first
+    # CHUNK_WINDOW - 1 positions only cover part of the window. The window is
+    # doubled with whole-buffer operations, which is much faster than
+    # rolling it byte by byte in Python.
+    n = len(data)
+    hashes = data.translate(HASH_TABLE)
+    value = int.from_bytes(hashes, "little")
+    width = 1
+    while width < CHUNK_WINDOW:
+        shifted = bytes(width) + hashes.translate(_MUL_TABLES[width])
+        value ^= int.from_bytes(shifted, "little")
+        # bytes past n are left over from the shifts
+        hashes = value.to_bytes(n + 2 * width, "little")[:n]
+        width *= 2
+    return hashes
+
+
+def _find_cut(data, start: int, end: int, bits: int) -> int:
+    """First cut point in [start, end) of memoryview `data`, or `end`.
+
+    A cut point c ends a window data[c - CHUNK_WINDOW:c] whose hash is zero
+    in its low `bits` bits.
+    """
+    first_mask = bytes(v & ((1 << bits) - 1) for v in range(256))
+    crc_mask = (1 << bits) - 1 >> 8
+    block_size = max(1 << (bits - 2), 64 * 1024)
+    for block_start in range(start, end, block_size):
+        block_end = min(block_start + block_size, end)
+        # hashes[j] is the hash of the window ending at offset + j, and the
+        # cut point after it is offset + j + 1
+        offset = block_start - CHUNK_WINDOW
+        hashes = _window_hashes(bytes(data[offset : block_end - 1]))
+        hashes = hashes.translate(first_mask)
+        j = hashes.find(0, CHUNK_WINDOW - 1)
+        while j >= 0:
+            cut = offset + j + 1
+            if not zlib.crc32(data[cut - CHUNK_WINDOW : cut]) & crc_mask:
+                return cut
+            j = hashes.find(0, j + 1)
+    return end
+
+
+def iter_chunks(f, min_size=CHUNK_MIN_SIZE, max_size=CHUNK_MAX_SIZE):
+    if min_size < CHUNK_WINDOW:
+        raise ValueError(f"min_size must be at least {CHUNK_WINDOW}")
+    bits = min(min_size.bit_length() - 1, 40)
+    buffer = memoryview(b"")
+    # start of the next chunk in buffer
+    offset = 0
+    eof = False
+    while True:
+        if not eof and len(buffer) - offset < max_size:
+            data = f.read(max_size)
+            eof = len(data) == 0
+            # the unchunked rest, at most max_size bytes, is copied once
+            buffer = memoryview(bytes(buffer[offset:]) + data)
+            offset = 0
+            continue
+        if offset == len(buffer):
+            return
+        end = min(len(buffer), offset + max_size)
+        cut = end
+        if offset + min_size < end:
+            cut = _find_cut(buffer, offset + min_size, end, bits)
+        yield buffer[offset:cut].tobytes()
+        offset = cut
+
+
+def chunk_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def encode_chunk(data: bytes) -> bytes:
+    compressed = zlib.compress(data, 1)
+    if len(compressed) < len(data):
+        return DEFLATED_CHUNK + compressed
+    return RAW_CHUNK + data
+
+
+def decode_chunk(payload: bytes) -> bytes:
+    if payload[:1] == DEFLATED_CHUNK:
+        return zlib.decompress(payload[1:])
+    return payload[1:]
+
+
+def bounded_map(executor, fn, items, window):
+    # Like executor.map, but keeps at most `window` results in memory
+    futures = []
+    for item in items:
+        futures.append(executor.submit(fn, item))
+        if len(futures) >= window:
+            yield futures.pop(0).result()
+    for future in futures:
+        yield future.result()
+
+
+def manifest_key(ex_name: str) -> str:
+    return ex_name + MANIFEST_SUFFIX
+
+
+def chunk_key(digest: str) -> str:
+    return CHUNK_PREFIX + digest
+
+
+class ChunkStore:
+    """Content-addressed experiment store on top of a `Storage` backend.
+
+    Files are split into content-defined chunks stored once per project under
+    `.chunks/<sha256>`. Each experiment is a small `<ex_name>.manifest.json`
+    listing its files and their chunks.
+    """
+
+    def __init__(self, storage: Storage, max_in_flight: int = 16):
+        self.storage = storage
+        self.max_in_flight = max_in_flight
+        self.remote_chunks = None
+        # whether remote_chunks comes from a listing of all chunks, so that
+        # any other chunk is known not to exist
+        self.chunks_listed = False
+        # chunks uploaded through this ChunkStore
+        self.uploaded_chunks = set()
+
+    def load_remote_chunks(self):
+        if self.remote_chunks is None:
+            self.remote_chunks = {
+                key[len(CHUNK_PREFIX) :]
+                for key in self.storage.list_objects(CHUNK_PREFIX)
+            }
+            self.chunks_listed = True
+        return self.remote_chunks
+
+    def is_chunked(self, ex_name: str) -> bool:
+        experiments = self.storage.index.get()
+        if experiments is not None and "format" in experiments.get(ex_name, {}):
+            return experiments[ex_name]["format"] == "chunked"
+        return self.storage.exist_object(manifest_key(ex_name))
+
+    def push(self, ex_name: str, ex_dir: str, previous: dict = None) -> dict:
+        """Upload `ex_dir` as `ex_name` and return the written manifest.
+
+        Files whose size and mtime match an entry of the `previous` manifest
+        are neither read nor uploaded again.
+        """
+        if previous is not None and self.remote_chunks is None:
+            # chunks of the previous manifest are known to be uploaded, and
+            # re-uploading any other existing chunk is harmless
+            self.remote_chunks = {
+                digest for entry in previous["files"] for digest in entry["chunks"]
+            }
+        remote_chunks = self.load_remote_chunks()
+        previous_files = (
+            {} if previous is None else {e["path"]: e for e in previous["files"]}
+        )
+        files = []
+
+        with ThreadPoolExecutor(max_workers=self.storage.max_workers) as executor:
+            in_flight = []
+
+            if self.chunks_listed:
+                put_object = self.storage.put_new_object
+            else:
+                put_object = self.storage.put_object
+
+            def put_chunk(digest, data):
+                put_object(chunk_key(digest), encode_chunk(data))
+
+            for root, dirs, filenames in os.walk(ex_dir):
+                dirs.sort()
+                for filename in sorted(filenames):
+                    file_path = join(root, filename)
+                    path = os.path.relpath(file_path, ex_dir).replace(os.sep, "/")
+                    stat = os.stat(file_path)
+
+                    entry = previous_files.get(path)
+                    if (
+                        entry is not None
+                        and entry["size"] == stat.st_size
+                        and entry["mtime"] == stat.st_mtime
+                    ):
+                        files.append(entry)
+                        continue
+
+                    digests = []
+                    file_hash = hashlib.sha256()
+                    with open(file_path, "rb") as f:
+                        for data in iter_chunks(f):
+                            file_hash.update(data)
+                            digest = chunk_hash(data)
+                            digests.append(digest)
+                            if digest in remote_chunks:
+                                continue
+                            remote_chunks.add(digest)
+                            self.uploaded_chunks.add(digest)
+                            in_flight.append(executor.submit(put_chunk, digest, data))
+                            if len(in_flight) >= self.max_in_flight:
+                                in_flight.pop(0).result()
+                    files.append(
+                        {
+                            "path": path,
+                            "size": stat.st_size,
+                            "mtime": stat.st_mtime,
+                            "mode": stat.st_mode & 0o777,
+                            "sha256": file_hash.hexdigest(),
+                            "chunks": digests,
+                        }
+                    )
+
+            for future in in_flight:
+                future.result()
+
+        manifest = {
+            "format": MANIFEST_FORMAT,
+            "version": MANIFEST_VERSION,
+            "files": files,
+        }
+        self.write_manifest(ex_name, manifest)
+        return manifest
+
+    def write_manifest(self, ex_name: str, manifest: dict):
+        # The manifest is written last so that a remote manifest always refers
+        # to chunks that have been uploaded completely.
+        metadata = self.storage.put_object(
+            manifest_key(ex_name), json.dumps(manifest, indent=1).encode("utf-8")
+        )
+        self.storage.index.add(ex_name, {**(metadata or {}), "format": "chunked"})
+        if self.storage.exist_object(ex_name + ZIP_SUFFIX):
+            self.storage.delete_object(ex_name + ZIP_SUFFIX)
+
+    def read_manifest(self, ex_name: str) -> dict:
+        manifest = json.loads(self.storage.get_object(manifest_key(ex_name)))
+        if manifest.get("format") != MANIFEST_FORMAT:
+            raise ValueError(f"{manifest_key(ex_name)} is not a resutil manifest")
+        return manifest
+
+    def remove_unreferenced_chunks(self, digests):
+        # Delete those of `digests` that no remaining manifest refers to.
+        # Chunks another push deduplicated against, but whose manifest is not
+        # written yet, look unreferenced too, so `digests` should only be
+        # chunks that nobody else can know of.
+        referenced = set()
+        for key in self.storage.list_objects(""):
+            if key.endswith(MANIFEST_SUFFIX):
+                manifest = self.read_manifest(key[: -len(MANIFEST_SUFFIX)])
+                for entry in manifest["files"]:
+                    referenced.update(entry["chunks"])
+        for digest in set(digests) - referenced:
+            self.storage.delete_object(chunk_key(digest))
+            if self.remote_chunks is not None:
+                self.remote_chunks.discard(digest)
+
+    def pull(self, ex_name: str, ex_dir: str, select=None):
+        # select(path) chooses the files to pull
+        manifest = self.read_manifest(ex_name)
+
+        def get_chunk(digest):
+            data = decode_chunk(self.storage.get_object(chunk_key(digest)))
+            if chunk_hash(data) != digest:
+                raise ValueError(f"Chunk {digest} of {ex_name} is corrupted")
+            return data
+
+        with ThreadPoolExecutor(max_workers=self.storage.max_workers) as executor:
+            for entry in manifest["files"]:
+                if select is not None and not select(entry["path"]):
+                    continue
+                file_path = join(ex_dir, *entry["path"].split("/"))
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                with open(file_path, "wb") as f:
+                    for data in bounded_map(
+                        executor, get_chunk, entry["chunks"], self.max_in_flight
+                    ):
+                        f.write(data)
+                os.chmod(file_path, entry["mode"])
+                os.utime(file_path, (entry["mtime"], entry["mtime"]))
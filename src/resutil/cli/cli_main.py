@@ -1,5 +1,6 @@
 import argparse
 import os
+import subprocess
 from os.path import join
 from datetime import datetime
 
@@ -10,18 +11,22 @@ from ..ex_dir import (
     find_unuploaded_ex_dirs,
     create_ex_dir,
     change_comment,
+    is_partial,
 )
-from ..utils import user_confirm, verify_comment
+from ..git import restore_code
+from ..sync import plan_sync, print_sync_plan, sync_experiments
+from ..utils import user_confirm, verify_comment, FileSelector
 from ..config_file import Config, create_ex_yaml
-from ..storage import GCS, GDrive
+from .. import metrics
 
 from ..core import (
     initialize,
+    load_config,
     upload,
-    upload_with_dependency,
+    upload_experiments,
     upload_all,
     download_all,
-    download_with_dependency,
+    download_experiments,
     download,
     remove_local,
     remove_remote,
@@ -47,9 +52,33 @@ def main():
         action="store_true",
         help="pull experiments without dependencies",
     )
+    parser_pull.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="show experiments to pull and their total size without pulling",
+    )
     parser_pull.add_argument(
         "-A", "--all", action="store_true", help="pull all experiments"
     )
+    parser_pull.add_argument(
+        "--metrics",
+        action="store_true",
+        help="print time and throughput of each phase at the end",
+    )
+    parser_pull.add_argument(
+        "--include",
+        action="append",
+        default=[],
+        metavar="PATTERN",
+        help="pull only the files matching the pattern (can be repeated)",
+    )
+    parser_pull.add_argument(
+        "--exclude",
+        action="append",
+        default=[],
+        metavar="PATTERN",
+        help="do not pull the files matching the pattern (can be repeated)",
+    )
     parser_pull.add_argument("experiments", nargs="*", help="experiment(s) to pull")
     parser_pull.set_defaults(handler=command_pull)
 
@@ -60,12 +89,46 @@ def main():
         action="store_true",
         help="push experiments without dependencies",
     )
+    parser_push.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="show experiments to push and their total size without pushing",
+    )
     parser_push.add_argument(
         "-A", "--all", action="store_true", help="push all experiments"
     )
+    parser_push.add_argument(
+        "--metrics",
+        action="store_true",
+        help="print time and throughput of each phase at the end",
+    )
     parser_push.add_argument("experiments", nargs="*", help="experient(s) to push")
     parser_push.set_defaults(handler=command_push)
 
+    # sync
+    parser_sync = subparsers.add_parser(
+        "sync", help="push and pull experiments changed since the last sync"
+    )
+    parser_sync.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="show experiments to push and pull without transferring them",
+    )
+    parser_sync.add_argument(
+        "-y", "--yes", action="store_true", help="do not ask for confirmation"
+    )
+    parser_sync.add_argument(
+        "--adopt",
+        action="store_true",
+        help="record experiments on both sides that were never synced as synced",
+    )
+    parser_sync.add_argument(
+        "--metrics",
+        action="store_true",
+        help="print time and throughput of each phase at the end",
+    )
+    parser_sync.set_defaults(handler=command_sync)
+
     # add
     parser_add = subparsers.add_parser("add", help="add experiments")
     parser_add.add_argument("comment", nargs="?", help="experient to add")
@@ -79,6 +142,11 @@ def main():
 
     # list
     parser_list = subparsers.add_parser("list", help="list remote experiments")
+    parser_list.add_argument(
+        "--refresh",
+        action="store_true",
+        help="list remote experiments again instead of using the cached index",
+    )
     parser_list.set_defaults(handler=command_list)
 
     # rm
@@ -113,6 +181,18 @@ def main():
     )
     parser_comment.set_defaults(handler=command_comment)
 
+    # restore-code
+    parser_restore = subparsers.add_parser(
+        "restore-code", help="rebuild the code an experiment was run with"
+    )
+    parser_restore.add_argument("EXPERIMENT")
+    parser_restore.add_argument(
+        "-o",
+        "--output",
+        help="directory to rebuild the code in (default: ./<EXPERIMENT>-code)",
+    )
+    parser_restore.set_defaults(handler=command_restore_code)
+
     # args
     args = parser.parse_args()
 
@@ -195,10 +275,10 @@ def command_init(args):
     # set storage type
     while True:
         d = "gcs"
-        print(f"Input storage_type ([bold]gcs[/bold]/gdrive): ", end="")
+        print(f"Input storage_type ([bold]gcs[/bold]/gdrive/local): ", end="")
         s = input()
         storage_type = s if s != "" else "gcs"
-        if storage_type in ["gcs", "gdrive"]:
+        if storage_type in ["gcs", "gdrive", "local"]:
             break
     config.set_storage_type(storage_type)
 
@@ -224,6 +304,8 @@ def command_init(args):
 
         config.set_storage_config(storage_config)
 
+        from ..storage import GCS
+
         try:
             GCS(config.storage_config, config.project_name)
         except Exception as e:
@@ -253,6 +335,8 @@ def command_init(args):
 
         config.set_storage_config(storage_config)
 
+        from ..storage import GDrive
+
         try:
             GDrive(config.storage_config, config.project_name)
         except Exception as e:
@@ -260,6 +344,24 @@ def command_init(args):
             print(f"  [red]{e}[/red]")
             return
 
+    # set local storage config
+    elif storage_type == "local":
+        print(f"Input path of the storage dir (e.g. a shared volume): ", end="")
+        path = input()
+
+        storage_config = {"path": path}
+
+        config.set_storage_config(storage_config)
+
+        from ..storage import LocalStorage
+
+        try:
+            LocalStorage(config.storage_config, config.project_name)
+        except Exception as e:
+            print("❌ Failed to connect to storage.")
+            print(f"  [red]{e}[/red]")
+            return
+
     # save config
     config.save()
 
@@ -269,56 +371,91 @@ def command_init(args):
 def command_push(args):
     config, storage = initialize()
 
-    if args.experiments:
-        for ex_name in args.experiments:
-            if args.no_dependency:
-                upload(ex_name, config.results_dir, storage)
-            else:
-                upload_with_dependency(ex_name, config.results_dir, storage)
-            print("✅ Uploaded")
-
-    elif args.all:
-        ex_names_to_upload = find_unuploaded_ex_dirs(config.results_dir, storage)
-
-        n = len(ex_names_to_upload)
-        if n > 0 and user_confirm(
-            f"ℹ️ There are {n} other experiment directory(s) that have not been uploaded. Do you want to upload them?",
-            default="y",
-        ):
-            upload_all(ex_names_to_upload, config.results_dir, storage)
-            print("✅ Uploaded")
-
-        elif n == 0:
-            print("✅ No experiment to upload.")
-    else:
-        print("⚠️ Specify experiment name(s) or use -A option.")
+    with metrics.collect(args.metrics or metrics.summary_requested()):
+        if args.experiments:
+            upload_experiments(
+                args.experiments,
+                config.results_dir,
+                storage,
+                dependency=not args.no_dependency,
+                dry_run=args.dry_run,
+            )
+            if not args.dry_run:
+                print("✅ Uploaded")
+
+        elif args.all:
+            ex_names_to_upload = find_unuploaded_ex_dirs(config.results_dir, storage)
+
+            n = len(ex_names_to_upload)
+            if n > 0 and user_confirm(
+                f"ℹ️ There are {n} other experiment directory(s) that have not been uploaded. Do you want to upload them?",
+                default="y",
+            ):
+                upload_all(ex_names_to_upload, config.results_dir, storage)
+                print("✅ Uploaded")
+
+            elif n == 0:
+                print("✅ No experiment to upload.")
+        else:
+            print("⚠️ Specify experiment name(s) or use -A option.")
 
 
 def command_pull(args):
     config, storage = initialize()
 
-    if args.experiments or args.experiments is None:
-        for ex_name in args.experiments:
-            if args.no_dependency:
-                download(ex_name, config.results_dir, storage)
-            else:
-                download_with_dependency(ex_name, config.results_dir, storage)
-        print("✅ Downloaded")
-    elif args.all:
-        ex_names_to_upload = find_undownloaded_ex_dirs(config.results_dir, storage)
-
-        n = len(ex_names_to_upload)
-        if n > 0 and user_confirm(
-            f"ℹ️ There are {n} other experiment directory(s) that have not been downloaded. Do you want to download them?",
-            default="y",
-        ):
-            download_all(ex_names_to_upload, config.results_dir, storage)
-            print("✅ Downloaded")
-
-        elif n == 0:
-            print("✅ No experiment to download.")
+    if args.include or args.exclude:
+        # dependencies are not pulled with a file selection
+        select = FileSelector(include=args.include, exclude=args.exclude)
     else:
-        print("⚠️ Specify experiment name(s) or use -A option.")
+        select = None
+
+    with metrics.collect(args.metrics or metrics.summary_requested()):
+        if args.experiments or args.experiments is None:
+            download_experiments(
+                args.experiments,
+                config.results_dir,
+                storage,
+                dependency=not args.no_dependency and select is None,
+                dry_run=args.dry_run,
+                select=select,
+            )
+            if not args.dry_run:
+                print("✅ Downloaded")
+        elif args.all:
+            ex_names_to_upload = find_undownloaded_ex_dirs(config.results_dir, storage)
+
+            n = len(ex_names_to_upload)
+            if n > 0 and user_confirm(
+                f"ℹ️ There are {n} other experiment directory(s) that have not been downloaded. Do you want to download them?",
+                default="y",
+            ):
+                download_all(
+                    ex_names_to_upload, config.results_dir, storage, select=select
+                )
+                print("✅ Downloaded")
+
+            elif n == 0:
+                print("✅ No experiment to download.")
+        else:
+            print("⚠️ Specify experiment name(s) or use -A option.")
+
+
+def command_sync(args):
+    config, storage = initialize()
+
+    with metrics.collect(args.metrics or metrics.summary_requested()):
+        with metrics.phase("plan", direction="sync"):
+            plan = plan_sync(config.results_dir, storage, adopt=args.adopt)
+        print_sync_plan(plan)
+        if args.dry_run:
+            return
+        if plan.uploads or plan.downloads:
+            if not args.yes and not user_confirm(
+                "ℹ️ Do you want to transfer them?", default="y"
+            ):
+                return
+        sync_experiments(config.results_dir, storage, plan)
+        print("✅ Synced")
 
 
 def command_add(args):
@@ -354,17 +491,28 @@ def command_list(args):
 
     print("📦 Remote experiment list")
 
-    local_ex_names = get_ex_dir_names(config.results_dir)
+    if args.refresh:
+        storage.refresh_index()
+
+    local_ex_names = set(get_ex_dir_names(config.results_dir))
     remote_ex_names = storage.get_all_experiment_names()
-    all_ex_names = sorted(list(set(local_ex_names) | set(remote_ex_names)))
+    all_ex_names = sorted(local_ex_names | set(remote_ex_names))
 
     print("")
     print(" Local |Remote | Experiment name")
     print("-------|-------|------------------------------")
     for ex_name in all_ex_names:
         remote = "✅" if ex_name in remote_ex_names else "  "
-        local = "✅" if ex_name in local_ex_names else "  "
+        if ex_name not in local_ex_names:
+            local = "  "
+        elif is_partial(config.results_dir, ex_name):
+            local = "🔸"
+        else:
+            local = "✅"
         print(f"   {local}  |  {remote}   | {ex_name}")
+    if any(is_partial(config.results_dir, e) for e in local_ex_names):
+        print("")
+        print("🔸: partially pulled with --include/--exclude")
 
 
 def command_rm(args):
@@ -412,3 +560,27 @@ def command_comment(args):
         storage.change_comment(ex_name, comment)
 
     print(f"✅ Renamed [bold]{ex_name}[/bold] to [bold]{new_ex_name}[/bold]")
+
+
+def command_restore_code(args):
+    # only reads the experiment dir, the storage is not needed
+    config = load_config()
+
+    ex_name = args.EXPERIMENT
+    ex_dir_path = join(config.results_dir, ex_name)
+    if not os.path.exists(ex_dir_path):
+        print(f"⚠️ {ex_name} does not exist in the local directory.")
+        print(f"  Pull it with [bold]resutil pull {ex_name}[/bold] and try again")
+        return
+
+    output = args.output or f"{ex_name}-code"
+    try:
+        commit = restore_code(ex_dir_path, output)
+    except (ValueError, FileExistsError, RuntimeError) as e:
+        print(f"⛔️ {e}")
+        return
+    except subprocess.CalledProcessError as e:
+        print("⛔️ The patch of the experiment could not be applied.")
+        print(f"  [red]{e.stderr.decode().strip()}[/red]")
+        return
+    print(f"✅ Restored the code of [bold]{ex_name}[/bold] ({commit[:7]}) to {output}")
@@ -12,6 +12,9 @@ CONFIG_FILE_NAME = "resutil-conf.yaml"
 class Config:
     def __init__(self):
         self.current_dir = Path.cwd()
+        self.archive_config: dict = {}
+        self.cache_config: dict = {}
+        self.git_config: dict = {}
 
     def load(self):
         # serch config file from current dir to root dir
@@ -31,6 +34,9 @@ class Config:
         self.results_dir: str = conf["results_dir"]
         self.storage_type: str = conf["storage_type"]
         self.storage_config: str = conf["storage_config"]
+        self.archive_config: dict = conf.get("archive") or {}
+        self.cache_config: dict = conf.get("cache") or {}
+        self.git_config: dict = conf.get("git") or {}
 
     def set_project_name(self, project_name: str):
         self.project_name = project_name
@@ -42,7 +48,7 @@ class Config:
         self.results_dir = results_dir
 
     def set_storage_type(self, storage_type: str):
-        if storage_type not in ["gs", "gcs", "gdrive"]:
+        if storage_type not in ["gs", "gcs", "gdrive", "local"]:
             raise ValueError("storage_type must be 'local', 'gcs' or 'gdrive'")
         self.storage_type = storage_type
 
@@ -58,8 +64,11 @@ class Config:
                 raise ValueError("storage_config must have 'key_file_path' key")
             if "base_folder_id" not in storage_config:
                 raise ValueError("storage_config must have 'base_folder_id' key")
+        elif self.storage_type == "local":
+            if "path" not in storage_config:
+                raise ValueError("storage_config must have 'path' key")
         else:
-            raise ValueError("storage_type must be 'gcs' or 'gdrive'")
+            raise ValueError("storage_type must be 'local', 'gcs' or 'gdrive'")
         self.storage_config = storage_config
 
     def save(self):
@@ -69,6 +78,12 @@ class Config:
             "storage_type": self.storage_type,
             "storage_config": self.storage_config,
         }
+        if self.archive_config:
+            data["archive"] = self.archive_config
+        if self.cache_config:
+            data["cache"] = self.cache_config
+        if self.git_config:
+            data["git"] = self.git_config
         with open(CONFIG_FILE_NAME, "w") as stream:
             yaml.dump(data, stream)
 
@@ -78,6 +93,8 @@ def create_ex_yaml(
     dependencies: list[Path] = [],
     commit_hash: Optional[str] = None,
     uncommited_files: list[str] = [],
+    untracked_files: Optional[list[str]] = None,
+    snapshot: Optional[str] = None,
 ):
     args = " ".join(sys.argv)
     data = {
@@ -89,5 +106,11 @@ def create_ex_yaml(
             "commit_hash": commit_hash,
         },
     }
+    # only recorded when untracked files are captured
+    if untracked_files is not None:
+        data["git"]["untracked_files"] = untracked_files
+    # how uncommitted changes are stored, see git.store_snapshot
+    if snapshot == "patch":
+        data["git"]["snapshot"] = snapshot
     with Path(dir, "resutil-exp.yaml").open("w") as stream:
         yaml.dump(data, stream, width=10000, allow_unicode=True)
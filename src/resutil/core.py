@@ -1,23 +1,43 @@
-from concurrent.futures import ThreadPoolExecutor
-from os.path import join, exists
+from os.path import join, exists, dirname
 from os import makedirs
 import os
-import zipfile
 import tempfile
 import shutil
 
 
 from rich import print
 
-from .storage import GCS, GDrive, Storage
+from .storage import Storage
+from .storage.resumable import ResumeMismatch
 from .config_file import Config
-from .exp_file import ExpFile
-from .ex_dir import get_ex_dir_names
-
-exp_file_name = "resutil-exp.yaml"
-
-
-def initialize():
+from .ex_dir import (
+    get_ex_dir_names,
+    get_state_dir,
+    is_partial,
+    mark_partial,
+    unmark_partial,
+)
+from .archive import (
+    zip_directory,
+    unzip_file,
+    iter_zip_chunks,
+    extract_zip_stream,
+    extract_zip_members,
+    set_archive_options,
+    RangedFile,
+    UnsupportedStreamError,
+)
+from .chunkstore import ChunkStore, manifest_key
+from .local_index import LocalIndex
+from .planner import plan_upload, plan_download, print_plan, get_local_size
+from .scheduler import TransferScheduler
+from .sync import record_synced
+from . import cache, metrics
+from .cache import archive_validator, cache_key, set_cache_options
+
+
+def load_config() -> Config:
+    # resutil-conf.yaml, without connecting to the storage
     try:
         config = Config()
         config.load()
@@ -25,8 +45,19 @@ def initialize():
         print(f"⚠️ Config file does not exist.")
         print("Create a config file by running [bold]resutil init[/bold] and try again")
         exit(1)
+    return config
+
+
+def initialize():
+    metrics.configure_from_env()
+
+    config = load_config()
+    set_archive_options(config.archive_config)
+    set_cache_options(config.cache_config)
 
     if config.storage_type == "gcs" or config.storage_type == "gs":
+        from .storage import GCS
+
         storage = GCS(config.storage_config, config.project_name)
         print("📦 Connected to [bold]Google Cloud Storage[/bold]")
         info = storage.get_info()
@@ -34,101 +65,310 @@ def initialize():
         print(f"  📁 Project dir: [bold]{info['project_dir']}[/bold]")
 
     elif config.storage_type == "gdrive":
+        from .storage import GDrive
+
         storage = GDrive(config.storage_config, config.project_name)
         print("📦 Connected to [bold]Google Drive[/bold]")
         info = storage.get_info()
         print(f"  📁 Base folder id: [bold]{info['base_folder_id']}[/bold]")
         print(f"  📁 Project dir: [bold]{info['project_dir']}[/bold]")
 
+    elif config.storage_type == "local":
+        from .storage import LocalStorage
+
+        storage = LocalStorage(config.storage_config, config.project_name)
+        print("📦 Connected to [bold]Local Storage[/bold]")
+        info = storage.get_info()
+        print(f"  📁 Path: [bold]{info['path']}[/bold]")
+        print(f"  📁 Project dir: [bold]{info['project_dir']}[/bold]")
+
     else:
         raise (
             ValueError(
                 f"⛔️ Wronge storage type. Check your [bold]{config_file_name}[/bold] file."
             )
         )
-    return config, storage
 
+    storage.transfer_state_dir = join(get_state_dir(config.results_dir), "transfers")
 
-def zip_directory(folder_path, zip_path):
-    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-        for root, dirs, files in os.walk(folder_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                arcname = os.path.relpath(file_path, start=folder_path)
-                zipf.write(file_path, arcname)
+    if storage.persist_index:
+        storage.index.attach(
+            join(get_state_dir(config.results_dir), "remote-index.json"),
+            {"storage_type": config.storage_type, **storage.get_info()},
+        )
+    return config, storage
 
 
 def upload(ex_name: str, results_dir: str, storage: Storage):
     ex_dir_path = join(results_dir, ex_name)
 
-    with tempfile.TemporaryDirectory() as temp_dir:
-        zip_path = os.path.join(temp_dir, f"{ex_name}.zip")
-        zip_directory(ex_dir_path, zip_path)
-        print(f"🗂️ Uploading: [bold]{ex_name}[/bold]")
-        storage.upload_experiment(zip_path)
+    if is_partial(results_dir, ex_name):
+        # it would replace the complete remote experiment
+        print(f"⚠️ {ex_name} is only partially pulled and is not uploaded.")
+        return
+
+    print(f"🗂️ Uploading: [bold]{ex_name}[/bold]")
+    with metrics.phase("upload", target=ex_name) as phase:
+        if phase.enabled:
+            files, size = metrics.tree_stats(ex_dir_path)
+            phase.add(bytes=size, files=files)
+        if storage.storage_format == "chunked":
+            ChunkStore(storage).push(ex_name, ex_dir_path)
+        else:
+            # the experiment being replaced, if any, from the cached listing
+            previous = storage.list_experiments().get(ex_name)
+            if storage.storage_format == "directory":
+                storage.upload_experiment_dir(ex_name, ex_dir_path)
+            else:
+                try:
+                    storage.upload_experiment_stream(
+                        ex_name, iter_zip_chunks(ex_dir_path)
+                    )
+                except ResumeMismatch:
+                    # the experiment changed since the interrupted upload
+                    print(f"🔁 Restarting the upload of [bold]{ex_name}[/bold]")
+                    storage.upload_experiment_stream(
+                        ex_name, iter_zip_chunks(ex_dir_path)
+                    )
+            # drop a manifest left over from a previous chunked upload
+            if previous is not None:
+                remove_manifest(ex_name, previous, storage)
+    record_synced(results_dir, ex_name, storage)
+
+
+def remove_manifest(ex_name: str, metadata: dict, storage: Storage):
+    # Listings of the backends tell the format of each experiment, so the
+    # manifest only has to be looked up for listings that do not
+    remote_format = metadata.get("format")
+    if remote_format == "chunked" or (
+        remote_format is None and storage.exist_object(manifest_key(ex_name))
+    ):
+        try:
+            storage.delete_object(manifest_key(ex_name))
+        except FileNotFoundError:
+            # backends such as GDrive replace the whole experiment on upload
+            pass
+
+
+def upload_experiments(
+    ex_names: list[str],
+    results_dir: str,
+    storage: Storage,
+    dependency: bool = True,
+    dry_run: bool = False,
+):
+    with metrics.phase("plan", direction="upload"):
+        planner = plan_upload(ex_names, results_dir, storage, dependency)
+    if dry_run:
+        print_plan(planner.plan)
+        return
+    planner.execute(
+        lambda e: upload(e, results_dir, storage),
+        TransferScheduler(storage, planner.plan.sizes.get),
+    )
 
 
 def upload_with_dependency(ex_name: str, results_dir: str, storage: Storage):
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        recurcive_uploder(ex_name, results_dir, storage, executor)
-
-
-def recurcive_uploder(ex_name: str, results_dir: str, storage, executor):
-    ex_dir_path = join(results_dir, ex_name)
-
-    executor.submit(upload, ex_name, results_dir, storage)
-
-    ex_file_path = join(ex_dir_path, exp_file_name)
-
-    if exists(ex_file_path):
-        exp_file = ExpFile(ex_file_path)
-        for dependency in exp_file.dependency:
-            if not storage.exist_experiment(dependency):
-                recurcive_uploder(dependency, results_dir, storage, executor)
+    upload_experiments([ex_name], results_dir, storage)
 
 
 def upload_all(ex_names_to_upload: list[str], results_dir: str, storage: Storage):
-    with ThreadPoolExecutor(max_workers=1) as executor:
-        for ex_name in ex_names_to_upload:
-            executor.submit(upload, ex_name, results_dir, storage)
-
+    scheduler = TransferScheduler(storage, lambda e: get_local_size(e, results_dir))
+    scheduler.run(lambda e: upload(e, results_dir, storage), ex_names_to_upload)
 
-def unzip_file(zip_path, extract_to):
-    with zipfile.ZipFile(zip_path, "r") as zip_ref:
-        zip_ref.extractall(extract_to)
 
+def download(ex_name: str, results_dir: str, storage: Storage, select=None):
+    # select(path) chooses the files to download, see utils.FileSelector.
+    # Such experiments are recorded as partial.
+    ex_dir = join(results_dir, ex_name)
+    if select is not None and exists(ex_dir) and not is_partial(results_dir, ex_name):
+        print(f"⏭️  {ex_name} has already been downloaded completely")
+        return
 
-def download(ex_name: str, results_dir: str, storage: Storage):
     print(f"🗂️ Downloading: [bold]{ex_name}[/bold]")
 
-    with tempfile.TemporaryDirectory() as temp_dir:
-        storage.download_experiment(join(temp_dir, ex_name + ".zip"))
-        ex_dir = join(results_dir, ex_name)
-        makedirs(ex_dir, exist_ok=True)
-        unzip_file(join(temp_dir, f"{ex_name}.zip"), ex_dir)
-
-
-def download_with_dependency(ex_name: str, results_dir: str, storage: Storage):
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        recurcive_downloader(ex_name, results_dir, storage, executor)
+    # Extract into a staging dir next to the results so that an interrupted
+    # download never leaves a half-populated experiment dir behind
+    staging_root = join(get_state_dir(results_dir), "staging")
+    makedirs(staging_root, exist_ok=True)
+    staging_dir = tempfile.mkdtemp(dir=staging_root, prefix=f"{ex_name}.")
+    try:
+        with metrics.phase("download", target=ex_name) as phase:
+            chunk_store = ChunkStore(storage)
+            if storage.exist_experiment_dir(ex_name):
+                storage.download_experiment_dir(ex_name, staging_dir, select)
+            elif chunk_store.is_chunked(ex_name):
+                chunk_store.pull(ex_name, staging_dir, select)
+            elif select is not None:
+                download_zip_members(ex_name, staging_dir, storage, select)
+            else:
+                download_zip(ex_name, staging_dir, storage)
+            if phase.enabled:
+                files, size = metrics.tree_stats(staging_dir)
+                phase.add(bytes=size, files=files)
+            move_into_place(staging_dir, ex_dir)
+            if select is None:
+                unmark_partial(results_dir, ex_name)
+                record_synced(results_dir, ex_name, storage)
+            else:
+                mark_partial(results_dir, ex_name, select)
+    finally:
+        if exists(staging_dir):
+            shutil.rmtree(staging_dir)
+
+
+def download_zip(ex_name: str, extract_to: str, storage: Storage):
+    entry = archive_cache_entry(ex_name, storage)
+    if entry is not None:
+        zip_path = cache.archive_cache.get(*entry)
+        if zip_path is not None:
+            print("  ♻️ Extracting the cached archive")
+            with metrics.phase("archive.unzip", target=ex_name):
+                unzip_file(zip_path, extract_to)
+            return
+
+    if storage.use_sliced_download(ex_name):
+        download_zip_file(ex_name, extract_to, storage, entry)
+        return
 
+    try:
+        # includes the time waiting for the download
+        with metrics.phase("archive.extract_stream", target=ex_name):
+            chunks = storage.download_experiment_stream(ex_name)
+            if entry is None:
+                extract_zip_stream(chunks, extract_to)
+            else:
+                # keep a copy of the archive while extracting it
+                def write(f):
+                    teed = _tee(chunks, f)
+                    extract_zip_stream(teed, extract_to)
+                    for _ in teed:
+                        pass
+
+                cache.archive_cache.put(*entry, write)
+        return
+    except UnsupportedStreamError:
+        pass
+
+    # The archive needs its central directory, e.g. it was not written by
+    # resutil. Download it as a whole.
+    shutil.rmtree(extract_to)
+    makedirs(extract_to)
+    with tempfile.TemporaryDirectory(dir=dirname(extract_to)) as temp_dir:
+        zip_path = join(temp_dir, f"{ex_name}.zip")
+        with open(zip_path, "wb") as f:
+            for chunk in storage.download_experiment_stream(ex_name):
+                f.write(chunk)
+        zip_path = cache_zip(zip_path, entry)
+        with metrics.phase("archive.unzip", target=ex_name):
+            unzip_file(zip_path, extract_to)
+
+
+def archive_cache_entry(ex_name: str, storage: Storage):
+    # (key, validator) of the archive in the archive cache, None if it is
+    # not to be cached
+    if cache.archive_cache is None or not storage.cache_archives:
+        return None
+    metadata = storage.list_experiments().get(ex_name) or {}
+    validator = archive_validator(metadata)
+    if not validator or metadata.get("size") is None:
+        return None
+    max_entry_bytes = cache.archive_cache.max_entry_bytes
+    if max_entry_bytes is not None and metadata["size"] > max_entry_bytes:
+        # not worth writing a copy of the archive while extracting it
+        return None
+    return cache_key(storage, f"{ex_name}.zip"), validator
+
+
+def cache_zip(zip_path: str, entry) -> str:
+    # Moves the downloaded archive into the archive cache
+    if entry is None:
+        return zip_path
+    return cache.archive_cache.put_path(
+        *entry, lambda path: shutil.move(zip_path, path)
+    )
+
+
+def _tee(chunks, f):
+    for chunk in chunks:
+        f.write(chunk)
+        yield chunk
+
+
+def download_zip_members(ex_name: str, extract_to: str, storage: Storage, select):
+    try:
+        size = storage.experiment_zip_size(ex_name)
+    except NotImplementedError:
+        # no random access, skip the other members while streaming
+        with metrics.phase("archive.extract_stream", target=ex_name):
+            extract_zip_stream(
+                storage.download_experiment_stream(ex_name), extract_to, select
+            )
+        return
 
-def recurcive_downloader(ex_name: str, results_dir: str, storage: Storage, executor):
-    download(ex_name, results_dir, storage)
+    with metrics.phase("archive.extract_members", target=ex_name):
+        fileobj = RangedFile(
+            size,
+            lambda offset, length: storage.read_experiment_zip(ex_name, offset, length),
+        )
+        extract_zip_members(fileobj, extract_to, select)
+
+
+def download_zip_file(ex_name: str, extract_to: str, storage: Storage, entry=None):
+    with tempfile.TemporaryDirectory(dir=dirname(extract_to)) as temp_dir:
+        zip_path = join(temp_dir, f"{ex_name}.zip")
+        storage.download_experiment(zip_path)
+        zip_path = cache_zip(zip_path, entry)
+        with metrics.phase("archive.unzip", target=ex_name):
+            unzip_file(zip_path, extract_to)
+
+
+def move_into_place(staging_dir: str, ex_dir: str):
+    if not exists(ex_dir):
+        os.rename(staging_dir, ex_dir)
+        return
+
+    # Merge into the existing experiment dir file by file
+    for root, dirs, files in os.walk(staging_dir):
+        dst_root = join(ex_dir, os.path.relpath(root, staging_dir))
+        makedirs(dst_root, exist_ok=True)
+        for file in files:
+            os.replace(join(root, file), join(dst_root, file))
+
+
+def download_experiments(
+    ex_names: list[str],
+    results_dir: str,
+    storage: Storage,
+    dependency: bool = True,
+    dry_run: bool = False,
+    select=None,
+):
+    with metrics.phase("plan", direction="download"):
+        planner = plan_download(ex_names, results_dir, storage, dependency)
+    if dry_run:
+        print_plan(planner.plan)
+        return
+    planner.execute(
+        lambda e: download(e, results_dir, storage, select),
+        TransferScheduler(storage, planner.plan.sizes.get),
+    )
 
-    ex_file_path = join(results_dir, ex_name, exp_file_name)
 
-    if exists(ex_file_path):
-        exp_file = ExpFile(ex_file_path)
-        for d in exp_file.dependency:
-            if not exists(join(results_dir, d)):
-                executor.submit(recurcive_downloader, d, results_dir, storage, executor)
+def download_with_dependency(ex_name: str, results_dir: str, storage: Storage):
+    download_experiments([ex_name], results_dir, storage)
 
 
-def download_all(ex_names_to_download: list[str], results_dir: str, storage: Storage):
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        for ex_name in ex_names_to_download:
-            executor.submit(download, ex_name, results_dir, storage)
+def download_all(
+    ex_names_to_download: list[str], results_dir: str, storage: Storage, select=None
+):
+    remote_experiments = storage.list_experiments()
+    scheduler = TransferScheduler(
+        storage, lambda e: remote_experiments.get(e, {}).get("size")
+    )
+    scheduler.run(
+        lambda e: download(e, results_dir, storage, select), ex_names_to_download
+    )
 
 
 def remove_local(ex_names: list[str], results_dir: str):
@@ -137,6 +377,7 @@ def remove_local(ex_names: list[str], results_dir: str):
         if exists(path):
             print(f"🗑️ Removing (local): [bold]{ex_name}[/bold]")
             shutil.rmtree(path)
+            unmark_partial(results_dir, ex_name)
         else:
             print(f"⚠️ {ex_name} does not exist in the local directory.")
 
@@ -152,13 +393,5 @@ def remove_remote(ex_names: list[str], storage: Storage):
 
 
 def get_past_comments(results_dir: str):
-    ex_dir_names = get_ex_dir_names(results_dir)
-    sorted_ex_dir_names = sorted(ex_dir_names, reverse=True)
-
-    comments = []
-    for ex in sorted_ex_dir_names:
-        item = ex.split("_")
-        if len(item) == 3:
-            comments.append(item[2])
-
-    return list(set(comments))
+    # newest first
+    return LocalIndex(results_dir).comments()
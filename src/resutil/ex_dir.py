@@ -1,12 +1,50 @@
 from datetime import datetime
+import json
 import os
 import shutil
-from glob import glob
-from os.path import basename, normpath, join
+from os.path import join
 
 
 from .utils import to_base26, parse_result_dirs
 
+# Hidden dir in the results dir for resutil's own state. get_ex_dir_names
+# does not list it, nor any other dot dir.
+STATE_DIR_NAME = ".resutil"
+
+
+def get_state_dir(results_dir):
+    return join(results_dir, STATE_DIR_NAME)
+
+
+# Experiments pulled with --include/--exclude are recorded here. They are
+# not complete and are treated as not downloaded.
+
+
+def get_partial_path(results_dir, ex_name):
+    return join(get_state_dir(results_dir), "partial", f"{ex_name}.json")
+
+
+def is_partial(results_dir, ex_name):
+    return os.path.exists(get_partial_path(results_dir, ex_name))
+
+
+def mark_partial(results_dir, ex_name, selector):
+    path = get_partial_path(results_dir, ex_name)
+    selections = []
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            selections = json.load(f)["selections"]
+    selections.append({"include": selector.include, "exclude": selector.exclude})
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"selections": selections}, f)
+
+
+def unmark_partial(results_dir, ex_name):
+    path = get_partial_path(results_dir, ex_name)
+    if os.path.exists(path):
+        os.remove(path)
+
 
 def create_ex_dir(now, comment, results_dir):
     base_time = datetime(2024, 1, 1, 0, 0, 0, 0)
@@ -38,35 +76,41 @@ def change_comment(results_dir, ex_name, new_comment):
     new_ex_name = f"{ex_name.split('_')[0]}_{ex_name.split('_')[1]}_{new_comment}"
     new_ex_dir_path = os.path.join(results_dir, new_ex_name)
     os.rename(ex_dir_path, new_ex_dir_path)
+    if is_partial(results_dir, ex_name):
+        os.rename(
+            get_partial_path(results_dir, ex_name),
+            get_partial_path(results_dir, new_ex_name),
+        )
     return new_ex_name
 
 
 def get_ex_dir_names(results_dir):
-    ex_dir_paths = glob(join(results_dir + "/*/"))
-    ex_dir_names = [
-        basename(normpath(p)) for p in ex_dir_paths if basename(normpath(p)) != "_debug"
-    ]
-    return ex_dir_names
+    # local_index imports this module
+    from .local_index import LocalIndex
+
+    return LocalIndex(results_dir).names()
 
 
 def find_unuploaded_ex_dirs(results_dir_path, storage):
-    remote_ex_dir_names = storage.get_all_experiment_names()
-    local_ex_dir_names = get_ex_dir_names(results_dir_path)
-    ex_dir_names_to_upload = []
-    for local_ex_dir_name in local_ex_dir_names:
-        if local_ex_dir_name not in remote_ex_dir_names:
-            ex_dir_names_to_upload.append(local_ex_dir_name)
-    return ex_dir_names_to_upload
+    remote_ex_dir_names = set(storage.get_all_experiment_names())
+    return [
+        name
+        for name in get_ex_dir_names(results_dir_path)
+        if name not in remote_ex_dir_names
+    ]
 
 
 def find_undownloaded_ex_dirs(results_dir_path, storage):
-    remote_ex_dir_names = storage.get_all_experiment_names()
-    local_ex_dir_names = get_ex_dir_names(results_dir_path)
-    ex_dir_names_to_download = []
-    for remote_ex_dir_name in remote_ex_dir_names:
-        if remote_ex_dir_name not in local_ex_dir_names:
-            ex_dir_names_to_download.append(remote_ex_dir_name)
-    return ex_dir_names_to_download
+    local_ex_dir_names = {
+        name
+        for name in get_ex_dir_names(results_dir_path)
+        if not is_partial(results_dir_path, name)
+    }
+    return [
+        name
+        for name in storage.get_all_experiment_names()
+        if name not in local_ex_dir_names
+    ]
 
 
 def delete_ex_dir(ex_dir_path):
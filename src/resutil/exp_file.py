@@ -13,3 +13,4 @@ class ExpFile:
             raise FileNotFoundError(f"experiment file {exp_file_path} does not exist.")
 
         self.dependency = conf["dependency"]
+        self.git: dict = conf.get("git") or {}
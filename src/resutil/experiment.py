@@ -0,0 +1,259 @@
+from typing import Optional, Union
+import io
+import os
+import posixpath
+import shutil
+import tempfile
+import threading
+import zipfile
+
+from .archive import RangedFile, STREAM_CHUNK_SIZE
+from . import cache
+from .chunkstore import ChunkStore
+from .cache import FileCache, cache_key, default_cache_dir, DEFAULT_CACHE_BYTES
+from .core import initialize
+from .storage import Storage
+
+
+class _ExperimentFiles:
+    # Reading helpers on top of path(), shared by the experiment views
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        pass
+
+    def _normalize(self, path: str) -> str:
+        return posixpath.normpath("/" + path.replace("\\", "/")).lstrip("/")
+
+    def path(self, path: str) -> str:
+        raise NotImplementedError()
+
+    def open(self, path: str, mode: str = "rb", encoding: Optional[str] = None):
+        if mode not in ("r", "rb", "rt"):
+            raise ValueError("experiments are read-only")
+        f = self._open_binary(path)
+        if mode == "rb":
+            return f
+        return io.TextIOWrapper(f, encoding=encoding or "utf-8")
+
+    def _open_binary(self, path: str):
+        return open(self.path(path), "rb")
+
+    def read_bytes(self, path: str) -> bytes:
+        with self.open(path, "rb") as f:
+            return f.read()
+
+    def read_text(self, path: str, encoding: str = "utf-8") -> str:
+        return self.read_bytes(path).decode(encoding)
+
+
+class RemoteExperiment(_ExperimentFiles):
+    """Read-only, lazy view of a remote experiment.
+
+    Only the central directory of `<ex_name>.zip` is read when opening.
+    Members are fetched with ranged reads when they are first accessed and
+    kept uncompressed in `cache`, so `path()` can be passed to anything that
+    takes a file name, e.g. `numpy.load(exp.path("x.npy"), mmap_mode="r")`.
+    Without a cache, members are read from the storage every time they are
+    opened, and `path()` extracts them to a temporary directory that is
+    removed by `close()`. Paths use "/" separators and are relative to the
+    experiment dir.
+    """
+
+    def __init__(self, ex_name: str, storage: Storage, file_cache: Optional[FileCache]):
+        self.ex_name = ex_name
+        self.storage = storage
+        self.cache = file_cache
+        self.lock = threading.Lock()
+        self._tmp_dir = None
+        size = storage.experiment_zip_size(ex_name)
+        self._file = RangedFile(
+            size,
+            lambda offset, length: storage.read_experiment_zip(ex_name, offset, length),
+        )
+        self._zip = zipfile.ZipFile(self._file)
+        self._infos = {}
+        self._dirs = {""}
+        for info in self._zip.infolist():
+            name = info.filename.rstrip("/")
+            if not info.is_dir():
+                self._infos[name] = info
+            parent = posixpath.dirname(name) if not info.is_dir() else name
+            while parent and parent not in self._dirs:
+                self._dirs.add(parent)
+                parent = posixpath.dirname(parent)
+        # members are fetched up to the next one
+        offsets = sorted(info.header_offset for info in self._zip.infolist())
+        self._ends = dict(zip(offsets, offsets[1:] + [self._zip.start_dir]))
+
+    def close(self):
+        self._zip.close()
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            self._tmp_dir = None
+
+    def __repr__(self):
+        return f"RemoteExperiment({self.ex_name!r})"
+
+    def _info(self, path: str) -> zipfile.ZipInfo:
+        info = self._infos.get(self._normalize(path))
+        if info is None:
+            raise FileNotFoundError(f"{path} does not exist in {self.ex_name}")
+        return info
+
+    def exists(self, path: str) -> bool:
+        path = self._normalize(path)
+        return path in self._infos or path in self._dirs
+
+    def is_dir(self, path: str) -> bool:
+        return self._normalize(path) in self._dirs
+
+    def listdir(self, path: str = "") -> list[str]:
+        path = self._normalize(path)
+        if path not in self._dirs:
+            raise FileNotFoundError(f"{path} is not a directory in {self.ex_name}")
+        names = set()
+        for name in list(self._infos) + list(self._dirs):
+            if name and posixpath.dirname(name) == path:
+                names.add(posixpath.basename(name))
+        return sorted(names)
+
+    def walk(self):
+        # like os.walk, with paths relative to the experiment dir
+        for path in sorted(self._dirs):
+            names = self.listdir(path)
+            dirs = [n for n in names if posixpath.join(path, n) in self._dirs]
+            files = [n for n in names if posixpath.join(path, n) in self._infos]
+            yield path, dirs, files
+
+    def size(self, path: str) -> int:
+        return self._info(path).file_size
+
+    def path(self, path: str) -> str:
+        """Local path of the member, fetched into the cache if needed."""
+        info = self._info(path)
+        if self.cache is None:
+            return self._extract(info)
+        key = cache_key(self.storage, self.ex_name, info.filename)
+        validator = {"size": info.file_size, "crc": info.CRC}
+        cached = self.cache.get(key, validator)
+        if cached is not None:
+            return cached
+        return self.cache.put(key, validator, lambda f: self._write(info, f))
+
+    def _open_binary(self, path: str):
+        if self.cache is not None:
+            return super()._open_binary(path)
+        f = io.BytesIO()
+        self._write(self._info(path), f)
+        f.seek(0)
+        return f
+
+    def _write(self, info: zipfile.ZipInfo, f):
+        with self.lock:
+            self._file.read_ahead_limit = self._ends[info.header_offset]
+            with self._zip.open(info) as member:
+                shutil.copyfileobj(member, f, STREAM_CHUNK_SIZE)
+
+    def _extract(self, info: zipfile.ZipInfo) -> str:
+        with self.lock:
+            if self._tmp_dir is None:
+                self._tmp_dir = tempfile.mkdtemp(prefix="resutil-")
+            local_path = os.path.join(self._tmp_dir, *info.filename.split("/"))
+        if not os.path.exists(local_path):
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            tmp_path = f"{local_path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                self._write(info, f)
+            os.replace(tmp_path, local_path)
+        return local_path
+
+
+class DirectoryExperiment(_ExperimentFiles):
+    """Read-only view of an experiment stored as a directory ("directory"
+    format of LocalStorage), with the same methods as RemoteExperiment.
+
+    Files are read in place, `path()` returns their path in the storage.
+    """
+
+    def __init__(self, ex_name: str, ex_dir: str):
+        self.ex_name = ex_name
+        self.ex_dir = ex_dir
+
+    def __repr__(self):
+        return f"DirectoryExperiment({self.ex_name!r})"
+
+    def _full_path(self, path: str) -> str:
+        path = self._normalize(path)
+        return os.path.join(self.ex_dir, *path.split("/")) if path else self.ex_dir
+
+    def exists(self, path: str) -> bool:
+        return os.path.exists(self._full_path(path))
+
+    def is_dir(self, path: str) -> bool:
+        return os.path.isdir(self._full_path(path))
+
+    def listdir(self, path: str = "") -> list[str]:
+        full_path = self._full_path(path)
+        if not os.path.isdir(full_path):
+            raise FileNotFoundError(f"{path} is not a directory in {self.ex_name}")
+        return sorted(os.listdir(full_path))
+
+    def walk(self):
+        for root, dirs, files in os.walk(self.ex_dir):
+            dirs.sort()
+            path = os.path.relpath(root, self.ex_dir).replace(os.sep, "/")
+            yield "" if path == "." else path, dirs, sorted(files)
+
+    def size(self, path: str) -> int:
+        return os.path.getsize(self.path(path))
+
+    def path(self, path: str) -> str:
+        full_path = self._full_path(path)
+        if not os.path.isfile(full_path):
+            raise FileNotFoundError(f"{path} does not exist in {self.ex_name}")
+        return full_path
+
+
+def open_experiment(
+    ex_name: str,
+    storage: Optional[Storage] = None,
+    cache_dir: Optional[str] = None,
+    max_cache_bytes: Optional[int] = None,
+) -> Union[RemoteExperiment, DirectoryExperiment]:
+    """Open a remote experiment for reading without pulling it.
+
+    `storage` defaults to the one configured in resutil-conf.yaml. Files are
+    cached in the cache shared with pull unless `cache_dir` or
+    `max_cache_bytes` is given. If that cache is disabled, or not configured
+    because `storage` is given, nothing is cached. Experiments in the chunked
+    format can not be opened, they have to be pulled.
+    """
+    if storage is None:
+        _, storage = initialize()
+    ex_format = storage.list_experiments().get(ex_name, {}).get("format")
+    if ex_format is None:
+        # listings without formats, look the experiment up
+        if storage.exist_experiment_dir(ex_name):
+            ex_format = "directory"
+        elif ChunkStore(storage).is_chunked(ex_name):
+            ex_format = "chunked"
+    if ex_format == "directory":
+        return DirectoryExperiment(ex_name, storage.experiment_dir_path(ex_name))
+    if ex_format == "chunked":
+        raise ValueError(
+            f"{ex_name} is stored in the chunked format, which open_experiment "
+            "does not support. Pull it instead."
+        )
+    file_cache = cache.archive_cache
+    if cache_dir is not None or max_cache_bytes is not None:
+        file_cache = FileCache(
+            cache_dir or default_cache_dir(),
+            DEFAULT_CACHE_BYTES if max_cache_bytes is None else max_cache_bytes,
+        )
+    return RemoteExperiment(ex_name, storage, file_cache)
@@ -1,48 +1,250 @@
-from shutil import copy
+from dataclasses import dataclass, field
+from os.path import join, exists, abspath, dirname
 from pathlib import Path
+from shutil import copy, copytree, rmtree
+from typing import Optional
+import os
+import subprocess
+import tarfile
 
-from git import Repo, InvalidGitRepositoryError
+from rich import print
+
+from .exp_file import ExpFile
+from .utils import EX_YAML_NAME
+
+# Snapshots of the code in experiment dirs: changed files are either copied
+# to COPY_DIR_NAME ("copy"), or stored as a patch against the commit
+# ("patch") with only the untracked files copied
+COPY_DIR_NAME = "uncommited_files"
+PATCH_FILE_NAME = "uncommited_files.patch"
+
+
+@dataclass
+class GitState:
+    commit: Optional[str]
+    # changed in the working tree, staged, and not tracked
+    modified: list[str] = field(default_factory=list)
+    staged: list[str] = field(default_factory=list)
+    untracked: list[str] = field(default_factory=list)
+    # False if `git status` did not finish within the time budget
+    complete: bool = True
+
+    @property
+    def uncommitted(self) -> list[str]:
+        # changed files that exist in the working tree, once each
+        return list(dict.fromkeys(self.modified + self.staged))
+
+
+def parse_status(output: bytes) -> GitState:
+    """Parse `git status --porcelain=v2 -z --branch`.
+
+    Paths are relative to the root of the repository. Deleted files are
+    left out since there is nothing to store.
+    """
+    state = GitState(commit=None)
+    fields = output.split(b"\0")
+    i = 0
+    while i < len(fields):
+        entry = fields[i].decode("utf-8", "surrogateescape")
+        i += 1
+        if entry.startswith("# branch.oid "):
+            oid = entry[len("# branch.oid ") :]
+            state.commit = None if oid == "(initial)" else oid
+        elif entry[:2] in ("1 ", "2 ", "u "):
+            kind = entry[0]
+            # "1 XY sub mH mI mW hH hI path", renames and copies ("2") have
+            # a score before the path and the original path in the next field
+            # and unmerged entries ("u") three more modes and hashes
+            n_fields = {"1": 8, "2": 9, "u": 10}[kind]
+            parts = entry.split(" ", n_fields)
+            staged, changed = parts[1]
+            path = parts[n_fields]
+            if kind == "2":
+                i += 1
+            if kind == "u":
+                state.modified.append(path)
+                continue
+            if changed not in ".D":
+                state.modified.append(path)
+            if staged not in ".D" and changed != "D":
+                state.staged.append(path)
+        elif entry.startswith("? "):
+            state.untracked.append(entry[2:])
+    return state
 
 
 class GitRepo:
     def __init__(self):
         # search repogitory recursively to root
+        self.working_tree_dir = self._git("rev-parse", "--show-toplevel")
+        self.uncommitd_file_path_list = []
+
+    def _git(self, *args) -> Optional[str]:
         try:
-            self.repo = Repo("./", search_parent_directories=True)
-        except InvalidGitRepositoryError:
-            self.repo = None
+            result = subprocess.run(["git", *args], capture_output=True, text=True)
+        except OSError:
+            # git is not installed
+            return None
+        if result.returncode != 0:
+            return None
+        return result.stdout.strip()
 
     def exist(self):
-        return self.repo is not None
+        return self.working_tree_dir is not None
+
+    def get_state(
+        self, untracked: bool = False, timeout: Optional[float] = None
+    ) -> GitState:
+        """Commit and changed files from a single `git status` call.
+
+        With `untracked`, files that are neither tracked nor ignored are
+        listed as well. If `git status` takes longer than `timeout` seconds,
+        only the commit is returned.
+        """
+        args = ["git", "status", "--porcelain=v2", "-z", "--branch"]
+        args.append("--untracked-files=all" if untracked else "--untracked-files=no")
+        try:
+            result = subprocess.run(
+                args,
+                cwd=self.working_tree_dir,
+                capture_output=True,
+                timeout=timeout,
+                check=True,
+            )
+        except (OSError, subprocess.SubprocessError) as e:
+            if isinstance(e, subprocess.TimeoutExpired):
+                print(f"⚠️ git status took more than {timeout} s.")
+            else:
+                print(f"⚠️ git status failed: {e}")
+            print("  Changed files are not stored.")
+            commit = self._git("rev-parse", "--verify", "-q", "HEAD")
+            state = GitState(commit=commit, complete=False)
+        else:
+            state = parse_status(result.stdout)
+        self.uncommitd_file_path_list = state.uncommitted + state.untracked
+        return state
 
     def get_git_info(self):
-        # Get the most recent commit
-        latest_commit = self.repo.head.commit.hexsha
-
-        # Get modified files
-
-        modified_files = [
-            item.a_path
-            for item in self.repo.index.diff(None)
-            if not item.change_type == "D"
-        ]
-        staged_files = [
-            item.a_path
-            for item in self.repo.index.diff("HEAD")
-            if not item.change_type == "A"
-        ]
-
-        self.uncommitd_file_path_list = [*modified_files, *staged_files]
-
-        return latest_commit, self.uncommitd_file_path_list
-
-    def store_uncomited_to(self, dir_path):
-        # copy files
-        # cd to the root of the repository
-        # get the root of the repository
-        working_tree_dir = self.repo.working_tree_dir
-        for uncommitd_file_path in self.uncommitd_file_path_list:
-            src = Path(working_tree_dir, uncommitd_file_path)
+        state = self.get_state()
+        return state.commit, state.uncommitted
+
+    def store_uncomited_to(self, dir_path, paths: Optional[list[str]] = None):
+        # copy files, paths are relative to the root of the repository
+        if paths is None:
+            paths = self.uncommitd_file_path_list
+        for uncommitd_file_path in paths:
+            src = Path(self.working_tree_dir, uncommitd_file_path)
             dst = Path(dir_path, uncommitd_file_path)
             dst.parent.mkdir(parents=True, exist_ok=True)
             copy(src, dst)
+
+    def store_patch_to(self, patch_path, timeout: Optional[float] = None) -> bool:
+        """Write the changes since HEAD as a binary-safe patch.
+
+        Returns False if git diff failed or took longer than `timeout`.
+        """
+        args = ["git", "diff", "HEAD", "--binary", "--full-index"]
+        args += ["--no-color", "--no-ext-diff", "--no-textconv"]
+        try:
+            with open(patch_path, "wb") as f:
+                subprocess.run(
+                    args,
+                    cwd=self.working_tree_dir,
+                    stdout=f,
+                    stderr=subprocess.PIPE,
+                    timeout=timeout,
+                    check=True,
+                )
+        except (OSError, subprocess.SubprocessError):
+            if exists(patch_path):
+                os.remove(patch_path)
+            return False
+        return True
+
+    def store_snapshot(
+        self,
+        ex_dir_path,
+        state: GitState,
+        mode: str = "copy",
+        timeout: Optional[float] = None,
+    ) -> str:
+        """Store the changed files of `state` in the experiment dir.
+
+        Returns the mode used: "patch" falls back to "copy" if the patch can
+        not be created, e.g. before the first commit.
+        """
+        if mode == "patch" and state.complete and state.commit is not None:
+            if self.store_patch_to(join(ex_dir_path, PATCH_FILE_NAME), timeout):
+                self.store_uncomited_to(
+                    join(ex_dir_path, COPY_DIR_NAME), state.untracked
+                )
+                return "patch"
+            print("⚠️ git diff failed, changed files are copied instead.")
+        self.store_uncomited_to(join(ex_dir_path, COPY_DIR_NAME))
+        return "copy"
+
+
+def restore_code(ex_dir_path, dst_dir):
+    """Rebuild the working tree an experiment was run with in `dst_dir`.
+
+    The commit is exported from the current repository, the patch is applied
+    to it and the copied files are put on top.
+    """
+    git_info = ExpFile(join(ex_dir_path, EX_YAML_NAME)).git
+    commit = git_info.get("commit_hash")
+    if commit is None:
+        raise ValueError(f"{ex_dir_path} has no commit recorded")
+    check = subprocess.run(
+        ["git", "cat-file", "-e", f"{commit}^{{commit}}"], capture_output=True
+    )
+    if check.returncode != 0:
+        raise ValueError(f"Commit {commit} is not in this repository, fetch it first")
+    if exists(dst_dir) and os.listdir(dst_dir):
+        raise FileExistsError(f"{dst_dir} is not empty")
+    created = not exists(dst_dir)
+    os.makedirs(dst_dir, exist_ok=True)
+    try:
+        _restore_code_to(ex_dir_path, dst_dir, commit)
+    except BaseException:
+        # no half restored tree is left behind
+        rmtree(dst_dir)
+        if not created:
+            os.makedirs(dst_dir)
+        raise
+    return commit
+
+
+def _restore_code_to(ex_dir_path, dst_dir, commit):
+    archive = subprocess.Popen(
+        ["git", "archive", "--format=tar", commit],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    read_error = None
+    try:
+        with tarfile.open(fileobj=archive.stdout, mode="r|") as tar:
+            tar.extractall(dst_dir)
+    except tarfile.ReadError as e:
+        # reported with the error of git, which explains it
+        read_error = e
+    _, stderr = archive.communicate()
+    if archive.returncode != 0:
+        raise RuntimeError(f"git archive {commit} failed: {stderr.decode().strip()}")
+    if read_error is not None:
+        raise RuntimeError(f"git archive {commit} returned no archive: {read_error}")
+
+    patch_path = join(ex_dir_path, PATCH_FILE_NAME)
+    if exists(patch_path) and os.path.getsize(patch_path) > 0:
+        # applied as to plain files, not to the repository around dst_dir
+        env = dict(os.environ, GIT_CEILING_DIRECTORIES=dirname(abspath(dst_dir)))
+        subprocess.run(
+            ["git", "apply", "--binary", "--whitespace=nowarn", abspath(patch_path)],
+            cwd=dst_dir,
+            env=env,
+            check=True,
+            capture_output=True,
+        )
+
+    copy_dir = join(ex_dir_path, COPY_DIR_NAME)
+    if exists(copy_dir):
+        copytree(copy_dir, dst_dir, dirs_exist_ok=True)
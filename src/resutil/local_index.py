@@ -0,0 +1,194 @@
+from contextlib import closing
+from dataclasses import dataclass
+from os.path import join
+from typing import Optional
+import json
+import os
+import sqlite3
+
+import yaml
+
+from .ex_dir import get_state_dir
+from .utils import EX_YAML_NAME
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+INDEX_FILE_NAME = "index.sqlite3"
+# Bumped when the table changes, the index is rebuilt then
+SCHEMA_VERSION = 2
+
+COLUMNS = (
+    "name",
+    "dir_mtime_ns",
+    "yaml_mtime_ns",
+    "timestamp",
+    "comment",
+    "dependencies",
+)
+
+
+@dataclass
+class LocalExperiment:
+    name: str
+    timestamp: Optional[str]
+    comment: str
+    # entries of `dependency` in resutil-exp.yaml, None without the file
+    dependencies: Optional[list[str]]
+
+
+def _mtime_ns(path) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _read_experiment(ex_dir_path, name, dir_mtime_ns, yaml_mtime_ns) -> tuple:
+    # a row of the experiments table
+    parts = name.split("_", 2)
+    timestamp = parts[1] if len(parts) > 1 else None
+    comment = parts[2] if len(parts) > 2 else ""
+
+    dependencies = None
+    if yaml_mtime_ns is not None:
+        try:
+            with open(join(ex_dir_path, EX_YAML_NAME), "r") as f:
+                exp = yaml.load(f, Loader=SafeLoader) or {}
+            dependencies = json.dumps([str(d) for d in exp.get("dependency") or []])
+        except (OSError, yaml.YAMLError):
+            pass
+    return (name, dir_mtime_ns, yaml_mtime_ns, timestamp, comment, dependencies)
+
+
+class LocalIndex:
+    """Metadata of the local experiments, kept in SQLite under .resutil.
+
+    Experiments are read again only when the mtime of their dir or of their
+    resutil-exp.yaml changed since they were indexed, so listing thousands
+    of experiments takes one directory scan. If the index can not be
+    written, e.g. in a read-only results dir, experiments are read directly.
+    """
+
+    def __init__(self, results_dir: str):
+        self.results_dir = results_dir
+        self.path = join(get_state_dir(results_dir), INDEX_FILE_NAME)
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(get_state_dir(self.results_dir), exist_ok=True)
+        # several processes of a sweep may refresh the index at once
+        conn = sqlite3.connect(self.path, timeout=30)
+        if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            with conn:
+                conn.execute("DROP TABLE IF EXISTS experiments")
+                conn.execute(
+                    "CREATE TABLE experiments ("
+                    "name TEXT PRIMARY KEY, dir_mtime_ns INTEGER, "
+                    "yaml_mtime_ns INTEGER, timestamp TEXT, comment TEXT, "
+                    "dependencies TEXT)"
+                )
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        return conn
+
+    def _scan(self) -> dict:
+        # {name: (dir path, dir mtime, yaml mtime)} of the experiment dirs
+        dirs = {}
+        try:
+            entries = list(os.scandir(self.results_dir))
+        except FileNotFoundError:
+            return dirs
+        for entry in entries:
+            # the state dir, and the dir of debug runs, are no experiments
+            if entry.name.startswith(".") or entry.name == "_debug":
+                continue
+            try:
+                if not entry.is_dir():
+                    continue
+                dir_mtime_ns = entry.stat().st_mtime_ns
+            except OSError:
+                continue
+            yaml_mtime_ns = _mtime_ns(join(entry.path, EX_YAML_NAME))
+            dirs[entry.name] = (entry.path, dir_mtime_ns, yaml_mtime_ns)
+        return dirs
+
+    def _upsert(self, conn, rows):
+        columns = ", ".join(COLUMNS)
+        updates = ", ".join(f"{c} = excluded.{c}" for c in COLUMNS[1:])
+        conn.executemany(
+            f"INSERT INTO experiments ({columns}) "
+            f"VALUES ({', '.join('?' * len(COLUMNS))}) "
+            f"ON CONFLICT(name) DO UPDATE SET {updates}",
+            rows,
+        )
+
+    def _refresh(self, conn):
+        known = {
+            name: (dir_mtime_ns, yaml_mtime_ns)
+            for name, dir_mtime_ns, yaml_mtime_ns in conn.execute(
+                "SELECT name, dir_mtime_ns, yaml_mtime_ns FROM experiments"
+            )
+        }
+        rows = []
+        for name, (path, dir_mtime_ns, yaml_mtime_ns) in self._scan().items():
+            if known.pop(name, None) != (dir_mtime_ns, yaml_mtime_ns):
+                rows.append(_read_experiment(path, name, dir_mtime_ns, yaml_mtime_ns))
+        with conn:
+            self._upsert(conn, rows)
+            conn.executemany(
+                "DELETE FROM experiments WHERE name = ?", [(n,) for n in known]
+            )
+
+    def experiments(self) -> list[LocalExperiment]:
+        try:
+            with closing(self._connect()) as conn:
+                self._refresh(conn)
+                rows = conn.execute(
+                    f"SELECT {', '.join(COLUMNS)} FROM experiments ORDER BY name"
+                ).fetchall()
+        except (sqlite3.Error, OSError):
+            rows = [
+                _read_experiment(path, name, *mtimes)
+                for name, (path, *mtimes) in sorted(self._scan().items())
+            ]
+        return [_experiment(row) for row in rows]
+
+    def names(self) -> list[str]:
+        return [e.name for e in self.experiments()]
+
+    def comments(self) -> list[str]:
+        # newest first, once each
+        comments = [e.comment for e in reversed(self.experiments()) if e.comment]
+        return list(dict.fromkeys(comments))
+
+    def get(self, ex_name: str) -> Optional[LocalExperiment]:
+        """Metadata of one experiment, only refreshing that experiment."""
+        path = join(self.results_dir, ex_name)
+        dir_mtime_ns = _mtime_ns(path)
+        if dir_mtime_ns is None:
+            return None
+        yaml_mtime_ns = _mtime_ns(join(path, EX_YAML_NAME))
+        try:
+            with closing(self._connect()) as conn:
+                row = conn.execute(
+                    f"SELECT {', '.join(COLUMNS)} FROM experiments WHERE name = ?",
+                    (ex_name,),
+                ).fetchone()
+                if row is None or row[1:3] != (dir_mtime_ns, yaml_mtime_ns):
+                    row = _read_experiment(path, ex_name, dir_mtime_ns, yaml_mtime_ns)
+                    with conn:
+                        self._upsert(conn, [row])
+        except (sqlite3.Error, OSError):
+            row = _read_experiment(path, ex_name, dir_mtime_ns, yaml_mtime_ns)
+        return _experiment(row)
+
+
+def _experiment(row) -> LocalExperiment:
+    name, _, _, timestamp, comment, dependencies = row
+    return LocalExperiment(
+        name=name,
+        timestamp=timestamp,
+        comment=comment or "",
+        dependencies=None if dependencies is None else json.loads(dependencies),
+    )
@@ -8,31 +8,51 @@ import os
 from pathlib import Path
 
 from rich import print
-from prompt_toolkit import prompt
-from prompt_toolkit.completion import WordCompleter
 
 from .utils import user_confirm, parse_result_dirs, verify_comment, EnvArgs
 from .config_file import create_ex_yaml
-from .ex_dir import create_ex_dir, delete_ex_dir, find_unuploaded_ex_dirs
+from .ex_dir import (
+    create_ex_dir,
+    delete_ex_dir,
+    find_unuploaded_ex_dirs,
+    is_partial,
+)
 from .git import GitRepo
+from .checkpoint import Checkpointer, BackgroundUploader
+from . import metrics
 
 from .core import (
     initialize,
     upload,
     upload_all,
     get_past_comments,
-    download,
+    download_experiments,
 )
 
 
 class resutil_args:
-    def __init__(self, ex_dir, checkpoint_callback):
+    def __init__(self, ex_dir, checkpoint_callback, checkpoint_status=None):
         self.ex_dir = ex_dir
         self.checkpoint_callback = checkpoint_callback
+        self.checkpoint_status = checkpoint_status
 
     def save_checkpoint(self):
         self.checkpoint_callback()
 
+    @property
+    def checkpoint_queue_depth(self) -> int:
+        # checkpoints requested but not uploaded yet (async mode only)
+        if self.checkpoint_status is None:
+            return 0
+        return self.checkpoint_status.queue_depth
+
+    @property
+    def last_checkpoint_time(self):
+        # time.time() of the last completed checkpoint upload, or None
+        if self.checkpoint_status is None:
+            return None
+        return self.checkpoint_status.last_upload_time
+
 
 def get_comment(env_args, config):
     if env_args.debug_mode:
@@ -45,6 +65,10 @@ def get_comment(env_args, config):
     elif env_args.comment_env is not None:
         comment = env_args.comment_env
     else:
+        # prompt_toolkit is slow to import and only needed here
+        from prompt_toolkit import prompt
+        from prompt_toolkit.completion import WordCompleter
+
         comments = WordCompleter(get_past_comments(config.results_dir))
         print("")
         while True:
@@ -68,21 +92,27 @@ def get_env_args():
     comment_env = os.environ.get("RESUTIL_COMMENT", None)
     no_remote = os.environ.get("RESUTIL_NO_REMOTE") is not None
     debug_mode = os.environ.get("RESUTIL_DEBUG") is not None
+    async_checkpoint = os.environ.get("RESUTIL_ASYNC_CHECKPOINT") is not None
     env_args = EnvArgs(
         comment_env=comment_env,
         no_interactive=no_interactive,
         no_remote=no_remote,
         debug_mode=debug_mode,
+        async_checkpoint=async_checkpoint,
     )
 
     return env_args
 
 
 # Used as a decorator
-def main(verbose=True):
+def main(verbose=True, async_checkpoint=False, show_metrics=False):
     def main_wrapper(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
+            with metrics.collect(show_metrics or metrics.summary_requested()):
+                return run(*args, **kwargs)
+
+        def run(*args, **kwargs):
             print("")
             print("✨ Runnning your code with [bold]Resutil[/bold]")
             print("")
@@ -108,16 +138,30 @@ def main(verbose=True):
             # check uncommited files
             git_repo = GitRepo()
 
+            capture_untracked = bool(config.git_config.get("untracked", False))
+            snapshot = None
             if git_repo.exist():
-                commit_hash, unstaged_files = git_repo.get_git_info()
-                if len(unstaged_files) > 0:
+                git_state = git_repo.get_state(
+                    untracked=capture_untracked,
+                    timeout=config.git_config.get("timeout"),
+                )
+                commit_hash = git_state.commit
+                unstaged_files = git_state.uncommitted
+                untracked_files = git_state.untracked
+                if len(unstaged_files) + len(untracked_files) > 0:
                     print("🔍 Unstaged files will be stored in the result dir:")
-                    for file in unstaged_files:
+                    for file in unstaged_files + untracked_files:
                         print(f"  - {file}")
-                    git_repo.store_uncomited_to(join(ex_dir_path, "uncommited_files"))
+                    snapshot = git_repo.store_snapshot(
+                        ex_dir_path,
+                        git_state,
+                        config.git_config.get("snapshot", "copy"),
+                        config.git_config.get("timeout"),
+                    )
             else:
                 commit_hash = None
                 unstaged_files = []
+                untracked_files = []
 
             dependencies = parse_result_dirs(sys.argv, config.results_dir)
 
@@ -126,13 +170,15 @@ def main(verbose=True):
                 dependencies,
                 commit_hash=commit_hash,
                 uncommited_files=unstaged_files,
+                untracked_files=untracked_files if capture_untracked else None,
+                snapshot=snapshot,
             )
 
             # Check all dependencies exist
             unexisting_deps = []
             for dep in dependencies:
                 print(dep)
-                if not dep.exists():
+                if not dep.exists() or is_partial(config.results_dir, dep.name):
                     unexisting_deps.append(dep)
             if len(unexisting_deps) > 0:
                 print(
@@ -140,31 +186,65 @@ def main(verbose=True):
                 )
                 for dep in unexisting_deps:
                     print(f"  📁 {dep}")
-                for dep in unexisting_deps:
-                    download(dep.name, config.results_dir, storage)
+                download_experiments(
+                    [dep.name for dep in unexisting_deps],
+                    config.results_dir,
+                    storage,
+                )
                 print("")
 
             # Run the main function
             print("🚀 Running the main function...")
 
-            def checkpoint_callback():
-                print("📁 Uploading the results up to this point...")
-                upload(ex_name, config.results_dir, storage)
+            checkpointer = Checkpointer(ex_name, config.results_dir, storage)
+
+            if async_checkpoint or env_args.async_checkpoint:
+                uploader = BackgroundUploader(checkpointer)
+                checkpoint_status = uploader
+
+                def checkpoint_callback():
+                    print("📁 Queued uploading the results up to this point...")
+                    uploader.request()
+
+            else:
+                uploader = None
+                checkpoint_status = checkpointer
+
+                def checkpoint_callback():
+                    print("📁 Uploading the results up to this point...")
+                    checkpointer.save()
+
+            def run_func():
+                params = resutil_args(
+                    ex_dir_path, checkpoint_callback, checkpoint_status
+                )
+                if uploader is None:
+                    func(params, *args, **kwargs)
+                    return
+                try:
+                    func(params, *args, **kwargs)
+                except BaseException:
+                    # don't start queued checkpoints, the experiment is
+                    # either uploaded as a whole or deleted afterwards
+                    uploader.close(flush=False)
+                    raise
+                # wait for queued checkpoints before the final upload
+                uploader.close()
 
             # if resutil is NOT interactive, run the function and upload the result
             if env_args.no_interactive:
-                func(resutil_args(ex_dir_path, checkpoint_callback), *args, **kwargs)
+                run_func()
                 print("")
                 if not (env_args.no_remote or env_args.debug_mode):
-                    upload(ex_name, config.results_dir, storage)
+                    checkpointer.finalize()
                 return
 
             # if resutil is interactive, ask the user to confirm before running the function
             try:
-                func(resutil_args(ex_dir_path, checkpoint_callback), *args, **kwargs)
+                run_func()
                 print("")
                 if not (env_args.no_remote or env_args.debug_mode):
-                    upload(ex_name, config.results_dir, storage)
+                    checkpointer.finalize()
             except KeyboardInterrupt:
                 print("")
                 if user_confirm(
@@ -174,7 +254,7 @@ def main(verbose=True):
                     delete_ex_dir(ex_dir_path)
                     print(f"🗑️  Deleted [bold]{ex_dir_path}[/bold]")
                 else:
-                    upload(ex_name, config.results_dir, storage)
+                    checkpointer.finalize()
             except Exception as e:
                 print("")
                 if user_confirm(
@@ -184,7 +264,7 @@ def main(verbose=True):
                     delete_ex_dir(ex_dir_path)
                     print(f"🗑️  Deleted [bold]{ex_dir_path}[/bold]")
                 else:
-                    upload(ex_name, config.results_dir, storage)
+                    checkpointer.finalize()
                 print("❌ Please check the error message below:")
                 print("----------------------------------")
                 traceback.print_exception(type(e), e, e.__traceback__)
@@ -0,0 +1,275 @@
+"""Timing and throughput of transfer phases.
+
+Instrumented code wraps each phase in `phase(name, ...)`. Records are only
+built while at least one hook is registered, so instrumentation costs a
+list lookup per phase when metrics are off.
+
+A record is a dict such as:
+
+    {"phase": "storage.put_object", "start": 1720000000.0, "seconds": 0.12,
+     "bytes": 1048576, "files": 0, "bytes_per_second": 8738133.3, "ok": true}
+"""
+
+from os.path import join, getsize
+from typing import Callable, Optional
+import json
+import os
+import threading
+import time
+
+from rich import print
+
+from .utils import format_bytes
+
+METRICS_ENV = "RESUTIL_METRICS"
+METRICS_FILE_ENV = "RESUTIL_METRICS_FILE"
+
+_hooks: list[Callable[[dict], None]] = []
+_lock = threading.Lock()
+
+
+def add_hook(hook: Callable[[dict], None]):
+    """Register `hook`, called with every record. Hooks may be called from
+    worker threads."""
+    with _lock:
+        _hooks.append(hook)
+
+
+def remove_hook(hook: Callable[[dict], None]):
+    with _lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+
+def enabled() -> bool:
+    return len(_hooks) > 0
+
+
+def emit(record: dict):
+    for hook in list(_hooks):
+        hook(record)
+
+
+class Phase:
+    enabled = True
+
+    def __init__(self, name: str, fields: dict):
+        self.name = name
+        self.fields = fields
+        self.bytes = 0
+        self.files = 0
+
+    def add(self, bytes: int = 0, files: int = 0):
+        self.bytes += bytes
+        self.files += files
+
+    def __enter__(self):
+        self.start = time.time()
+        self.perf_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.perf_start
+        emit(
+            {
+                "phase": self.name,
+                "start": self.start,
+                "seconds": seconds,
+                "bytes": self.bytes,
+                "files": self.files,
+                "bytes_per_second": self.bytes / seconds if seconds > 0 else None,
+                "ok": exc_type is None,
+                **self.fields,
+            }
+        )
+        return False
+
+
+class _NullPhase:
+    enabled = False
+
+    def add(self, bytes: int = 0, files: int = 0):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+def phase(name: str, **fields):
+    if not _hooks:
+        return _NULL_PHASE
+    return Phase(name, fields)
+
+
+def tree_stats(path: str) -> tuple[int, int]:
+    # (files, bytes) under `path`
+    files = 0
+    size = 0
+    for root, dirs, names in os.walk(path):
+        for name in names:
+            files += 1
+            size += getsize(join(root, name))
+    return files, size
+
+
+def counting_iter(chunks, phase_name: str, **fields):
+    """Pass `chunks` through, recording their bytes and the time spent
+    producing them (not the time the consumer spends between chunks)."""
+    if not _hooks:
+        yield from chunks
+        return
+    chunks = iter(chunks)
+    start = time.time()
+    seconds = 0.0
+    size = 0
+    ok = False
+    try:
+        while True:
+            t = time.perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                ok = True
+                return
+            finally:
+                seconds += time.perf_counter() - t
+            size += len(chunk)
+            yield chunk
+    finally:
+        emit(
+            {
+                "phase": phase_name,
+                "start": start,
+                "seconds": seconds,
+                "bytes": size,
+                "files": 0,
+                "bytes_per_second": size / seconds if seconds > 0 else None,
+                "ok": ok,
+                **fields,
+            }
+        )
+
+
+class MetricsFile:
+    """Hook appending records as JSON lines to `path`."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def __call__(self, record: dict):
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            with open(self.path, "a") as f:
+                f.write(line)
+
+
+def wall_seconds(intervals: list[tuple[float, float]]) -> float:
+    # time covered by at least one of the (start, end) intervals, so that
+    # concurrent calls are counted once and idle time between calls not at all
+    seconds = 0.0
+    covered_until = None
+    for start, end in sorted(intervals):
+        if covered_until is None or start > covered_until:
+            seconds += end - start
+            covered_until = end
+        elif end > covered_until:
+            seconds += end - covered_until
+            covered_until = end
+    return seconds
+
+
+class Summary:
+    """Hook aggregating records per phase.
+
+    "seconds" is the sum over the calls of a phase, which exceeds the time
+    it took when calls run concurrently, e.g. the parts of an upload.
+    Throughput is computed from the wall clock time covered by the calls.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phases = {}
+
+    def __call__(self, record: dict):
+        with self.lock:
+            total = self.phases.setdefault(
+                record["phase"],
+                {"calls": 0, "seconds": 0.0, "bytes": 0, "files": 0, "intervals": []},
+            )
+            total["calls"] += 1
+            total["seconds"] += record["seconds"]
+            total["bytes"] += record["bytes"]
+            total["files"] += record["files"]
+            total["intervals"].append(
+                (record["start"], record["start"] + record["seconds"])
+            )
+
+    def wall_seconds(self, name: str) -> float:
+        with self.lock:
+            return wall_seconds(self.phases[name]["intervals"])
+
+    def print(self):
+        if not self.phases:
+            return
+        print("📊 Metrics:")
+        for name, total in sorted(self.phases.items()):
+            wall = self.wall_seconds(name)
+            line = f"  {name:36s} {total['calls']:5d} call(s) {total['seconds']:9.3f} s"
+            if wall < total["seconds"] * 0.99:
+                line += f" ({wall:.3f} s wall)"
+            if total["bytes"] > 0:
+                line += f"  {format_bytes(total['bytes']):>10s}"
+                if wall > 0:
+                    line += f"  {format_bytes(total['bytes'] / wall)}/s"
+            if total["files"] > 0:
+                line += f"  {total['files']} file(s)"
+            print(line)
+
+
+_metrics_file: Optional[MetricsFile] = None
+
+
+def configure_from_env():
+    # Writes records to the file named by RESUTIL_METRICS_FILE, if set
+    global _metrics_file
+    path = os.environ.get(METRICS_FILE_ENV)
+    if path is None or (_metrics_file is not None and _metrics_file.path == path):
+        return
+    if _metrics_file is not None:
+        remove_hook(_metrics_file)
+    _metrics_file = MetricsFile(path)
+    add_hook(_metrics_file)
+
+
+def summary_requested() -> bool:
+    return (
+        os.environ.get(METRICS_ENV) is not None
+        or os.environ.get(METRICS_FILE_ENV) is not None
+    )
+
+
+class collect:
+    """Context manager collecting a Summary of the records emitted inside it
+    and printing it at the end. Does nothing unless `enabled`."""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.summary = Summary()
+
+    def __enter__(self) -> Summary:
+        if self.enabled:
+            add_hook(self.summary)
+        return self.summary
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.enabled:
+            remove_hook(self.summary)
+            self.summary.print()
+        return False
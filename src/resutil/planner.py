@@ -0,0 +1,196 @@
+from dataclasses import dataclass, field
+from os.path import join, exists, basename, normpath, getsize
+from typing import Callable, Optional
+import os
+
+from rich import print
+
+from .storage import Storage
+from .scheduler import TransferScheduler
+from .ex_dir import is_partial
+from .local_index import LocalIndex
+from .utils import format_bytes
+
+
+def dependency_name(dependency: str) -> str:
+    # `dependency` entries are either experiment names or paths such as
+    # "results/<ex_name>"
+    return basename(normpath(dependency))
+
+
+def read_local_dependencies(ex_name: str, results_dir: str) -> Optional[list[str]]:
+    experiment = LocalIndex(results_dir).get(ex_name)
+    if experiment is None or experiment.dependencies is None:
+        return None
+    return [dependency_name(d) for d in experiment.dependencies]
+
+
+def get_local_size(ex_name: str, results_dir: str) -> int:
+    size = 0
+    for root, dirs, files in os.walk(join(results_dir, ex_name)):
+        for file in files:
+            size += getsize(join(root, file))
+    return size
+
+
+@dataclass
+class TransferPlan:
+    direction: str
+    # experiments to transfer, dependencies before dependents where known
+    transfers: list[str] = field(default_factory=list)
+    # experiments already present at the destination
+    skipped: list[str] = field(default_factory=list)
+    # dependencies that exist on neither side
+    missing: list[str] = field(default_factory=list)
+    cycles: list[list[str]] = field(default_factory=list)
+    # experiments whose dependencies are only known after downloading them
+    unresolved: list[str] = field(default_factory=list)
+    sizes: dict = field(default_factory=dict)
+
+    @property
+    def total_bytes(self) -> Optional[int]:
+        if any(self.sizes.get(ex_name) is None for ex_name in self.transfers):
+            return None
+        return sum(self.sizes[ex_name] for ex_name in self.transfers)
+
+
+class TransferPlanner:
+    """Resolves the dependency closure of experiments into a TransferPlan.
+
+    Roots are always transferred. Dependencies are transferred when they are
+    missing at the destination, and their own dependencies are followed.
+    Every experiment is planned at most once, so diamond-shaped dependency
+    graphs do not transfer anything twice.
+    """
+
+    def __init__(
+        self,
+        direction: str,
+        read_dependencies: Callable[[str], Optional[list[str]]],
+        exists_at_source: Callable[[str], bool],
+        exists_at_destination: Callable[[str], bool],
+    ):
+        self.plan = TransferPlan(direction)
+        self.read_dependencies = read_dependencies
+        self.exists_at_source = exists_at_source
+        self.exists_at_destination = exists_at_destination
+        self.state = {}  # ex_name -> "visiting" | "done"
+
+    def resolve(self, roots: list[str]) -> TransferPlan:
+        for root in dict.fromkeys(roots):
+            self._visit(root, [], True)
+        return self.plan
+
+    def _visit(self, ex_name, path, is_root) -> list[str]:
+        # returns the experiments newly added to the transfers
+        if self.state.get(ex_name) == "visiting":
+            self.plan.cycles.append(path[path.index(ex_name) :] + [ex_name])
+            return []
+        if ex_name in self.state:
+            return []
+        self.state[ex_name] = "visiting"
+
+        added = []
+        if not is_root and self.exists_at_destination(ex_name):
+            self.plan.skipped.append(ex_name)
+        elif not self.exists_at_source(ex_name):
+            self.plan.missing.append(ex_name)
+        else:
+            dependencies = self.read_dependencies(ex_name)
+            if dependencies is None:
+                self.plan.unresolved.append(ex_name)
+            for dependency in dependencies or []:
+                added += self._visit(dependency, path + [ex_name], False)
+            self.plan.transfers.append(ex_name)
+            added.append(ex_name)
+
+        self.state[ex_name] = "done"
+        return added
+
+    def execute(self, transfer: Callable[[str], None], scheduler: TransferScheduler):
+        """Run `transfer` for every planned experiment with `scheduler`.
+
+        Dependencies of unresolved experiments are read once they have been
+        transferred, and the ones to transfer are added to the plan.
+        """
+
+        def on_done(ex_name):
+            if ex_name not in self.plan.unresolved:
+                return []
+            self.plan.unresolved.remove(ex_name)
+            added = []
+            for dependency in self.read_dependencies(ex_name) or []:
+                added += self._visit(dependency, [ex_name], False)
+            return added
+
+        scheduler.run(transfer, self.plan.transfers, on_done)
+        report_problems(self.plan)
+
+
+def plan_upload(
+    ex_names: list[str], results_dir: str, storage: Storage, dependency: bool = True
+) -> TransferPlanner:
+    remote_ex_names = storage.list_experiments()
+
+    def read_dependencies(ex_name):
+        if not dependency:
+            return []
+        return read_local_dependencies(ex_name, results_dir) or []
+
+    planner = TransferPlanner(
+        "upload",
+        read_dependencies,
+        lambda ex_name: exists(join(results_dir, ex_name)),
+        lambda ex_name: ex_name in remote_ex_names,
+    )
+    plan = planner.resolve(ex_names)
+    plan.sizes = {e: get_local_size(e, results_dir) for e in plan.transfers}
+    return planner
+
+
+def plan_download(
+    ex_names: list[str], results_dir: str, storage: Storage, dependency: bool = True
+) -> TransferPlanner:
+    remote_ex_names = storage.list_experiments()
+
+    def read_dependencies(ex_name):
+        if not dependency:
+            return []
+        # dependencies of experiments not downloaded yet are unknown (None)
+        return read_local_dependencies(ex_name, results_dir)
+
+    planner = TransferPlanner(
+        "download",
+        read_dependencies,
+        lambda ex_name: ex_name in remote_ex_names,
+        # partially pulled experiments are downloaded again
+        lambda ex_name: exists(join(results_dir, ex_name))
+        and not is_partial(results_dir, ex_name),
+    )
+    plan = planner.resolve(ex_names)
+    plan.sizes = {e: remote_ex_names[e].get("size") for e in plan.transfers}
+    return planner
+
+
+def print_plan(plan: TransferPlan):
+    verb = "upload" if plan.direction == "upload" else "download"
+    print(f"📋 Experiments to {verb}:")
+    for ex_name in plan.transfers:
+        size = plan.sizes.get(ex_name)
+        size_str = "?" if size is None else format_bytes(size)
+        print(f"  📁 {ex_name} ({size_str})")
+    total = plan.total_bytes
+    print(f"  Total: {len(plan.transfers)} experiment(s), ", end="")
+    print("unknown size" if total is None else format_bytes(total))
+    for ex_name in plan.skipped:
+        print(f"  ⏭️  {ex_name} (already exists)")
+    for ex_name in plan.unresolved:
+        print(f"  ℹ️ Dependencies of {ex_name} are resolved after downloading it")
+    report_problems(plan)
+
+
+def report_problems(plan: TransferPlan):
+    for ex_name in plan.missing:
+        print(f"⚠️ {ex_name} exists neither locally nor in the remote directory.")
+    for cycle in plan.cycles:
+        print(f"⚠️ Circular dependency: {' -> '.join(cycle)}")
@@ -0,0 +1,114 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Iterable, Optional
+import time
+
+from rich import print
+
+from .storage import Storage
+from .storage.resumable import is_throttled
+
+# A change of the throughput within this ratio is taken as noise
+THROUGHPUT_TOLERANCE = 0.1
+
+
+class TransferScheduler:
+    """Runs experiment transfers with an adaptive number of concurrent ones.
+
+    The number of concurrent transfers starts at half of the storage's limit
+    (`max_transfers` of storage_config, by default `max_workers` of the
+    backend) and is tuned from the throughput of each round of transfers:
+    it grows while the throughput does and shrinks when the throughput
+    drops. When the backend asks to slow down (HTTP 429/503, also while
+    retrying chunks inside a transfer), it is halved and not raised beyond
+    the level that was throttled again. Throttled requests are retried by
+    the transfers themselves, the scheduler does not retry transfers. A
+    failed transfer does not stop the others, the failures are reported
+    when all transfers have finished.
+    """
+
+    def __init__(self, storage: Storage, size: Optional[Callable] = None):
+        self.storage = storage
+        self.retry = storage.retry
+        self.max_limit = max(1, int(storage.max_transfers or storage.max_workers))
+        self.ceiling = self.max_limit
+        self.limit = max(1, self.max_limit // 2)
+        # size(ex_name) in bytes, or None if unknown
+        self.size = size or (lambda ex_name: None)
+        self._throttles = self.retry.throttles
+        self._last_rate = None
+        self._start_round()
+
+    def _start_round(self):
+        self._round_start = time.monotonic()
+        self._round_transfers = 0
+        self._round_bytes = 0
+
+    def _throttled(self):
+        self.ceiling = max(1, self.limit - 1)
+        self.limit = max(1, self.limit // 2)
+        self._last_rate = None
+        self._start_round()
+
+    def _completed(self, ex_name: str):
+        if self.retry.throttles != self._throttles:
+            # chunks of the transfer were throttled
+            self._throttles = self.retry.throttles
+            self._throttled()
+            return
+        self._round_transfers += 1
+        self._round_bytes += self.size(ex_name) or 0
+        if self._round_transfers < self.limit:
+            return
+
+        elapsed = max(time.monotonic() - self._round_start, 1e-6)
+        # transfers per second if the sizes are unknown
+        rate = (self._round_bytes or self._round_transfers) / elapsed
+        last_rate = self._last_rate
+        if last_rate is None or rate > last_rate * (1 + THROUGHPUT_TOLERANCE):
+            self.limit = min(self.ceiling, self.limit + 1)
+        elif rate < last_rate * (1 - THROUGHPUT_TOLERANCE):
+            self.limit = max(1, self.limit - 1)
+        self._last_rate = rate
+        self._start_round()
+
+    def run(
+        self,
+        transfer: Callable[[str], None],
+        ex_names: Iterable[str],
+        on_done: Optional[Callable[[str], Iterable[str]]] = None,
+    ):
+        """Run `transfer(ex_name)` for every experiment.
+
+        `on_done(ex_name)` is called after each successful transfer and
+        returns further experiments to transfer. If transfers failed, the
+        error of the first one is raised once the others have finished.
+        """
+        pending = deque(ex_names)
+        running = {}
+        errors = {}
+        with ThreadPoolExecutor(max_workers=self.max_limit) as executor:
+            while pending or running:
+                while pending and len(running) < self.limit:
+                    ex_name = pending.popleft()
+                    running[executor.submit(transfer, ex_name)] = ex_name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    ex_name = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception as e:
+                        errors[ex_name] = e
+                        if is_throttled(e):
+                            # the retries of its requests were throttled too
+                            self._throttles = self.retry.throttles
+                            self._throttled()
+                        continue
+                    self._completed(ex_name)
+                    if on_done is not None:
+                        pending.extend(on_done(ex_name) or [])
+
+        for ex_name, e in errors.items():
+            print(f"⛔️ Failed to transfer [bold]{ex_name}[/bold]: {e}")
+        if errors:
+            raise next(iter(errors.values()))
@@ -1,5 +1,20 @@
-from .gcs.gcs import GCS
-from .gdrive.gdrive import GDrive
+import importlib
+
 from .storage import Storage
 
-__all__ = ["GCS", "GDrive", "Storage"]
+# The backends load their client libraries, which takes most of the startup
+# time, so they are imported on first access
+_BACKEND_MODULES = {
+    "GCS": ".gcs.gcs",
+    "GDrive": ".gdrive.gdrive",
+    "LocalStorage": ".local.local",
+}
+
+__all__ = ["GCS", "GDrive", "LocalStorage", "Storage"]
+
+
+def __getattr__(name):
+    if name in _BACKEND_MODULES:
+        module = importlib.import_module(_BACKEND_MODULES[name], __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
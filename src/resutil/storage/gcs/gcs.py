@@ -1,15 +1,56 @@
-from os.path import basename, normpath
+from os.path import basename, normpath, getsize
 from os import makedirs
 from concurrent.futures import ThreadPoolExecutor, Future
+from itertools import chain
+from typing import Callable, Iterable, Iterator
+from urllib.parse import quote
+import base64
+import hashlib
+import threading
+import uuid
 
 from google.cloud import storage
+from google.api_core.exceptions import NotFound
+from google.auth.transport.requests import AuthorizedSession
 from google.oauth2 import service_account
 
-from ..storage import Storage
+from ..storage import (
+    Storage,
+    ZIP_SUFFIX,
+    MANIFEST_SUFFIX,
+    experiment_name_from_object_name,
+)
+from ..resumable import (
+    ResumableUpload,
+    ResumableDownload,
+    ResumeMismatch,
+    SlicedDownload,
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_SLICE_SIZE,
+    DEFAULT_SLICE_THRESHOLD,
+    aligned_chunk_size,
+    check_response,
+    fetch_range,
+    iter_file_chunks,
+    load_state,
+    remove_state,
+    save_state,
+)
+
+DEFAULT_API_ENDPOINT = "https://storage.googleapis.com"
+# Archives of at least this size are uploaded as parallel composite uploads
+DEFAULT_COMPOSITE_THRESHOLD = 150 * 1024 * 1024
+# Size of the parts streamed archives are cut into after composite_threshold
+DEFAULT_COMPOSITE_PART_SIZE = 16 * 1024 * 1024
+# A compose request takes at most 32 source objects
+MAX_COMPOSITE_PARTS = 32
+# Temporary part objects, not listed as experiments
+COMPOSITE_PREFIX = ".composite"
 
 
 class GCS(Storage):
     def __init__(self, storage_config: dict, project_name: str):
+        super().__init__(storage_config, project_name)
         key_file_path = storage_config["key_file_path"]
         backet_name = storage_config["backet_name"]
         try:
@@ -19,12 +60,38 @@ class GCS(Storage):
 
             self.client = storage.Client(credentials=credentials)
             self.bucket_name = backet_name
+            # Experiment zips are transferred through resumable sessions
+            self.http = AuthorizedSession(
+                credentials.with_scopes(
+                    ["https://www.googleapis.com/auth/devstorage.read_write"]
+                )
+            )
         except FileNotFoundError:
             raise ValueError(f"Key file not found at {key_file_path}")
 
-        self.project_dir = project_name
-
+        self.api_endpoint = storage_config.get("api_endpoint", DEFAULT_API_ENDPOINT)
         self.max_workers = 10
+        self.stream_chunk_size = aligned_chunk_size(
+            storage_config.get("chunk_size", DEFAULT_CHUNK_SIZE)
+        )
+        self.composite_threshold = int(
+            storage_config.get("composite_threshold", DEFAULT_COMPOSITE_THRESHOLD)
+        )
+        self.composite_parts = int(
+            storage_config.get("composite_parts", MAX_COMPOSITE_PARTS)
+        )
+        self.composite_part_size = int(
+            storage_config.get("composite_part_size", DEFAULT_COMPOSITE_PART_SIZE)
+        )
+        self.slice_size = int(storage_config.get("slice_size", DEFAULT_SLICE_SIZE))
+        self.slice_workers = int(storage_config.get("slice_workers", 8))
+        self.slice_threshold = int(
+            storage_config.get("slice_threshold", DEFAULT_SLICE_THRESHOLD)
+        )
+        if not 1 <= self.composite_parts <= MAX_COMPOSITE_PARTS:
+            raise ValueError(
+                f"composite_parts must be between 1 and {MAX_COMPOSITE_PARTS}"
+            )
 
     def get_info(self) -> tuple[str, str, str]:
         return {
@@ -33,40 +100,404 @@ class GCS(Storage):
         }
 
     def upload_experiment(self, zip_path: str):
-        blob = self.client.bucket(self.bucket_name).blob(
-            f"{self.project_dir}/{basename(zip_path)}"
-        )
-        blob = self.client.bucket(self.bucket_name).blob(
-            f"{self.project_dir}/{basename(zip_path)}"
+        ex_name = basename(zip_path)[:-4]
+        if getsize(zip_path) >= self.composite_threshold:
+            self._upload_composite(ex_name, zip_path)
+        else:
+            self.upload_experiment_stream(ex_name, iter_file_chunks(zip_path))
+
+    def upload_experiment_stream(self, ex_name: str, chunks: Iterable[bytes]):
+        # The first composite_threshold bytes are held back until it is known
+        # whether the archive ends there. Archives that do are sent to their
+        # key through one resumable session. Larger ones are cut into parts of
+        # composite_part_size, up to composite_parts of which are uploaded at
+        # once while the rest is produced, and composed.
+        stream = _PartReader(chunks)
+        head = list(stream.read(self.composite_threshold))
+        if stream.at_end():
+            self._upload_object(
+                ex_name + ZIP_SUFFIX,
+                head,
+                state_path=self.transfer_state_path(ex_name, "upload.json"),
+            )
+            return
+        stream.unread(head)
+        del head
+
+        upload = _CompositeUpload(self, ex_name, self.composite_part_size)
+        workers = min(self.max_workers, self.composite_parts)
+        part_count = 0
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                in_flight = []
+                while not stream.at_end():
+                    part = list(stream.read(self.composite_part_size))
+                    in_flight.append(
+                        executor.submit(upload.upload, part_count, lambda p=part: p)
+                    )
+                    part_count += 1
+                    if len(in_flight) >= workers:
+                        in_flight.pop(0).result()
+                for future in in_flight:
+                    future.result()
+            blob = upload.compose(part_count)
+        except BaseException:
+            upload.abort()
+            raise
+        self.index.add(ex_name, self._blob_metadata(blob))
+
+    def _upload_object(self, key: str, chunks: Iterable[bytes], state_path=None):
+        name = f"{self.project_dir}/{key}"
+
+        def initiate():
+            response = self.http.post(
+                f"{self.api_endpoint}/upload/storage/v1/b/{self.bucket_name}/o",
+                params={"uploadType": "resumable", "name": name},
+                json={"contentType": "application/zip"},
+            )
+            return check_response(response).headers["Location"]
+
+        upload = ResumableUpload(
+            self.http,
+            initiate,
+            target={"bucket": self.bucket_name, "name": name},
+            state_path=state_path,
+            chunk_size=self.stream_chunk_size,
+            retry=self.retry,
         )
-        blob.upload_from_filename(zip_path)
+        resource = upload.upload(chunks)
+        ex_name = experiment_name_from_object_name(key)
+        if ex_name is not None:
+            self.index.add(ex_name, self._resource_metadata(resource))
+
+    def _upload_composite(self, ex_name: str, zip_path: str):
+        size = getsize(zip_path)
+        part_count = max(1, min(self.composite_parts, size // self.stream_chunk_size))
+        part_size = -(-size // part_count)
+        upload = _CompositeUpload(self, ex_name, part_size)
+
+        def upload_part(i):
+            upload.upload(
+                i,
+                lambda: _iter_file_range(
+                    zip_path, i * part_size, part_size, self.stream_chunk_size
+                ),
+            )
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                list(executor.map(upload_part, range(part_count)))
+            blob = upload.compose(part_count)
+        except BaseException:
+            upload.abort()
+            raise
+        self.index.add(ex_name, self._blob_metadata(blob))
+
+    def _compose(self, key: str, part_keys: list[str]):
+        # A compose request takes at most MAX_COMPOSITE_PARTS sources, so more
+        # parts are composed in groups first. The groups are appended to
+        # `part_keys` to be deleted with the parts.
+        sources = list(part_keys)
+        while len(sources) > MAX_COMPOSITE_PARTS:
+            groups = [
+                sources[i : i + MAX_COMPOSITE_PARTS]
+                for i in range(0, len(sources), MAX_COMPOSITE_PARTS)
+            ]
+            sources = [f"{group[0]}.group" for group in groups]
+            part_keys.extend(sources)
+            for group_key, group in zip(sources, groups):
+                self._blob(group_key).compose([self._blob(k) for k in group])
+        blob = self._blob(key)
+        blob.content_type = "application/zip"
+        blob.compose([self._blob(k) for k in sources])
+        return blob
+
+    def _delete_part(self, key: str):
+        try:
+            self._blob(key).delete()
+        except NotFound:
+            # not uploaded
+            pass
+
+    def use_sliced_download(self, ex_name: str) -> bool:
+        size = self.list_experiments().get(ex_name, {}).get("size")
+        return size is not None and size >= self.slice_threshold
 
     def download_experiment(self, zip_path: str):
-        blob = self.client.bucket(self.bucket_name).blob(
-            f"{self.project_dir}/{basename(zip_path)}"
+        ex_name = basename(zip_path)[:-4]
+        blob, url = self._media(ex_name)
+        if blob.size <= self.slice_size:
+            with open(zip_path, "wb") as f:
+                for chunk in self._download_stream(ex_name, blob, url):
+                    f.write(chunk)
+            return
+
+        # composite objects only have a CRC32C checksum
+        if blob.md5_hash is not None:
+            checksums = {"md5": base64.b64decode(blob.md5_hash).hex()}
+        else:
+            checksums = {"crc32c": base64.b64decode(blob.crc32c).hex()}
+        download = SlicedDownload(
+            self.http,
+            url,
+            blob.size,
+            version={"generation": blob.generation},
+            checksums=checksums,
+            state_path=self.transfer_state_path(ex_name, "sliced.json"),
+            part_path=self.transfer_state_path(ex_name, "sliced.part"),
+            slice_size=self.slice_size,
+            workers=self.slice_workers,
+            retry=self.retry,
         )
-        blob.download_to_filename(zip_path)
+        download.download(zip_path)
 
-    def get_all_experiment_names(self) -> list[str]:
-        blobs = self.client.list_blobs(self.bucket_name, prefix=self.project_dir + "/")
-        return [p.name.split("/")[-1][:-4] for p in blobs]
+    def download_experiment_stream(self, ex_name: str) -> Iterator[bytes]:
+        yield from self._download_stream(ex_name, *self._media(ex_name))
 
-    def remove_experiment(self, ex_name: str):
-        blob = self.client.bucket(self.bucket_name).blob(
-            self.project_dir + "/" + ex_name + ".zip"
+    def _download_stream(self, ex_name, blob, url):
+        download = ResumableDownload(
+            self.http,
+            url,
+            version={"generation": blob.generation},
+            state_path=self.download_state_path(ex_name),
+            part_path=self.transfer_state_path(ex_name, "download.part"),
+            chunk_size=self.stream_chunk_size,
+            retry=self.retry,
+        )
+        yield from download.iter_chunks()
+
+    def experiment_zip_size(self, ex_name: str) -> int:
+        blob, _ = self._media(ex_name)
+        return blob.size
+
+    def read_experiment_zip(self, ex_name: str, offset: int, length: int) -> bytes:
+        name = quote(f"{self.project_dir}/{ex_name}{ZIP_SUFFIX}", safe="")
+        url = f"{self.api_endpoint}/download/storage/v1/b/{self.bucket_name}/o/{name}?alt=media"
+        return fetch_range(self.http, url, offset, length, self.retry)
+
+    def _media(self, ex_name: str):
+        blob = self._blob(ex_name + ZIP_SUFFIX)
+        try:
+            blob.reload()
+        except NotFound:
+            raise FileNotFoundError(f"{ex_name}{ZIP_SUFFIX} does not exist")
+        # pin the generation, a resumed download must not mix two uploads
+        url = (
+            f"{self.api_endpoint}/download/storage/v1/b/{self.bucket_name}/o/"
+            f"{quote(blob.name, safe='')}?alt=media&generation={blob.generation}"
+        )
+        return blob, url
+
+    def _list_experiments(self) -> dict:
+        blobs = self.client.list_blobs(
+            self.bucket_name, prefix=self.project_dir + "/", delimiter="/"
         )
-        blob.delete()
+        experiments = {}
+        for blob in blobs:
+            ex_name = experiment_name_from_object_name(blob.name.split("/")[-1])
+            if ex_name is not None:
+                experiments[ex_name] = self._blob_metadata(blob)
+        return experiments
+
+    def remove_experiment(self, ex_name: str):
+        for suffix in (ZIP_SUFFIX, MANIFEST_SUFFIX):
+            if self.exist_object(ex_name + suffix):
+                self.delete_object(ex_name + suffix)
+        self.index.remove(ex_name)
 
     def change_comment(self, ex_name, new_comment):
         new_ex_name = f"{ex_name.split('_')[0]}_{ex_name.split('_')[1]}_{new_comment}"
-        old_name = self.project_dir + "/" + ex_name + ".zip"
-        new_name = self.project_dir + "/" + new_ex_name + ".zip"
-        old_blob = self.client.bucket(self.bucket_name).blob(old_name)
+        for suffix in (ZIP_SUFFIX, MANIFEST_SUFFIX):
+            old_blob = self._blob(ex_name + suffix)
+            if not old_blob.exists():
+                continue
+            self.client.bucket(self.bucket_name).copy_blob(
+                old_blob,
+                self.client.bucket(self.bucket_name),
+                self.project_dir + "/" + new_ex_name + suffix,
+            )
+            old_blob.delete()
+        self.index.rename(ex_name, new_ex_name)
 
-        self.client.bucket(self.bucket_name).copy_blob(
-            old_blob, self.client.bucket(self.bucket_name), new_name
+    def put_object(self, key: str, data: bytes) -> dict:
+        blob = self._blob(key)
+        blob.upload_from_string(data)
+        return self._blob_metadata(blob)
+
+    def get_object(self, key: str) -> bytes:
+        try:
+            return self._blob(key).download_as_bytes()
+        except NotFound:
+            raise FileNotFoundError(f"{key} does not exist")
+
+    def exist_object(self, key: str) -> bool:
+        return self._blob(key).exists()
+
+    def list_objects(self, prefix: str) -> list[str]:
+        blobs = self.client.list_blobs(
+            self.bucket_name, prefix=f"{self.project_dir}/{prefix}", delimiter="/"
         )
-        old_blob.delete()
+        return [p.name[len(self.project_dir) + 1 :] for p in blobs]
+
+    def delete_object(self, key: str):
+        try:
+            self._blob(key).delete()
+        except NotFound:
+            raise FileNotFoundError(f"{key} does not exist")
+
+    def _blob_metadata(self, blob) -> dict:
+        return {
+            "format": "chunked" if blob.name.endswith(MANIFEST_SUFFIX) else "zip",
+            "size": blob.size,
+            "md5": blob.md5_hash,
+            "crc32c": blob.crc32c,
+            "generation": blob.generation,
+            "updated": None if blob.updated is None else blob.updated.isoformat(),
+        }
+
+    def _resource_metadata(self, resource: dict) -> dict:
+        # Same as _blob_metadata, from the JSON API object resource
+        metadata = {"format": "zip"}
+        if "size" in resource:
+            metadata["size"] = int(resource["size"])
+        for key, name in (
+            ("md5", "md5Hash"),
+            ("crc32c", "crc32c"),
+            ("updated", "updated"),
+        ):
+            if name in resource:
+                metadata[key] = resource[name]
+        if "generation" in resource:
+            metadata["generation"] = int(resource["generation"])
+        return metadata
+
+    def _blob(self, key: str):
+        return self.client.bucket(self.bucket_name).blob(f"{self.project_dir}/{key}")
+
+
+def _iter_file_range(path: str, offset: int, length: int, chunk_size: int):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
+
+
+class _PartReader:
+    # Reads a stream of chunks in parts of a given size
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self.chunks = iter(chunks)
+        self.pending = b""
+
+    def at_end(self) -> bool:
+        while not self.pending:
+            self.pending = next(self.chunks, None)
+            if self.pending is None:
+                self.pending = b""
+                return True
+        return False
+
+    def read(self, size: int) -> Iterator[bytes]:
+        # chunks of the next `size` bytes, split where a part ends
+        while size > 0 and not self.at_end():
+            chunk, self.pending = self.pending[:size], self.pending[size:]
+            size -= len(chunk)
+            yield chunk
+
+    def unread(self, chunks: list[bytes]):
+        # puts `chunks` back in front of the stream
+        self.chunks = chain(chunks, [self.pending], self.chunks)
+        self.pending = b""
+
+
+def _part_digest(chunks: Iterable[bytes]) -> str:
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _CompositeUpload:
+    """The parts of a composite upload of an experiment.
+
+    The parts are named after an upload id, which is persisted with the
+    digests of the parts uploaded completely. An interrupted upload is
+    continued with the same parts: those whose data is unchanged are not
+    sent again, and the others resume their own resumable sessions. Without
+    a transfer state dir nothing can continue the upload, and its parts are
+    removed when it fails.
+    """
+
+    def __init__(self, storage: GCS, ex_name: str, part_size: int):
+        self.storage = storage
+        self.ex_name = ex_name
+        self.state_path = storage.transfer_state_path(ex_name, "composite.json")
+        self.lock = threading.Lock()
+        self.started = set()
+        # parts and the groups composed from them
+        self.keys = []
+        self.state = load_state(self.state_path)
+        if self.state is not None and self.state.get("part_size") != part_size:
+            # parts of an upload that cannot be continued
+            self._delete([self._key(i) for i in self.state["digests"]])
+            self.state = None
+        if self.state is None:
+            self.state = {
+                "upload_id": uuid.uuid4().hex,
+                "part_size": part_size,
+                "digests": {},
+            }
+            save_state(self.state_path, self.state)
+
+    def upload(self, index: int, chunks: Callable[[], Iterable[bytes]]):
+        # `chunks` returns the data of the part, and is called again to send
+        # it unless the part is already uploaded
+        with self.lock:
+            self.started.add(index)
+        digest = _part_digest(chunks())
+        if self.state["digests"].get(str(index)) == digest:
+            return
+        key = self._key(index)
+        state_path = self.storage.transfer_state_path(
+            self.ex_name, f"part{index:02d}.json"
+        )
+        try:
+            self.storage._upload_object(key, chunks(), state_path=state_path)
+        except ResumeMismatch:
+            # the session was for other data, and has been discarded
+            self.storage._upload_object(key, chunks(), state_path=state_path)
+        with self.lock:
+            self.state["digests"][str(index)] = digest
+            save_state(self.state_path, self.state)
+
+    def compose(self, part_count: int):
+        self.keys = keys = [self._key(i) for i in range(part_count)]
+        try:
+            blob = self.storage._compose(self.ex_name + ZIP_SUFFIX, keys)
+        except NotFound:
+            # a part kept from the interrupted upload has been removed, e.g. by
+            # a lifecycle rule. The next upload starts over.
+            remove_state(self.state_path)
+            raise
+        # parts of an interrupted upload of a longer archive too
+        keys.extend(self._key(i) for i in self.state["digests"] if int(i) >= part_count)
+        self._delete(keys)
+        remove_state(self.state_path)
+        return blob
+
+    def abort(self):
+        if self.state_path is None:
+            started = [self._key(i) for i in self.started]
+            self._delete(sorted(set(started + self.keys)))
+
+    def _key(self, index) -> str:
+        upload_id = self.state["upload_id"]
+        return f"{COMPOSITE_PREFIX}/{self.ex_name}/{upload_id}.{int(index):02d}"
 
-    def exist_experiment(self, ex_name: str) -> bool:
-        return ex_name in self.get_all_experiment_names()
+    def _delete(self, keys: list[str]):
+        with ThreadPoolExecutor(max_workers=self.storage.max_workers) as executor:
+            list(executor.map(self.storage._delete_part, keys))
@@ -1,43 +1,93 @@
 from os.path import basename
+from posixpath import dirname, basename as key_basename
+from typing import Iterable, Iterator
 import io
+import threading
 
 
+from google.auth.transport.requests import AuthorizedSession
 from google.oauth2 import service_account
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
-
-from ..storage import Storage
+import httplib2
+from requests.adapters import HTTPAdapter
+from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload
+
+from ..storage import (
+    Storage,
+    ZIP_SUFFIX,
+    MANIFEST_SUFFIX,
+    experiment_name_from_object_name,
+)
+from ..resumable import (
+    ResumableUpload,
+    ResumableDownload,
+    SlicedDownload,
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_SLICE_SIZE,
+    DEFAULT_SLICE_THRESHOLD,
+    aligned_chunk_size,
+    check_response,
+    fetch_range,
+    iter_file_chunks,
+)
+
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+# Largest page size files().list accepts
+LIST_PAGE_SIZE = 1000
+# Drive batch requests take at most 100 calls
+BATCH_SIZE = 100
+METADATA_FIELDS = "modifiedTime, size, md5Checksum"
+# requested for the files resutil writes, so that they can be indexed
+# without listing them again
+FILE_FIELDS = "id, name, " + METADATA_FIELDS
+UPLOAD_URL = "https://www.googleapis.com/upload/drive/v3/files"
+FILES_URL = "https://www.googleapis.com/drive/v3/files"
+# Connections kept open by the session used for transfers
+DEFAULT_MAX_CONNECTIONS = 16
+
+
+def escape_query(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("'", "\\'")
 
 
 class GDrive(Storage):
     def __init__(self, storage_config: dict, project_name: str):
+        super().__init__(storage_config, project_name)
         key_file_path = storage_config["key_file_path"]
         try:
             credentials = service_account.Credentials.from_service_account_file(
                 key_file_path
             ).with_scopes(["https://www.googleapis.com/auth/drive"])
 
-            self.service = build("drive", "v3", credentials=credentials)
+            self.credentials = credentials
+            self._local = threading.local()
+            # Experiment zips are transferred through resumable sessions.
+            # Sessions are thread-safe and share a bounded connection pool.
+            self.http = AuthorizedSession(credentials)
+            max_connections = int(
+                storage_config.get("max_connections", DEFAULT_MAX_CONNECTIONS)
+            )
+            self.http.mount(
+                "https://",
+                HTTPAdapter(pool_connections=4, pool_maxsize=max_connections),
+            )
             self.base_folder_id = storage_config["base_folder_id"]
 
         except FileNotFoundError:
             raise ValueError(f"Key file not found at {key_file_path}")
 
-        self.project_dir = project_name
-
-        query = f"name = '{project_name}' and mimeType = 'application/vnd.google-apps.folder'"
-        results = (
-            self.service.files()
-            .list(
+        query = (
+            f"name = '{escape_query(project_name)}' and mimeType = '{FOLDER_MIME_TYPE}'"
+        )
+        results = self._execute(
+            self.service.files().list(
                 q=query,
                 fields="files(id, name)",
             )
-            .execute()
         )
         items = results.get("files", [])
 
-        self.experiment_item_cache = items
-
         for item in items:
             if item["name"] == project_name:
                 self.project_dir_id = item["id"]
@@ -48,13 +98,40 @@ class GDrive(Storage):
                 "mimeType": "application/vnd.google-apps.folder",
                 "parents": [self.base_folder_id],
             }
-            folder = (
-                self.service.files().create(body=file_metadata, fields="id").execute()
+            folder = self._execute(
+                self.service.files().create(body=file_metadata, fields="id")
             )
             self.project_dir_id = folder.get("id")
 
-        self.experiment_item_cache = None
-        self.max_workers = 1
+        # {file name: file id} of the experiment files in the project folder
+        self.experiment_file_ids = None
+        self.list_metadata = bool(storage_config.get("list_metadata", False))
+        self.folder_id_cache = {"": self.project_dir_id}
+        self.folder_lock = threading.RLock()
+        self.max_workers = int(storage_config.get("max_workers", 4))
+        self.stream_chunk_size = aligned_chunk_size(
+            storage_config.get("chunk_size", DEFAULT_CHUNK_SIZE)
+        )
+        self.slice_size = int(storage_config.get("slice_size", DEFAULT_SLICE_SIZE))
+        self.slice_workers = int(storage_config.get("slice_workers", 4))
+        self.slice_threshold = int(
+            storage_config.get("slice_threshold", DEFAULT_SLICE_THRESHOLD)
+        )
+
+    @property
+    def service(self):
+        # googleapiclient services are not thread-safe since they share one
+        # httplib2 connection, so each thread builds its own on first use.
+        # The credentials, and with them the access token, are shared.
+        service = getattr(self._local, "service", None)
+        if service is None:
+            service = self.build_service()
+            self._local.service = service
+        return service
+
+    def build_service(self):
+        http = AuthorizedHttp(self.credentials, http=httplib2.Http())
+        return build("drive", "v3", http=http, cache_discovery=False)
 
     def get_info(self) -> tuple[str, str, str]:
         return {
@@ -63,89 +140,371 @@ class GDrive(Storage):
         }
 
     def upload_experiment(self, zip_path: str):
-        if self.exist_experiment(basename(zip_path)[:-4]):
-            self.remove_experiment(basename(zip_path)[:-4])
-
-        file_metadata = {
-            "name": basename(zip_path),  # アップロードするファイル名
-            "parents": [self.project_dir_id],  # アップロード先のフォルダID
-        }
-        media = MediaFileUpload(zip_path, mimetype="application/zip")
+        self.upload_experiment_stream(
+            basename(zip_path)[:-4], iter_file_chunks(zip_path)
+        )
 
-        self.service.files().create(
-            body=file_metadata, media_body=media, fields="id"
-        ).execute()
+    def upload_experiment_stream(self, ex_name: str, chunks: Iterable[bytes]):
+        if self.exist_experiment(ex_name):
+            self.remove_experiment(ex_name)
 
-    def download_experiment(self, zip_path: str):
-        file_id = self._find_file_id(basename(zip_path))
+        file_name = f"{ex_name}{ZIP_SUFFIX}"
 
-        request = self.service.files().get_media(fileId=file_id)
-        fh = io.FileIO(zip_path, "wb")
+        def initiate():
+            response = self.http.post(
+                UPLOAD_URL,
+                params={"uploadType": "resumable", "fields": FILE_FIELDS},
+                json={"name": file_name, "parents": [self.project_dir_id]},
+                headers={"X-Upload-Content-Type": "application/zip"},
+            )
+            return check_response(response).headers["Location"]
+
+        upload = ResumableUpload(
+            self.http,
+            initiate,
+            target={"folder_id": self.project_dir_id, "name": file_name},
+            state_path=self.transfer_state_path(ex_name, "upload.json"),
+            chunk_size=self.stream_chunk_size,
+            retry=self.retry,
+        )
+        response = upload.upload(chunks)
+        if "id" in response:
+            self._add_experiment_file({"name": file_name, **response})
+        else:
+            self._forget_experiment_file(file_name)
+            self.index.invalidate()
 
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while not done:
-            status, done = downloader.next_chunk()
+    def use_sliced_download(self, ex_name: str) -> bool:
+        size = self.list_experiments().get(ex_name, {}).get("size")
+        if size is None:
+            size = int(self._file_item(ex_name).get("size", 0))
+        return size >= self.slice_threshold
 
-    def get_all_experiment_names(self) -> list[str]:
-        query = f"'{self.project_dir_id}' in parents and trashed = false"
-        results = (
-            self.service.files()
-            .list(
-                q=query,
-                fields="files(id, name)",
-            )
-            .execute()
+    def download_experiment(self, zip_path: str):
+        ex_name = basename(zip_path)[:-4]
+        item = self._file_item(ex_name)
+        size = int(item.get("size", 0))
+        if size <= self.slice_size:
+            with open(zip_path, "wb") as f:
+                for chunk in self._download_stream(ex_name, item):
+                    f.write(chunk)
+            return
+
+        download = SlicedDownload(
+            self.http,
+            f"{FILES_URL}/{item['id']}?alt=media",
+            size,
+            version={"id": item["id"], "md5": item.get("md5Checksum")},
+            checksums={"md5": item["md5Checksum"]} if "md5Checksum" in item else {},
+            state_path=self.transfer_state_path(ex_name, "sliced.json"),
+            part_path=self.transfer_state_path(ex_name, "sliced.part"),
+            slice_size=self.slice_size,
+            workers=self.slice_workers,
+            retry=self.retry,
         )
-        items = results.get("files", [])
+        download.download(zip_path)
 
-        self.experiment_item_cache = items
+    def download_experiment_stream(self, ex_name: str) -> Iterator[bytes]:
+        yield from self._download_stream(ex_name, self._file_item(ex_name))
 
-        if not items:
-            return []
-        else:
-            filenames = [item["name"] for item in items]
-            return [f[:-4] for f in filenames]
+    def experiment_zip_size(self, ex_name: str) -> int:
+        return int(self._file_item(ex_name)["size"])
 
-    def remove_experiment(self, ex_name: str):
-        filename = ex_name + ".zip"
+    def read_experiment_zip(self, ex_name: str, offset: int, length: int) -> bytes:
+        file_id = self._find_file_id(ex_name + ZIP_SUFFIX)
+        url = f"{FILES_URL}/{file_id}?alt=media"
+        return fetch_range(self.http, url, offset, length, self.retry)
 
-        file_id = self._find_file_id(filename)
+    def _file_item(self, ex_name: str) -> dict:
+        file_id = self._find_file_id(ex_name + ZIP_SUFFIX)
+        return self._execute(
+            self.service.files().get(fileId=file_id, fields="id, size, md5Checksum")
+        )
 
-        try:
-            self.service.files().delete(fileId=file_id).execute()
-        except Exception as e:
-            print(f"An error occurred: {e}")
+    def _download_stream(self, ex_name, item):
+        download = ResumableDownload(
+            self.http,
+            f"{FILES_URL}/{item['id']}?alt=media",
+            version={"id": item["id"], "md5": item.get("md5Checksum")},
+            state_path=self.download_state_path(ex_name),
+            part_path=self.transfer_state_path(ex_name, "download.part"),
+            chunk_size=self.stream_chunk_size,
+            retry=self.retry,
+        )
+        yield from download.iter_chunks()
+
+    def _iter_files(self, query, fields="id, name"):
+        # Yields the files matching `query` page by page, so that callers can
+        # start working before the listing is complete
+        page_token = None
+        while True:
+            results = self._execute(
+                self.service.files().list(
+                    q=query,
+                    fields=f"nextPageToken, files({fields})",
+                    pageSize=LIST_PAGE_SIZE,
+                    pageToken=page_token,
+                )
+            )
+            yield from results.get("files", [])
+            page_token = results.get("nextPageToken")
+            if page_token is None:
+                return
+
+    def iter_experiments(self, with_metadata=None):
+        """Yield (ex_name, metadata) of the remote experiments while listing.
+
+        With `with_metadata` (default: `list_metadata` of storage_config) the
+        metadata includes size, md5 and modification time.
+        """
+        if with_metadata is None:
+            with_metadata = self.list_metadata
+        fields = "id, name"
+        if with_metadata:
+            fields += ", " + METADATA_FIELDS
+        query = f"'{self.project_dir_id}' in parents and trashed = false and mimeType != '{FOLDER_MIME_TYPE}'"
+
+        file_ids = {}
+        for item in self._iter_files(query, fields):
+            ex_name = experiment_name_from_object_name(item["name"])
+            if ex_name is None:
+                continue
+            file_ids[item["name"]] = item["id"]
+            yield ex_name, self._item_metadata(item)
+        self.experiment_file_ids = file_ids
+
+    def _list_experiments(self) -> dict:
+        return dict(self.iter_experiments())
+
+    def remove_experiment(self, ex_name: str):
+        file_ids = self._find_file_ids(
+            [ex_name + ZIP_SUFFIX, ex_name + MANIFEST_SUFFIX]
+        )
+        for file_name, file_id in file_ids.items():
+            if file_id is None:
+                continue
+            try:
+                self._execute(self.service.files().delete(fileId=file_id))
+                self._forget_experiment_file(file_name)
+            except Exception as e:
+                print(f"An error occurred: {e}")
+        self.index.remove(ex_name)
 
     def change_comment(self, ex_name, new_comment):
         new_ex_name = f"{ex_name.split('_')[0]}_{ex_name.split('_')[1]}_{new_comment}"
-        old_name = ex_name + ".zip"
-        new_name = new_ex_name + ".zip"
+        file_ids = self._find_file_ids(
+            [ex_name + ZIP_SUFFIX, ex_name + MANIFEST_SUFFIX]
+        )
+        for old_name, file_id in file_ids.items():
+            if file_id is None:
+                continue
+            new_name = new_ex_name + old_name[len(ex_name) :]
+
+            try:
+                file_metadata = {"name": new_name}
+                updated_file = self._execute(
+                    self.service.files().update(
+                        fileId=file_id, body=file_metadata, fields="id, name"
+                    )
+                )
+                print(
+                    f"File ID: {updated_file.get('id')} renamed to {updated_file.get('name')}."
+                )
+                self._forget_experiment_file(old_name)
+                if self.experiment_file_ids is not None:
+                    self.experiment_file_ids[new_name] = file_id
+            except Exception as e:
+                print(f"An error occurred: {e}")
+        self.index.rename(ex_name, new_ex_name)
+
+    # Object keys map to files in (nested) sub folders of the project folder,
+    # e.g. ".chunks/<hash>" is the file "<hash>" in the folder ".chunks".
+
+    def put_object(self, key: str, data: bytes) -> dict:
+        folder_id = self._find_folder_id(dirname(key), create=True)
+        file_id = self._find_object_id(folder_id, key_basename(key))
+        if file_id is None:
+            return self._create_object(folder_id, key, data)
+        media = MediaIoBaseUpload(io.BytesIO(data), mimetype="application/octet-stream")
+        file = self._execute(
+            self.service.files().update(
+                fileId=file_id, media_body=media, fields=FILE_FIELDS
+            )
+        )
+        return self._item_metadata(file)
+
+    def put_new_object(self, key: str, data: bytes) -> dict:
+        # Drive allows several files of the same name, so the lookup that
+        # put_object needs to replace a file is skipped
+        folder_id = self._find_folder_id(dirname(key), create=True)
+        return self._create_object(folder_id, key, data)
+
+    def _create_object(self, folder_id, key, data):
+        media = MediaIoBaseUpload(io.BytesIO(data), mimetype="application/octet-stream")
+        file_metadata = {"name": key_basename(key), "parents": [folder_id]}
+        file = self._execute(
+            self.service.files().create(
+                body=file_metadata, media_body=media, fields=FILE_FIELDS
+            )
+        )
+        if dirname(key) == "" and experiment_name_from_object_name(key):
+            self._add_experiment_file(file)
+        return self._item_metadata(file)
+
+    def get_object(self, key: str) -> bytes:
+        folder_id = self._find_folder_id(dirname(key))
+        file_id = (
+            None
+            if folder_id is None
+            else self._find_object_id(folder_id, key_basename(key))
+        )
+        if file_id is None:
+            raise FileNotFoundError(f"{key} does not exist")
 
-        file_id = self._find_file_id(old_name)
+        request = self.service.files().get_media(fileId=file_id)
+        fh = io.BytesIO()
+        downloader = MediaIoBaseDownload(fh, request)
+        done = False
+        while not done:
+            status, done = self.retry.call(downloader.next_chunk)
+        return fh.getvalue()
+
+    def exist_object(self, key: str) -> bool:
+        folder_id = self._find_folder_id(dirname(key))
+        if folder_id is None:
+            return False
+        return self._find_object_id(folder_id, key_basename(key)) is not None
+
+    def list_objects(self, prefix: str) -> list[str]:
+        # Only prefixes that name a folder ("dir/" or "") are supported
+        folder = prefix.rstrip("/")
+        folder_id = self._find_folder_id(folder)
+        if folder_id is None:
+            return []
+        query = f"'{folder_id}' in parents and trashed = false and mimeType != '{FOLDER_MIME_TYPE}'"
+        return [
+            item["name"] if folder == "" else f"{folder}/{item['name']}"
+            for item in self._iter_files(query, "name")
+        ]
+
+    def delete_object(self, key: str):
+        folder_id = self._find_folder_id(dirname(key))
+        file_id = (
+            None
+            if folder_id is None
+            else self._find_object_id(folder_id, key_basename(key))
+        )
+        if file_id is None:
+            raise FileNotFoundError(f"{key} does not exist")
+        self._execute(self.service.files().delete(fileId=file_id))
+        if dirname(key) == "":
+            self._forget_experiment_file(key)
+
+    def _find_object_id(self, folder_id, name, mime_type=None):
+        query = f"'{folder_id}' in parents and name = '{escape_query(name)}' and trashed = false"
+        if mime_type is not None:
+            query += f" and mimeType = '{mime_type}'"
+        results = self._execute(
+            self.service.files().list(q=query, fields="files(id, name)")
+        )
+        items = results.get("files", [])
+        return items[0]["id"] if items else None
 
-        try:
-            file_metadata = {"name": new_name}
-            updated_file = (
-                self.service.files()
-                .update(fileId=file_id, body=file_metadata, fields="id, name")
-                .execute()
-            )
-            print(
-                f"File ID: {updated_file.get('id')} renamed to {updated_file.get('name')}."
+    def _find_folder_id(self, path, create=False):
+        if path in self.folder_id_cache:
+            return self.folder_id_cache[path]
+        # so that concurrent puts do not create the same folder twice
+        with self.folder_lock:
+            return self._find_folder_id_locked(path, create)
+
+    def _find_folder_id_locked(self, path, create):
+        if path in self.folder_id_cache:
+            return self.folder_id_cache[path]
+
+        parent_id = self._find_folder_id(dirname(path), create)
+        if parent_id is None:
+            return None
+
+        folder_id = self._find_object_id(
+            parent_id, key_basename(path), mime_type=FOLDER_MIME_TYPE
+        )
+        if folder_id is None:
+            if not create:
+                return None
+            file_metadata = {
+                "name": key_basename(path),
+                "mimeType": FOLDER_MIME_TYPE,
+                "parents": [parent_id],
+            }
+            folder = self._execute(
+                self.service.files().create(body=file_metadata, fields="id")
             )
-        except Exception as e:
-            print(f"An error occurred: {e}")
+            folder_id = folder.get("id")
 
-    def exist_experiment(self, ex_name: str) -> bool:
-        return ex_name in self.get_all_experiment_names()
+        self.folder_id_cache[path] = folder_id
+        return folder_id
 
-    def _find_file_id(self, file_name):
-        if self.experiment_item_cache is None:
-            self.get_all_experiment_names()
+    def _execute(self, request):
+        # Throttled and failed requests are retried with backoff, and the
+        # throttles reported to the scheduler
+        return self.retry.call(request.execute)
 
-        for item in self.experiment_item_cache:
-            if item["name"] == file_name:
-                return item["id"]
+    def _item_metadata(self, item) -> dict:
+        metadata = {
+            "format": "chunked" if item["name"].endswith(MANIFEST_SUFFIX) else "zip",
+            "id": item["id"],
+        }
+        if "size" in item:
+            metadata["size"] = int(item["size"])
+        if "md5Checksum" in item:
+            metadata["md5"] = item["md5Checksum"]
+        if "modifiedTime" in item:
+            metadata["updated"] = item["modifiedTime"]
+        return metadata
+
+    def _add_experiment_file(self, item):
+        if self.experiment_file_ids is not None:
+            self.experiment_file_ids[item["name"]] = item["id"]
+        self.index.add(
+            experiment_name_from_object_name(item["name"]), self._item_metadata(item)
+        )
+
+    def _forget_experiment_file(self, file_name):
+        if self.experiment_file_ids is not None:
+            self.experiment_file_ids.pop(file_name, None)
+
+    def _find_file_ids(self, file_names) -> dict:
+        # {file name: file id or None} of files in the project folder. Served
+        # from the last listing if there is one, otherwise looked up with
+        # batch requests instead of listing the whole folder.
+        if self.experiment_file_ids is not None:
+            return {name: self.experiment_file_ids.get(name) for name in file_names}
+
+        names = list(dict.fromkeys(file_names))
+        file_ids = {name: None for name in names}
+        errors = []
+        for start in range(0, len(names), BATCH_SIZE):
+            batch_names = names[start : start + BATCH_SIZE]
+
+            def callback(request_id, response, exception):
+                if exception is not None:
+                    errors.append(exception)
+                    return
+                files = response.get("files", [])
+                if files:
+                    file_ids[batch_names[int(request_id)]] = files[0]["id"]
+
+            batch = self.service.new_batch_http_request(callback=callback)
+            for i, name in enumerate(batch_names):
+                query = f"'{self.project_dir_id}' in parents and name = '{escape_query(name)}' and trashed = false"
+                batch.add(
+                    self.service.files().list(q=query, fields="files(id)", pageSize=1),
+                    request_id=str(i),
+                )
+            batch.execute()
+        if errors:
+            raise errors[0]
+        return file_ids
 
-        return None
+    def _find_file_id(self, file_name):
+        return self._find_file_ids([file_name])[file_name]
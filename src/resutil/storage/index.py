@@ -0,0 +1,102 @@
+from os.path import exists, dirname
+from typing import Optional
+import json
+import os
+import threading
+import time
+
+DEFAULT_INDEX_TTL = 300.0
+
+
+class ExperimentIndex:
+    """Cached listing of the experiments in a remote project dir.
+
+    Maps experiment names to the metadata returned by the backend listing.
+    The listing expires after `ttl` seconds and is updated in place by the
+    storage methods that add, remove or rename experiments. When `attach` is
+    called, it is also persisted to a JSON file.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_INDEX_TTL):
+        self.ttl = ttl
+        self.entries = None
+        self.fetched_at = 0.0
+        self.path = None
+        self.identity = None
+        self.lock = threading.RLock()
+
+    def attach(self, path: str, identity: dict):
+        with self.lock:
+            self.path = path
+            self.identity = identity
+            if not exists(path):
+                return
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                return
+            if data.get("identity") != identity:
+                return
+            if self.entries is None:
+                self.entries = data["entries"]
+                self.fetched_at = data["fetched_at"]
+
+    def get(self) -> Optional[dict]:
+        # Returns None when the listing has to be fetched again
+        with self.lock:
+            if self.entries is None:
+                return None
+            if time.time() - self.fetched_at > self.ttl:
+                return None
+            return self.entries
+
+    def replace(self, entries: dict):
+        with self.lock:
+            self.entries = entries
+            self.fetched_at = time.time()
+            self._save()
+
+    def invalidate(self):
+        with self.lock:
+            self.entries = None
+            self.fetched_at = 0.0
+            if self.path is not None and exists(self.path):
+                os.remove(self.path)
+
+    def add(self, ex_name: str, metadata: Optional[dict] = None):
+        with self.lock:
+            if self.entries is None:
+                return
+            self.entries[ex_name] = metadata if metadata is not None else {}
+            self._save()
+
+    def remove(self, ex_name: str):
+        with self.lock:
+            if self.entries is None:
+                return
+            self.entries.pop(ex_name, None)
+            self._save()
+
+    def rename(self, ex_name: str, new_ex_name: str):
+        with self.lock:
+            if self.entries is None or ex_name not in self.entries:
+                return
+            self.entries[new_ex_name] = self.entries.pop(ex_name)
+            self._save()
+
+    def _save(self):
+        if self.path is None or self.entries is None:
+            return
+        os.makedirs(dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "identity": self.identity,
+                    "fetched_at": self.fetched_at,
+                    "entries": self.entries,
+                },
+                f,
+            )
+        os.replace(tmp_path, self.path)
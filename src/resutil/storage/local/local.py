@@ -0,0 +1,236 @@
+from os.path import join, exists, isdir, basename
+from typing import Iterable, Iterator
+import os
+import shutil
+
+from ..storage import (
+    Storage,
+    STORAGE_FORMATS,
+    ZIP_SUFFIX,
+    MANIFEST_SUFFIX,
+    experiment_name_from_object_name,
+)
+
+COPY_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def copy_file(src: str, dst: str, hardlink: bool = False):
+    """Copy `src` to `dst` as cheaply as the filesystem allows.
+
+    With `hardlink`, `dst` shares the inode of `src` when both are on the same
+    filesystem. Otherwise copy_file_range lets the kernel copy the data, which
+    is a reflink or a server side copy on filesystems that support it.
+    """
+    if hardlink:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+
+    if hasattr(os, "copy_file_range"):
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    n = os.copy_file_range(
+                        fsrc.fileno(), fdst.fileno(), min(remaining, 1 << 30)
+                    )
+                    if n == 0:
+                        break
+                    remaining -= n
+            shutil.copystat(src, dst)
+            return
+        except OSError:
+            # e.g. EXDEV on old kernels, or a filesystem without support
+            pass
+
+    shutil.copy2(src, dst)
+
+
+def copy_tree(src_dir: str, dst_dir: str, hardlink: bool = False, select=None):
+    # select(relative path) chooses the files to copy
+    for root, dirs, files in os.walk(src_dir):
+        rel_root = os.path.relpath(root, src_dir)
+        dst_root = join(dst_dir, rel_root)
+        os.makedirs(dst_root, exist_ok=True)
+        for file in files:
+            rel_path = file if rel_root == "." else f"{rel_root}/{file}"
+            if select is not None and not select(rel_path.replace(os.sep, "/")):
+                continue
+            copy_file(join(root, file), join(dst_root, file), hardlink)
+
+
+class LocalStorage(Storage):
+    """Storage on a local or shared (NFS, Lustre, ...) filesystem.
+
+    Experiments are stored as plain directories by default, so that push and
+    pull are file copies. The zip and chunked formats are supported as well.
+    """
+
+    formats = STORAGE_FORMATS + ["directory"]
+    default_format = "directory"
+    # the archives are local files already
+    cache_archives = False
+
+    def __init__(self, storage_config: dict, project_name: str):
+        super().__init__(storage_config, project_name)
+        self.base_path = storage_config["path"]
+        if not isdir(self.base_path):
+            raise ValueError(f"Storage dir not found at {self.base_path}")
+        self.path = join(self.base_path, project_name)
+        os.makedirs(self.path, exist_ok=True)
+        # Hardlinked files share their data with the local results dir, so
+        # modifying one in place modifies the other
+        self.hardlink = bool(storage_config.get("hardlink", False))
+
+        self.max_workers = 4
+
+    def get_info(self) -> dict:
+        return {
+            "project_dir": self.project_dir,
+            "path": self.base_path,
+        }
+
+    def upload_experiment(self, zip_path: str):
+        ex_name = basename(zip_path)[: -len(ZIP_SUFFIX)]
+        tmp_path = self._tmp_path(basename(zip_path))
+        copy_file(zip_path, tmp_path, self.hardlink)
+        os.replace(tmp_path, join(self.path, basename(zip_path)))
+        self._remove_experiment_dir(ex_name)
+        self.index.add(ex_name, self._metadata(basename(zip_path)))
+
+    def upload_experiment_stream(self, ex_name: str, chunks: Iterable[bytes]):
+        tmp_path = self._tmp_path(ex_name + ZIP_SUFFIX)
+        with open(tmp_path, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp_path, join(self.path, ex_name + ZIP_SUFFIX))
+        self._remove_experiment_dir(ex_name)
+        self.index.add(ex_name, self._metadata(ex_name + ZIP_SUFFIX))
+
+    def download_experiment(self, zip_path: str):
+        copy_file(join(self.path, basename(zip_path)), zip_path, self.hardlink)
+
+    def download_experiment_stream(self, ex_name: str) -> Iterator[bytes]:
+        with open(join(self.path, ex_name + ZIP_SUFFIX), "rb") as f:
+            while True:
+                chunk = f.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    def exist_experiment_dir(self, ex_name: str) -> bool:
+        return isdir(join(self.path, ex_name))
+
+    def experiment_dir_path(self, ex_name: str) -> str:
+        return join(self.path, ex_name)
+
+    def upload_experiment_dir(self, ex_name: str, ex_dir: str):
+        tmp_dir = self._tmp_path(ex_name)
+        try:
+            copy_tree(ex_dir, tmp_dir, self.hardlink)
+            self._remove_experiment_dir(ex_name)
+            os.rename(tmp_dir, join(self.path, ex_name))
+        finally:
+            if exists(tmp_dir):
+                shutil.rmtree(tmp_dir)
+        for suffix in (ZIP_SUFFIX, MANIFEST_SUFFIX):
+            if self.exist_object(ex_name + suffix):
+                self.delete_object(ex_name + suffix)
+        self.index.add(ex_name, self._metadata(ex_name))
+
+    def download_experiment_dir(self, ex_name: str, dst_dir: str, select=None):
+        copy_tree(join(self.path, ex_name), dst_dir, self.hardlink, select)
+
+    def experiment_zip_size(self, ex_name: str) -> int:
+        return os.path.getsize(join(self.path, ex_name + ZIP_SUFFIX))
+
+    def read_experiment_zip(self, ex_name: str, offset: int, length: int) -> bytes:
+        with open(join(self.path, ex_name + ZIP_SUFFIX), "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def _list_experiments(self) -> dict:
+        experiments = {}
+        for entry in os.scandir(self.path):
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir():
+                ex_name = entry.name
+            else:
+                ex_name = experiment_name_from_object_name(entry.name)
+            if ex_name is not None:
+                experiments[ex_name] = self._metadata(entry.name, entry.stat())
+        return experiments
+
+    def remove_experiment(self, ex_name: str):
+        self._remove_experiment_dir(ex_name)
+        for suffix in (ZIP_SUFFIX, MANIFEST_SUFFIX):
+            if self.exist_object(ex_name + suffix):
+                self.delete_object(ex_name + suffix)
+        self.index.remove(ex_name)
+
+    def change_comment(self, ex_name, new_comment):
+        new_ex_name = f"{ex_name.split('_')[0]}_{ex_name.split('_')[1]}_{new_comment}"
+        for suffix in ("", ZIP_SUFFIX, MANIFEST_SUFFIX):
+            if exists(join(self.path, ex_name + suffix)):
+                os.rename(
+                    join(self.path, ex_name + suffix),
+                    join(self.path, new_ex_name + suffix),
+                )
+        self.index.rename(ex_name, new_ex_name)
+
+    def put_object(self, key: str, data: bytes) -> dict:
+        path = join(self.path, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return self._metadata(key)
+
+    def get_object(self, key: str) -> bytes:
+        with open(join(self.path, key), "rb") as f:
+            return f.read()
+
+    def exist_object(self, key: str) -> bool:
+        return os.path.isfile(join(self.path, key))
+
+    def list_objects(self, prefix: str) -> list[str]:
+        folder = join(self.path, prefix)
+        if not isdir(folder):
+            return []
+        return [
+            prefix + entry.name
+            for entry in os.scandir(folder)
+            if entry.is_file() and not entry.name.endswith(".tmp")
+        ]
+
+    def delete_object(self, key: str):
+        os.remove(join(self.path, key))
+
+    def _remove_experiment_dir(self, ex_name: str):
+        if isdir(join(self.path, ex_name)):
+            # rename first, so that the experiment disappears at once
+            trash_dir = self._tmp_path(ex_name + ".removed")
+            os.rename(join(self.path, ex_name), trash_dir)
+            shutil.rmtree(trash_dir)
+
+    def _tmp_path(self, name: str) -> str:
+        # dot names are skipped by the listing
+        return join(self.path, f".{name}.{os.getpid()}.tmp")
+
+    def _metadata(self, name: str, stat=None) -> dict:
+        stat = stat or os.stat(join(self.path, name))
+        if name.endswith(MANIFEST_SUFFIX):
+            format = "chunked"
+        elif name.endswith(ZIP_SUFFIX):
+            format = "zip"
+        else:
+            format = "directory"
+        return {
+            "format": format,
+            "size": None if format == "directory" else stat.st_size,
+            "mtime": stat.st_mtime,
+        }
@@ -0,0 +1,641 @@
+"""Resumable uploads and downloads over HTTP.
+
+ResumableUpload speaks Google's resumable upload protocol, which Cloud
+Storage and Drive share: a session URL is created once, chunks are PUT with
+a Content-Range header, and the server answers 308 with the committed range
+until the last chunk. ResumableDownload fetches an object range by range.
+
+Both retry failed requests with exponential backoff and, when given a state
+path, persist their progress so that a later run continues where an
+interrupted one stopped.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from os.path import exists, dirname, getsize
+from typing import Callable, Iterable, Iterator, Optional
+import hashlib
+import json
+import os
+import random
+import shutil
+import sys
+import threading
+import time
+
+from ..archive import STREAM_CHUNK_SIZE
+
+# Chunks of a resumable upload, except the last one, must be multiples of
+# 256 KiB
+CHUNK_ALIGNMENT = 256 * 1024
+DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024
+DEFAULT_SLICE_SIZE = 64 * 1024 * 1024
+# Archives pulled in slices instead of streamed. Sliced pulls are faster, but
+# write the whole archive to disk before extracting it.
+DEFAULT_SLICE_THRESHOLD = 1024 * 1024 * 1024
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+# Responses telling the client to slow down
+THROTTLE_STATUS = {429, 503}
+
+
+def aligned_chunk_size(chunk_size) -> int:
+    chunk_size = int(chunk_size)
+    return max(CHUNK_ALIGNMENT, chunk_size - chunk_size % CHUNK_ALIGNMENT)
+
+
+class TransferError(Exception):
+    pass
+
+
+class HTTPStatusError(TransferError):
+    def __init__(self, response):
+        super().__init__(
+            f"{response.request.method} {response.url} returned "
+            f"{response.status_code}: {response.text[:200]}"
+        )
+        self.status_code = response.status_code
+
+
+class ResumeMismatch(TransferError):
+    # The data of a resumed upload differs from what was uploaded before.
+    # The session has been discarded, the upload has to start over.
+    pass
+
+
+def is_retryable(e: Exception) -> bool:
+    if isinstance(e, HTTPStatusError):
+        return e.status_code in RETRYABLE_STATUS
+    if isinstance(e, ConnectionError):
+        return True
+    if hasattr(e, "resp"):
+        # googleapiclient errors
+        return getattr(e.resp, "status", None) in RETRYABLE_STATUS or is_throttled(e)
+    # requests is slow to import. It is loaded by the backends raising its
+    # errors, so it is not needed before.
+    requests = sys.modules.get("requests")
+    return requests is not None and isinstance(
+        e,
+        (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+        ),
+    )
+
+
+def is_throttled(e: Exception) -> bool:
+    # HTTPStatusError, google.api_core (code) and googleapiclient (resp.status)
+    # errors
+    status = getattr(e, "status_code", None) or getattr(e, "code", None)
+    if status is None and hasattr(e, "resp"):
+        status = getattr(e.resp, "status", None)
+    try:
+        status = int(status)
+    except (TypeError, ValueError):
+        return False
+    if status == 403:
+        # Drive reports exceeded rate limits as 403
+        return "ratelimitexceeded" in str(e).lower()
+    return status in THROTTLE_STATUS
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter.
+
+    `throttles` counts the retries caused by the backend asking to slow
+    down, so that schedulers can reduce the number of concurrent transfers.
+    """
+
+    def __init__(
+        self, max_retries: int = 8, initial_delay: float = 1.0, max_delay: float = 60.0
+    ):
+        self.max_retries = max_retries
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.throttles = 0
+        self._lock = threading.Lock()
+
+    def note_throttle(self):
+        with self._lock:
+            self.throttles += 1
+
+    @classmethod
+    def from_config(cls, storage_config: dict) -> "RetryPolicy":
+        return cls(
+            max_retries=int(storage_config.get("max_retries", 8)),
+            initial_delay=float(storage_config.get("retry_initial_delay", 1.0)),
+        )
+
+    def sleep(self, attempt: int):
+        delay = min(self.max_delay, self.initial_delay * 2**attempt)
+        time.sleep(random.uniform(0, delay))
+
+    def call(self, func: Callable):
+        attempt = 0
+        while True:
+            try:
+                return func()
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                if is_throttled(e):
+                    self.note_throttle()
+            self.sleep(attempt)
+            attempt += 1
+
+
+def check_response(response):
+    if response.status_code >= 400:
+        raise HTTPStatusError(response)
+    return response
+
+
+def load_state(path: Optional[str]) -> Optional[dict]:
+    if path is None or not exists(path):
+        return None
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_state(path: Optional[str], state: dict):
+    if path is None:
+        return
+    os.makedirs(dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def remove_state(*paths):
+    for path in paths:
+        if path is not None and exists(path):
+            os.remove(path)
+
+
+def fetch_range(session, url, offset, length, retry: RetryPolicy) -> bytes:
+    def fetch():
+        headers = {"Range": f"bytes={offset}-{offset + length - 1}"}
+        response = check_response(session.get(url, headers=headers))
+        if response.status_code != 206:
+            raise TransferError(f"{url} does not support range requests")
+        return response.content
+
+    if length <= 0:
+        return b""
+    return retry.call(fetch)
+
+
+def iter_file_chunks(path: str, chunk_size: int = STREAM_CHUNK_SIZE):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _iter_blocks(chunks: Iterable[bytes], block_size: int):
+    # Yields (block, is_last). Every block but the last is block_size long.
+    buffer = bytearray()
+    pending = None
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) > block_size:
+            if pending is not None:
+                yield pending, False
+            pending = bytes(buffer[:block_size])
+            del buffer[:block_size]
+    if len(buffer) > 0:
+        if pending is not None:
+            yield pending, False
+        pending = bytes(buffer)
+    yield (pending if pending is not None else b""), True
+
+
+def _digest(block: bytes) -> str:
+    return hashlib.sha256(block).hexdigest()[:32]
+
+
+class ResumableUpload:
+    """Upload of a stream of unknown length through a resumable session.
+
+    `initiate` creates the session and returns its URL. `target` identifies
+    the destination and is stored with the session, so that a persisted
+    session is only resumed for the same destination. The digest of every
+    chunk is persisted too: when resuming, the stream is regenerated and the
+    already uploaded part is checked against them instead of being sent.
+    """
+
+    def __init__(
+        self,
+        session,
+        initiate: Callable[[], str],
+        target: dict,
+        state_path: Optional[str] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        retry: Optional[RetryPolicy] = None,
+    ):
+        self.session = session
+        self.initiate = initiate
+        self.target = target
+        self.state_path = state_path
+        self.chunk_size = aligned_chunk_size(chunk_size)
+        self.retry = retry or RetryPolicy()
+
+    def upload(self, chunks: Iterable[bytes]) -> dict:
+        """Upload `chunks` and return the JSON response of the last request."""
+        url, offset, digests = self._resume()
+        if url is None:
+            url = self.retry.call(self.initiate)
+            offset = 0
+            digests = []
+            self._save(url, offset, digests)
+
+        position = 0
+        for index, (block, last) in enumerate(_iter_blocks(chunks, self.chunk_size)):
+            end = position + len(block)
+            if index < len(digests):
+                if _digest(block) != digests[index]:
+                    remove_state(self.state_path)
+                    raise ResumeMismatch("The data differs from the interrupted upload")
+            else:
+                digests.append(_digest(block))
+            if end <= offset and not last:
+                position = end
+                continue
+
+            offset, result = self._send(url, block, position, offset, last)
+            if result is not None:
+                remove_state(self.state_path)
+                return result
+            self._save(url, offset, digests)
+            position = end
+
+        raise TransferError("The server did not complete the upload")
+
+    def _resume(self):
+        state = load_state(self.state_path)
+        if state is None or state.get("target") != self.target:
+            return None, 0, []
+        if state.get("chunk_size") != self.chunk_size:
+            return None, 0, []
+        try:
+            offset, result = self.retry.call(lambda: self._query(state["url"]))
+        except HTTPStatusError as e:
+            if e.status_code in (404, 410):
+                # the session expired
+                return None, 0, []
+            raise
+        if result is not None:
+            # completed, but the state was not removed
+            return None, 0, []
+        return state["url"], offset, state["digests"]
+
+    def _save(self, url, offset, digests):
+        save_state(
+            self.state_path,
+            {
+                "target": self.target,
+                "url": url,
+                "chunk_size": self.chunk_size,
+                "offset": offset,
+                "digests": digests,
+            },
+        )
+
+    def _query(self, url):
+        # Returns (committed offset, final response or None)
+        response = self.session.put(
+            url, data=b"", headers={"Content-Range": "bytes */*"}
+        )
+        if response.status_code in (200, 201):
+            return None, _json(response)
+        if response.status_code == 308:
+            return _committed_offset(response), None
+        raise HTTPStatusError(response)
+
+    def _send(self, url, block, position, offset, last):
+        # Sends the part of block the server does not have yet. Returns
+        # (committed offset, final response or None).
+        end = position + len(block)
+        total = str(end) if last else "*"
+        attempt = 0
+        while True:
+            if offset < position:
+                # the preceding chunks are not kept
+                raise TransferError("The server lost already committed data")
+            start = offset
+            if start < end:
+                content_range = f"bytes {start}-{end - 1}/{total}"
+            else:
+                content_range = f"bytes */{total}"
+            try:
+                response = self.session.put(
+                    url,
+                    data=block[start - position :],
+                    headers={"Content-Range": content_range},
+                )
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.retry.max_retries:
+                    raise
+                response = None
+
+            if response is not None:
+                if response.status_code in THROTTLE_STATUS:
+                    self.retry.note_throttle()
+                if response.status_code in (200, 201):
+                    return end, _json(response)
+                if response.status_code == 308:
+                    committed = _committed_offset(response)
+                    if committed >= end:
+                        return committed, None
+                    if committed > offset:
+                        # the server kept only a part, send the rest
+                        offset = committed
+                        attempt = 0
+                        continue
+                elif (
+                    response.status_code not in RETRYABLE_STATUS
+                    or attempt >= self.retry.max_retries
+                ):
+                    raise HTTPStatusError(response)
+            if attempt >= self.retry.max_retries:
+                raise TransferError(f"No progress uploading {content_range}")
+
+            self.retry.sleep(attempt)
+            attempt += 1
+            offset, result = self.retry.call(lambda: self._query(url))
+            if result is not None:
+                return end, result
+
+
+def _committed_offset(response) -> int:
+    # "Range: bytes=0-1234" means 1235 bytes are committed
+    range_header = response.headers.get("Range")
+    if range_header is None:
+        return 0
+    return int(range_header.split("-")[-1]) + 1
+
+
+def _json(response) -> dict:
+    try:
+        return response.json()
+    except ValueError:
+        return {}
+
+
+class ResumableDownload:
+    """Download of `url` in ranges of `chunk_size` bytes.
+
+    A range that fails is requested again from the offset reached. With
+    `state_path` and `part_path`, the received bytes are also written to
+    `part_path`, and a later download of the same `url` and `version`
+    replays them and only fetches the rest.
+    """
+
+    def __init__(
+        self,
+        session,
+        url: str,
+        version: dict,
+        state_path: Optional[str] = None,
+        part_path: Optional[str] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        retry: Optional[RetryPolicy] = None,
+    ):
+        self.session = session
+        self.url = url
+        self.version = version
+        self.state_path = state_path
+        self.part_path = part_path if state_path is not None else None
+        self.chunk_size = int(chunk_size)
+        self.retry = retry or RetryPolicy()
+
+    def iter_chunks(self) -> Iterator[bytes]:
+        offset = 0
+        state = load_state(self.state_path)
+        if (
+            state is not None
+            and state.get("url") == self.url
+            and state.get("version") == self.version
+            and self.part_path is not None
+            and exists(self.part_path)
+        ):
+            offset = min(state["offset"], getsize(self.part_path))
+            with open(self.part_path, "rb") as f:
+                remaining = offset
+                while remaining > 0:
+                    chunk = f.read(min(remaining, STREAM_CHUNK_SIZE))
+                    remaining -= len(chunk)
+                    yield chunk
+        else:
+            remove_state(self.part_path)
+
+        part = None
+        if self.part_path is not None:
+            os.makedirs(dirname(self.part_path), exist_ok=True)
+            part = open(self.part_path, "r+b" if exists(self.part_path) else "wb")
+            part.truncate(offset)
+            part.seek(offset)
+        try:
+            while True:
+                data, total = self.retry.call(lambda: self._fetch(offset))
+                if part is not None and data:
+                    part.write(data)
+                    part.flush()
+                    save_state(
+                        self.state_path,
+                        {
+                            "url": self.url,
+                            "version": self.version,
+                            "offset": offset + len(data),
+                        },
+                    )
+                offset += len(data)
+                if data:
+                    yield data
+                if total is None or offset >= total or not data:
+                    break
+        finally:
+            if part is not None:
+                part.close()
+        remove_state(self.state_path, self.part_path)
+
+    def _fetch(self, offset):
+        # Returns (data, total size or None when unknown)
+        headers = {"Range": f"bytes={offset}-{offset + self.chunk_size - 1}"}
+        response = self.session.get(self.url, headers=headers)
+        if response.status_code == 416:
+            # offset is at the end, e.g. an empty object
+            return b"", offset
+        check_response(response)
+        if response.status_code == 200:
+            # the whole object, the server ignored the range
+            return response.content[offset:], len(response.content)
+        content_range = response.headers.get("Content-Range", "")
+        total = content_range.split("/")[-1]
+        return response.content, None if total in ("", "*") else int(total)
+
+
+def _pwrite(fd, data, offset, lock):
+    if hasattr(os, "pwrite"):
+        os.pwrite(fd, data, offset)
+        return
+    # no positioned writes on Windows
+    with lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        os.write(fd, data)
+
+
+def file_checksums(path: str, kinds) -> dict:
+    # {kind: hex digest} of the file, kind is "md5" or "crc32c"
+    hashes = {}
+    for kind in kinds:
+        if kind == "md5":
+            hashes[kind] = hashlib.md5()
+        elif kind == "crc32c":
+            import google_crc32c
+
+            hashes[kind] = google_crc32c.Checksum()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            for h in hashes.values():
+                h.update(chunk)
+    return {kind: h.digest().hex() for kind, h in hashes.items()}
+
+
+class SlicedDownload:
+    """Download of `url` into a file, `workers` byte ranges at a time.
+
+    The file is preallocated and each slice is written at its offset. With
+    `state_path` and `part_path`, the object is downloaded into `part_path`
+    and the finished slices are recorded, so that a later download of the
+    same `url` and `version` only fetches the missing ones.
+    `checksums` ({"md5" or "crc32c": hex digest}) of the whole object are
+    verified at the end.
+    """
+
+    def __init__(
+        self,
+        session,
+        url: str,
+        size: int,
+        version: dict,
+        checksums: Optional[dict] = None,
+        state_path: Optional[str] = None,
+        part_path: Optional[str] = None,
+        slice_size: int = DEFAULT_SLICE_SIZE,
+        workers: int = 8,
+        retry: Optional[RetryPolicy] = None,
+    ):
+        self.session = session
+        self.url = url
+        self.size = size
+        self.version = version
+        self.checksums = checksums or {}
+        self.state_path = state_path
+        self.part_path = part_path if state_path is not None else None
+        self.slice_size = int(slice_size)
+        self.workers = max(1, int(workers))
+        self.retry = retry or RetryPolicy()
+        self.lock = threading.Lock()
+
+    def download(self, dst_path: str):
+        path = self.part_path or dst_path
+        if self.part_path is not None:
+            os.makedirs(dirname(path), exist_ok=True)
+        slice_count = max(1, -(-self.size // self.slice_size))
+        done = self._resume(path)
+        if not done:
+            with open(path, "wb") as f:
+                f.truncate(self.size)
+            if hasattr(os, "posix_fallocate") and self.size > 0:
+                fd = os.open(path, os.O_RDWR)
+                try:
+                    os.posix_fallocate(fd, 0, self.size)
+                finally:
+                    os.close(fd)
+            self._save(done)
+
+        fd = os.open(path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = [
+                    executor.submit(self._fetch_slice, fd, i, done)
+                    for i in range(slice_count)
+                    if i not in done
+                ]
+                try:
+                    for future in futures:
+                        future.result()
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            os.close(fd)
+
+        actual = file_checksums(path, self.checksums)
+        if actual != self.checksums:
+            remove_state(self.state_path, path)
+            raise TransferError(
+                f"Checksum mismatch for {self.url}: {actual} != {self.checksums}"
+            )
+        remove_state(self.state_path)
+        if path != dst_path:
+            shutil.move(path, dst_path)
+
+    def _resume(self, path) -> set:
+        state = load_state(self.state_path)
+        if (
+            state is None
+            or state.get("url") != self.url
+            or state.get("version") != self.version
+            or state.get("slice_size") != self.slice_size
+            or not exists(path)
+            or getsize(path) != self.size
+        ):
+            return set()
+        return set(state["done"])
+
+    def _save(self, done):
+        save_state(
+            self.state_path,
+            {
+                "url": self.url,
+                "version": self.version,
+                "slice_size": self.slice_size,
+                "done": sorted(done),
+            },
+        )
+
+    def _fetch_slice(self, fd, index, done):
+        offset = index * self.slice_size
+        end = min(offset + self.slice_size, self.size)
+        position = [offset]
+
+        def fetch():
+            # continues after the bytes written by a failed attempt
+            headers = {"Range": f"bytes={position[0]}-{end - 1}"}
+            with self.session.get(self.url, headers=headers, stream=True) as response:
+                check_response(response)
+                if response.status_code != 206:
+                    raise TransferError(f"{self.url} does not support range requests")
+                for data in response.iter_content(STREAM_CHUNK_SIZE):
+                    data = data[: end - position[0]]
+                    _pwrite(fd, data, position[0], self.lock)
+                    position[0] += len(data)
+            if position[0] < end:
+                raise ConnectionError(f"Connection closed at {position[0]}")
+
+        if offset < end:
+            self.retry.call(fetch)
+        with self.lock:
+            done.add(index)
+            self._save(done)
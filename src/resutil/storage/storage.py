@@ -1,15 +1,252 @@
+from functools import wraps
+from os.path import join, getsize
+import tempfile
+from typing import Iterable, Iterator, Optional
+
+from .index import ExperimentIndex, DEFAULT_INDEX_TTL
+from .resumable import RetryPolicy
+from .. import metrics
+
+ZIP_SUFFIX = ".zip"
+MANIFEST_SUFFIX = ".manifest.json"
+STORAGE_FORMATS = ["zip", "chunked"]
+
+
+def experiment_name_from_object_name(name: str) -> Optional[str]:
+    # Top level objects of a project dir are either `<ex_name>.zip` or
+    # `<ex_name>.manifest.json` (chunked format). Anything else is not an
+    # experiment.
+    for suffix in (ZIP_SUFFIX, MANIFEST_SUFFIX):
+        if name.endswith(suffix):
+            return name[: -len(suffix)]
+    return None
+
+
+# Methods recorded as "storage.<name>" phases when metrics are enabled
+INSTRUMENTED_METHODS = [
+    "upload_experiment",
+    "upload_experiment_stream",
+    "download_experiment",
+    "download_experiment_stream",
+    "upload_experiment_dir",
+    "download_experiment_dir",
+    "list_experiments",
+    "_list_experiments",
+    "get_all_experiment_names",
+    "exist_experiment",
+    "remove_experiment",
+    "change_comment",
+    "put_object",
+    "put_new_object",
+    "get_object",
+    "read_experiment_zip",
+    "exist_object",
+    "list_objects",
+    "delete_object",
+]
+
+
+def _count_bytes(chunks, phase):
+    for chunk in chunks:
+        phase.add(bytes=len(chunk))
+        yield chunk
+
+
+def _instrument(name, method):
+    phase_name = f"storage.{name}"
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not metrics.enabled():
+            return method(self, *args, **kwargs)
+
+        fields = {"backend": type(self).__name__}
+        if args and isinstance(args[0], str):
+            fields["target"] = args[0]
+
+        if name == "download_experiment_stream":
+            # time spent producing the chunks, i.e. receiving them
+            return metrics.counting_iter(
+                method(self, *args, **kwargs), phase_name, **fields
+            )
+
+        with metrics.phase(phase_name, **fields) as phase:
+            if name == "upload_experiment_stream" and len(args) > 1:
+                args = (args[0], _count_bytes(args[1], phase), *args[2:])
+            result = method(self, *args, **kwargs)
+            if name in ("upload_experiment", "download_experiment"):
+                phase.add(bytes=getsize(args[0]), files=1)
+            elif name in ("put_object", "put_new_object"):
+                phase.add(bytes=len(args[1]), files=1)
+            elif name == "get_object":
+                phase.add(bytes=len(result), files=1)
+            elif name == "read_experiment_zip":
+                phase.add(bytes=len(result))
+            return result
+
+    wrapper.instrumented = True
+    return wrapper
+
+
+def _instrument_methods(cls):
+    for name in INSTRUMENTED_METHODS:
+        method = cls.__dict__.get(name)
+        if method is not None and not getattr(method, "instrumented", False):
+            setattr(cls, name, _instrument(name, method))
+
+
 class Storage:
+    formats = STORAGE_FORMATS
+    default_format = "zip"
+    # Whether pulled archives are kept in the local archive cache
+    cache_archives = True
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        _instrument_methods(cls)
+
     def __init__(self, storage_config: dict, project_name: str):
-        pass
+        self.project_dir = project_name
+        self.storage_format = storage_config.get("format", self.default_format)
+        if self.storage_format not in self.formats:
+            raise ValueError(f"format must be one of {', '.join(self.formats)}")
+        self.max_workers = 1
+        # Upper limit of concurrent experiment transfers, max_workers if None
+        self.max_transfers = storage_config.get("max_transfers")
+        self.index = ExperimentIndex(
+            ttl=float(storage_config.get("index_ttl", DEFAULT_INDEX_TTL))
+        )
+        self.persist_index = bool(storage_config.get("persist_index", False))
+        self.retry = RetryPolicy.from_config(storage_config)
+        # Where resumable transfers keep their progress, set by initialize().
+        # Interrupted transfers can not be resumed while it is None.
+        self.transfer_state_dir = None
+        # Whether streamed downloads also write the received bytes to a part
+        # file, so that an interrupted pull can continue. It doubles the disk
+        # space a pull needs, the archive next to the extracted files.
+        self.spool_downloads = bool(storage_config.get("spool_downloads", False))
 
     def get_info(self) -> dict:
         return {}
 
+    def transfer_state_path(self, ex_name: str, kind: str) -> Optional[str]:
+        if self.transfer_state_dir is None:
+            return None
+        return join(self.transfer_state_dir, f"{ex_name}.{kind}")
+
+    def download_state_path(self, ex_name: str) -> Optional[str]:
+        # state of a streamed download, None unless spool_downloads is set
+        if not self.spool_downloads:
+            return None
+        return self.transfer_state_path(ex_name, "download.json")
+
     def upload_experiment(self, zip_path: str):
         pass
 
+    def upload_experiment_stream(self, ex_name: str, chunks: Iterable[bytes]):
+        # Fallback for backends without native streaming: spool to a temp file
+        with tempfile.TemporaryDirectory() as temp_dir:
+            zip_path = join(temp_dir, f"{ex_name}.zip")
+            with open(zip_path, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            self.upload_experiment(zip_path)
+
     def download_experiment(self, zip_path: str):
         pass
 
+    def download_experiment_stream(self, ex_name: str) -> Iterator[bytes]:
+        # Fallback for backends without native streaming
+        with tempfile.TemporaryDirectory() as temp_dir:
+            zip_path = join(temp_dir, f"{ex_name}.zip")
+            self.download_experiment(zip_path)
+            with open(zip_path, "rb") as f:
+                while True:
+                    chunk = f.read(16 * 1024 * 1024)
+                    if not chunk:
+                        return
+                    yield chunk
+
+    def use_sliced_download(self, ex_name: str) -> bool:
+        # Whether download_experiment fetches the archive in concurrent
+        # slices, which is faster than streaming it for large archives
+        return False
+
+    # Random access to zip archives, used to pull selected files only
+
+    def experiment_zip_size(self, ex_name: str) -> int:
+        raise NotImplementedError()
+
+    def read_experiment_zip(self, ex_name: str, offset: int, length: int) -> bytes:
+        raise NotImplementedError()
+
+    # Experiments stored as plain directories ("directory" format), only
+    # supported by LocalStorage
+
+    def exist_experiment_dir(self, ex_name: str) -> bool:
+        return False
+
+    def experiment_dir_path(self, ex_name: str) -> str:
+        raise NotImplementedError()
+
+    def upload_experiment_dir(self, ex_name: str, ex_dir: str):
+        raise NotImplementedError()
+
+    def download_experiment_dir(self, ex_name: str, dst_dir: str, select=None):
+        raise NotImplementedError()
+
+    def list_experiments(self, refresh: bool = False) -> dict:
+        """Return {ex_name: metadata} of the remote experiments.
+
+        The listing is served from `self.index` until it expires or
+        `refresh` is True.
+        """
+        entries = None if refresh else self.index.get()
+        if entries is None:
+            entries = self._list_experiments()
+            self.index.replace(entries)
+        return entries
+
+    def refresh_index(self):
+        self.list_experiments(refresh=True)
+
     def get_all_experiment_names(self) -> list[str]:
-        pass
+        return list(self.list_experiments())
+
+    def exist_experiment(self, ex_name: str) -> bool:
+        return ex_name in self.list_experiments()
+
+    def _list_experiments(self) -> dict:
+        # Backend specific full listing of the project dir
+        raise NotImplementedError()
+
+    # Generic object access relative to the project dir. Used by the chunked
+    # storage format, whose objects live next to the experiment zips.
+
+    def put_object(self, key: str, data: bytes) -> Optional[dict]:
+        # Returns the metadata of the written object as listed, if the backend
+        # gets it with the write
+        raise NotImplementedError()
+
+    def put_new_object(self, key: str, data: bytes) -> Optional[dict]:
+        # put_object for keys known not to exist, e.g. chunks missing from a
+        # listing. Backends that look keys up before writing skip the lookup.
+        return self.put_object(key, data)
+
+    def get_object(self, key: str) -> bytes:
+        raise NotImplementedError()
+
+    def exist_object(self, key: str) -> bool:
+        raise NotImplementedError()
+
+    def list_objects(self, prefix: str) -> list[str]:
+        # `prefix` is a folder such as "" or ".chunks/", and only the objects
+        # directly in it are listed
+        raise NotImplementedError()
+
+    def delete_object(self, key: str):
+        # raises FileNotFoundError if `key` does not exist
+        raise NotImplementedError()
+
+
+_instrument_methods(Storage)
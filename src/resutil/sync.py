@@ -0,0 +1,197 @@
+from dataclasses import dataclass, field
+from os.path import join
+from typing import Optional
+import hashlib
+import json
+import os
+import threading
+
+from rich import print
+
+from .cache import archive_validator
+from .ex_dir import get_ex_dir_names, get_state_dir, is_partial
+from .planner import get_local_size
+from .scheduler import TransferScheduler
+from .storage import Storage
+from .storage.resumable import load_state, save_state
+from .utils import format_bytes
+
+SYNC_STATE_NAME = "sync.json"
+# sync.json is updated by the transfer threads
+_state_lock = threading.Lock()
+
+
+def get_sync_state_path(results_dir):
+    # {ex_name: {"local": fingerprint, "remote": fingerprint}} as of the
+    # last sync
+    return join(get_state_dir(results_dir), SYNC_STATE_NAME)
+
+
+def local_fingerprint(ex_dir: str) -> str:
+    """Hash of the paths, sizes and modification times of the files."""
+    entries = []
+    for root, dirs, files in os.walk(ex_dir):
+        for file in files:
+            path = join(root, file)
+            st = os.stat(path)
+            entries.append((os.path.relpath(path, ex_dir), st.st_size, st.st_mtime_ns))
+    entries.sort()
+    return hashlib.sha256(json.dumps(entries).encode("utf-8")).hexdigest()
+
+
+def remote_fingerprint(metadata: dict) -> Optional[str]:
+    # None if the backend does not report anything that changes with the
+    # content, e.g. Google Drive without list_metadata
+    validator = archive_validator(metadata)
+    if not validator:
+        return None
+    return json.dumps(validator, sort_keys=True)
+
+
+def record_synced(results_dir: str, ex_name: str, storage: Storage):
+    """Record `ex_name` as being the same locally and remotely.
+
+    Called after every complete push and pull, so that a later sync only
+    transfers the experiment again if it changed since.
+    """
+    local = local_fingerprint(join(results_dir, ex_name))
+    # Uploads index what the backend returned for the written object, which
+    # may lack a validator. The remote side then counts as unchanged until
+    # its fingerprint is known.
+    remote = remote_fingerprint(storage.list_experiments().get(ex_name) or {})
+    with _state_lock:
+        state_path = get_sync_state_path(results_dir)
+        state = load_state(state_path) or {}
+        state[ex_name] = {"local": local, "remote": remote}
+        save_state(state_path, state)
+
+
+@dataclass
+class SyncPlan:
+    uploads: list[str] = field(default_factory=list)
+    downloads: list[str] = field(default_factory=list)
+    # changed on both sides since the last sync, or never synced and not
+    # adopted
+    conflicts: list[str] = field(default_factory=list)
+    unchanged: list[str] = field(default_factory=list)
+    sizes: dict = field(default_factory=dict)
+    # fingerprints recorded once the transfers have completed
+    local: dict = field(default_factory=dict)
+    remote: dict = field(default_factory=dict)
+
+    def total_bytes(self, ex_names: list[str]) -> Optional[int]:
+        if any(self.sizes.get(ex_name) is None for ex_name in ex_names):
+            return None
+        return sum(self.sizes[ex_name] for ex_name in ex_names)
+
+
+def plan_sync(results_dir: str, storage: Storage, adopt: bool = False) -> SyncPlan:
+    """Compare the local and remote experiments with the last sync.
+
+    Experiments that exist on one side only are transferred to the other.
+    Experiments on both sides are transferred in the direction in which
+    they changed since the last sync or push or pull. Without a record,
+    there is nothing to compare their fingerprints with and they are
+    conflicts, unless `adopt` is set: they are then taken to be the same on
+    both sides and are recorded as synced as they are.
+    """
+    plan = SyncPlan()
+    remote_experiments = storage.list_experiments()
+    # partially pulled experiments are not uploaded, and completed instead
+    local_ex_names = {
+        ex_name
+        for ex_name in get_ex_dir_names(results_dir)
+        if not is_partial(results_dir, ex_name)
+    }
+    state = load_state(get_sync_state_path(results_dir)) or {}
+
+    for ex_name in sorted(local_ex_names | set(remote_experiments)):
+        if ex_name in local_ex_names:
+            plan.local[ex_name] = local_fingerprint(join(results_dir, ex_name))
+        if ex_name in remote_experiments:
+            metadata = remote_experiments[ex_name]
+            plan.remote[ex_name] = remote_fingerprint(metadata)
+
+        record = state.get(ex_name)
+        if ex_name not in remote_experiments:
+            plan.uploads.append(ex_name)
+        elif ex_name not in local_ex_names:
+            plan.downloads.append(ex_name)
+        else:
+            if record is None and adopt:
+                record = {"local": plan.local[ex_name], "remote": None}
+                remote_changed = False
+            elif record is None:
+                record = {"local": None, "remote": None}
+                remote_changed = True
+            else:
+                remote_changed = None not in (plan.remote[ex_name], record["remote"])
+                remote_changed = (
+                    remote_changed and plan.remote[ex_name] != record["remote"]
+                )
+            local_changed = plan.local[ex_name] != record["local"]
+            if local_changed and remote_changed:
+                plan.conflicts.append(ex_name)
+            elif local_changed:
+                plan.uploads.append(ex_name)
+            elif remote_changed:
+                plan.downloads.append(ex_name)
+            else:
+                plan.unchanged.append(ex_name)
+
+    for ex_name in plan.uploads:
+        plan.sizes[ex_name] = get_local_size(ex_name, results_dir)
+    for ex_name in plan.downloads:
+        plan.sizes[ex_name] = remote_experiments[ex_name].get("size")
+    return plan
+
+
+def print_sync_plan(plan: SyncPlan):
+    for label, ex_names in (("upload", plan.uploads), ("download", plan.downloads)):
+        if not ex_names:
+            continue
+        print(f"📋 Experiments to {label}:")
+        for ex_name in ex_names:
+            size = plan.sizes.get(ex_name)
+            size_str = "?" if size is None else format_bytes(size)
+            print(f"  📁 {ex_name} ({size_str})")
+        total = plan.total_bytes(ex_names)
+        print(f"  Total: {len(ex_names)} experiment(s), ", end="")
+        print("unknown size" if total is None else format_bytes(total))
+    for ex_name in plan.conflicts:
+        print(
+            f"⚠️ {ex_name} changed locally and remotely, or has never been synced, "
+            "push or pull it explicitly, or sync with --adopt if it is the same"
+        )
+    print(f"  ✅ {len(plan.unchanged)} experiment(s) are up to date")
+
+
+def sync_experiments(results_dir: str, storage: Storage, plan: SyncPlan):
+    """Run the transfers of `plan` and record the synced fingerprints."""
+    from .core import upload, download
+
+    def transfer(ex_name):
+        # push and pull record the transferred experiments
+        if ex_name in plan.uploads:
+            upload(ex_name, results_dir, storage)
+        else:
+            download(ex_name, results_dir, storage)
+
+    try:
+        TransferScheduler(storage, plan.sizes.get).run(
+            transfer, plan.uploads + plan.downloads
+        )
+    finally:
+        with _state_lock:
+            state_path = get_sync_state_path(results_dir)
+            state = load_state(state_path) or {}
+            for ex_name in plan.unchanged:
+                state[ex_name] = {
+                    "local": plan.local[ex_name],
+                    "remote": plan.remote[ex_name],
+                }
+            # forget experiments removed on both sides
+            for ex_name in list(state):
+                if ex_name not in plan.local and ex_name not in plan.remote:
+                    del state[ex_name]
+            save_state(state_path, state)
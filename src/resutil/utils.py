@@ -1,8 +1,9 @@
 import re
 from rich import print
 import readline
+from fnmatch import fnmatchcase
 from pathlib import Path
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Optional
 
 
@@ -84,3 +85,37 @@ class EnvArgs:
     no_interactive: bool
     no_remote: bool
     debug_mode: bool
+    async_checkpoint: bool = False
+
+
+def format_bytes(n: int) -> str:
+    for unit in ["B", "KB", "MB", "GB"]:
+        if n < 1024:
+            return f"{n:.1f} {unit}" if unit != "B" else f"{int(n)} {unit}"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+
+# Always pulled, dependencies are read from it
+EX_YAML_NAME = "resutil-exp.yaml"
+
+
+@dataclass
+class FileSelector:
+    """Selects files of an experiment by glob patterns on their paths.
+
+    Paths are relative to the experiment dir with "/" separators, and "*"
+    also matches "/". A file is selected if it matches one of `include`
+    (or `include` is empty) and none of `exclude`.
+    """
+
+    include: list = field(default_factory=list)
+    exclude: list = field(default_factory=list)
+
+    def __call__(self, path: str) -> bool:
+        path = path.replace("\\", "/")
+        if path == EX_YAML_NAME:
+            return True
+        if self.include and not any(fnmatchcase(path, p) for p in self.include):
+            return False
+        return not any(fnmatchcase(path, p) for p in self.exclude)
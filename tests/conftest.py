@@ -0,0 +1,37 @@
+from resutil.storage import Storage
+from resutil.storage.storage import experiment_name_from_object_name
+
+
+class DictStorage(Storage):
+    def __init__(self):
+        super().__init__({"format": "chunked"}, "proj")
+        self.objects = {}
+        self.puts = 0
+        self.listings = 0
+
+    def _list_experiments(self):
+        self.listings += 1
+        names = [
+            experiment_name_from_object_name(k) for k in self.objects if "/" not in k
+        ]
+        return {n: {} for n in names if n is not None}
+
+    def put_object(self, key, data):
+        self.puts += 1
+        self.objects[key] = data
+
+    def get_object(self, key):
+        if key not in self.objects:
+            raise FileNotFoundError(key)
+        return self.objects[key]
+
+    def exist_object(self, key):
+        return key in self.objects
+
+    def list_objects(self, prefix):
+        return [k for k in self.objects if k.startswith(prefix)]
+
+    def delete_object(self, key):
+        if key not in self.objects:
+            raise FileNotFoundError(key)
+        del self.objects[key]
@@ -0,0 +1,147 @@
+import io
+import os
+import shutil
+import zipfile
+
+import pytest
+
+from resutil import archive
+from resutil.archive import (
+    ArchiveOptions,
+    extract_zip_stream,
+    iter_zip_chunks,
+    unzip_file,
+    zip_directory,
+)
+
+
+def make_tree(root):
+    os.makedirs(os.path.join(root, "subdir"))
+    with open(os.path.join(root, "test.txt"), "w") as f:
+        f.write("Hello World")
+    with open(os.path.join(root, "subdir", "data.bin"), "wb") as f:
+        f.write(os.urandom(300000))
+
+
+def test_iter_zip_chunks_matches_zip_directory(tmp_path):
+    src = tmp_path / "ex"
+    make_tree(src)
+
+    zip_path = tmp_path / "ex.zip"
+    zip_directory(src, zip_path)
+
+    data = b"".join(iter_zip_chunks(src, chunk_size=65536))
+    with zipfile.ZipFile(io.BytesIO(data)) as streamed, zipfile.ZipFile(
+        zip_path
+    ) as staged:
+        assert sorted(streamed.namelist()) == sorted(staged.namelist())
+        for name in staged.namelist():
+            assert streamed.read(name) == staged.read(name)
+
+
+def test_iter_zip_chunks_bounded_chunk_size(tmp_path):
+    src = tmp_path / "ex"
+    make_tree(src)
+
+    chunks = list(iter_zip_chunks(src, chunk_size=65536))
+    assert all(len(c) == 65536 for c in chunks[:-1])
+    assert 0 < len(chunks[-1]) <= 65536
+
+
+def test_iter_zip_chunks_can_be_abandoned(tmp_path):
+    src = tmp_path / "ex"
+    make_tree(src)
+
+    chunks = iter_zip_chunks(src, chunk_size=1024, max_queued_chunks=1)
+    next(chunks)
+    chunks.close()
+
+
+def test_extract_zip_stream(tmp_path):
+    src = tmp_path / "ex"
+    make_tree(src)
+    zip_path = tmp_path / "ex.zip"
+    zip_directory(src, zip_path)
+
+    for chunks in [
+        iter_zip_chunks(src, chunk_size=1000),
+        [zip_path.read_bytes()],
+    ]:
+        dst = tmp_path / "dst"
+        extract_zip_stream(chunks, dst)
+        assert (dst / "test.txt").read_text() == "Hello World"
+        assert (dst / "subdir" / "data.bin").read_bytes() == (
+            src / "subdir" / "data.bin"
+        ).read_bytes()
+        shutil.rmtree(dst)
+
+
+def test_extract_zip_stream_large_chunks(tmp_path):
+    # a member larger than the decompression piece size, followed by another
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("log.txt", "loss: 0.1\n" * 1000000)
+        z.writestr("data.bin", os.urandom(100000))
+        z.writestr("test.txt", "Hello World")
+    data = buffer.getvalue()
+
+    dst = tmp_path / "dst"
+    extract_zip_stream([data[:20000], data[20000:]], dst)
+    assert (dst / "log.txt").read_text() == "loss: 0.1\n" * 1000000
+    assert (dst / "test.txt").read_text() == "Hello World"
+
+
+def test_extract_zip_stream_truncated(tmp_path):
+    src = tmp_path / "ex"
+    make_tree(src)
+    data = b"".join(iter_zip_chunks(src))
+
+    with pytest.raises(zipfile.BadZipFile):
+        extract_zip_stream([data[: len(data) // 2]], tmp_path / "dst")
+
+
+def test_zip_directory_per_file_codec(tmp_path):
+    src = tmp_path / "ex"
+    make_tree(src)
+    (src / "model.PT").write_bytes(os.urandom(1000))
+    (src / "log.txt").write_text("loss: 0.1\n" * 100000)
+
+    options = ArchiveOptions(compression_level=9, workers=4, block_size=65536)
+    zip_path = tmp_path / "ex.zip"
+    zip_directory(src, zip_path, options)
+
+    with zipfile.ZipFile(zip_path) as z:
+        assert z.testzip() is None
+        assert z.getinfo("model.PT").compress_type == zipfile.ZIP_STORED
+        # compressed in several blocks
+        assert z.getinfo("log.txt").compress_type == zipfile.ZIP_DEFLATED
+        assert z.read("log.txt") == (src / "log.txt").read_bytes()
+
+    dst = tmp_path / "dst"
+    unzip_file(zip_path, dst)
+    assert (dst / "subdir" / "data.bin").read_bytes() == (
+        src / "subdir" / "data.bin"
+    ).read_bytes()
+
+
+def test_zip64_records(tmp_path, monkeypatch):
+    src = tmp_path / "ex"
+    make_tree(src)
+    monkeypatch.setattr(archive, "ZIP64_LIMIT", 1000)
+    monkeypatch.setattr(archive, "ZIP_FILECOUNT_LIMIT", 1)
+
+    zip_path = tmp_path / "ex.zip"
+    zip_directory(src, zip_path)
+    data = b"".join(iter_zip_chunks(src))
+    for f in [zip_path, io.BytesIO(data)]:
+        with zipfile.ZipFile(f) as z:
+            assert z.testzip() is None
+            data_bin = (src / "subdir" / "data.bin").read_bytes()
+            assert z.read("subdir/data.bin") == data_bin
+
+
+def test_archive_options_validation():
+    with pytest.raises(ValueError):
+        ArchiveOptions(compression_level=10)
+    options = ArchiveOptions(compression_level=0)
+    assert options.method("a.txt") == zipfile.ZIP_STORED
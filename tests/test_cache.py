@@ -0,0 +1,114 @@
+import os
+
+import pytest
+
+from resutil import cache
+from resutil.archive import iter_zip_chunks
+from resutil.cache import FileCache, set_cache_options
+from resutil.core import download
+
+from conftest import DictStorage
+
+EX_NAME = "aaaaaa_20240101T000000_test"
+
+
+class VersionedZipStorage(DictStorage):
+    def __init__(self, data, project_name="proj"):
+        super().__init__()
+        self.project_dir = project_name
+        self.data = data
+        self.generation = 1
+        self.downloads = 0
+        self.objects[f"{EX_NAME}.zip"] = data
+
+    def get_info(self):
+        return {"bucket_name": "bucket"}
+
+    def _list_experiments(self):
+        return {EX_NAME: {"size": len(self.data), "generation": self.generation}}
+
+    def download_experiment_stream(self, ex_name):
+        self.downloads += 1
+        for i in range(0, len(self.data), 1000):
+            yield self.data[i : i + 1000]
+
+
+@pytest.fixture
+def archive_cache(tmp_path, monkeypatch):
+    monkeypatch.delenv("RESUTIL_CACHE_DIR", raising=False)
+    monkeypatch.delenv("RESUTIL_CACHE_MAX_BYTES", raising=False)
+    monkeypatch.setattr(cache, "archive_cache", None)
+    set_cache_options({"dir": str(tmp_path / "cache")})
+    return cache.archive_cache
+
+
+def make_zip(tmp_path):
+    src = tmp_path / "src"
+    os.makedirs(src / "subdir")
+    (src / "test.txt").write_text("Hello World")
+    (src / "subdir" / "data.bin").write_bytes(os.urandom(100000))
+    return b"".join(iter_zip_chunks(src))
+
+
+def test_pull_is_served_from_the_cache(tmp_path, archive_cache):
+    storage = VersionedZipStorage(make_zip(tmp_path))
+
+    download(EX_NAME, str(tmp_path / "a"), storage)
+    # another results dir pulling from the same project
+    download(EX_NAME, str(tmp_path / "b"), storage)
+
+    assert storage.downloads == 1
+    assert (tmp_path / "b" / EX_NAME / "test.txt").read_text() == "Hello World"
+    [(_, size, _)] = archive_cache.entries()
+    assert size == len(storage.data)
+
+
+def test_changed_archive_is_downloaded_again(tmp_path, archive_cache):
+    storage = VersionedZipStorage(make_zip(tmp_path))
+    download(EX_NAME, str(tmp_path / "a"), storage)
+
+    storage.generation = 2
+    storage.refresh_index()
+    download(EX_NAME, str(tmp_path / "b"), storage)
+
+    assert storage.downloads == 2
+
+
+def test_large_archives_are_not_cached(tmp_path, archive_cache):
+    storage = VersionedZipStorage(make_zip(tmp_path))
+    set_cache_options(
+        {"dir": str(tmp_path / "cache"), "max_bytes": 3 * len(storage.data)}
+    )
+
+    download(EX_NAME, str(tmp_path / "a"), storage)
+    download(EX_NAME, str(tmp_path / "b"), storage)
+
+    assert storage.downloads == 2
+    assert cache.archive_cache.entries() == []
+
+
+def test_cache_options(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "archive_cache", None)
+    monkeypatch.setenv("RESUTIL_CACHE_DIR", str(tmp_path / "env"))
+    monkeypatch.delenv("RESUTIL_CACHE_MAX_BYTES", raising=False)
+
+    set_cache_options({"dir": str(tmp_path / "conf"), "max_bytes": 1000})
+    assert cache.archive_cache.root == str(tmp_path / "env")
+    assert cache.archive_cache.max_bytes == 1000
+
+    monkeypatch.setenv("RESUTIL_CACHE_MAX_BYTES", "0")
+    set_cache_options({"dir": str(tmp_path / "conf")})
+    assert cache.archive_cache is None
+
+
+def test_entries_are_shared_between_caches(tmp_path):
+    # e.g. two processes using the same cache dir
+    first = FileCache(str(tmp_path / "cache"), max_bytes=150)
+    second = FileCache(str(tmp_path / "cache"), max_bytes=150)
+    a = first.put("a", {"generation": 1}, lambda f: f.write(b"a" * 100))
+    os.utime(a, (1, 1))
+
+    assert second.get("a", {"generation": 1}) == a
+    second.put("b", {"generation": 1}, lambda f: f.write(b"b" * 100))
+
+    assert first.get("a", {"generation": 1}) is None
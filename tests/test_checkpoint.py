@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+
+from resutil.checkpoint import (
+    Checkpointer,
+    BackgroundUploader,
+    get_checkpoint_manifest_path,
+)
+from resutil.chunkstore import ChunkStore, CHUNK_PREFIX
+
+from conftest import DictStorage
+
+EX_NAME = "aaaaaa_20240101T000000_test"
+
+
+def test_checkpoint_uploads_only_changed_files(tmp_path):
+    ex_dir = tmp_path / EX_NAME
+    os.makedirs(ex_dir)
+    (ex_dir / "a.bin").write_bytes(os.urandom(100000))
+
+    storage = DictStorage()
+    checkpointer = Checkpointer(EX_NAME, str(tmp_path), storage)
+    checkpointer.save()
+    assert os.path.exists(get_checkpoint_manifest_path(str(tmp_path), EX_NAME))
+
+    (ex_dir / "b.bin").write_bytes(os.urandom(100000))
+    puts = storage.puts
+    checkpointer.save()
+    # chunks of b.bin and the manifest
+    assert storage.puts - puts == 2
+
+    dst = tmp_path / "pulled"
+    ChunkStore(storage).pull(EX_NAME, str(dst))
+    assert sorted(os.listdir(dst)) == ["a.bin", "b.bin"]
+
+
+def test_finalize_chunked(tmp_path):
+    ex_dir = tmp_path / EX_NAME
+    os.makedirs(ex_dir)
+    (ex_dir / "a.txt").write_text("a")
+
+    storage = DictStorage()
+    checkpointer = Checkpointer(EX_NAME, str(tmp_path), storage)
+    checkpointer.save()
+    (ex_dir / "b.txt").write_text("b")
+    checkpointer.finalize()
+
+    assert not os.path.exists(get_checkpoint_manifest_path(str(tmp_path), EX_NAME))
+    manifest = ChunkStore(storage).read_manifest(EX_NAME)
+    assert [e["path"] for e in manifest["files"]] == ["a.txt", "b.txt"]
+    assert len(storage.list_objects(CHUNK_PREFIX)) == 2
+
+
+def test_finalize_zip_keeps_chunks_it_did_not_upload(tmp_path):
+    ex_dir = tmp_path / EX_NAME
+    os.makedirs(ex_dir)
+    (ex_dir / "shared.bin").write_bytes(os.urandom(100000))
+
+    storage = DictStorage()
+    storage.storage_format = "zip"
+    # chunks of another run whose manifest is not written yet
+    other = ChunkStore(storage)
+    other.push("aaaaab_20240101T000000_other", str(ex_dir))
+    del storage.objects["aaaaab_20240101T000000_other.manifest.json"]
+    shared_chunks = set(storage.list_objects(CHUNK_PREFIX))
+
+    checkpointer = Checkpointer(EX_NAME, str(tmp_path), storage)
+    checkpointer.save()
+    (ex_dir / "own.bin").write_bytes(os.urandom(100000))
+    checkpointer.save()
+    checkpointer.finalize()
+
+    assert f"{EX_NAME}.manifest.json" not in storage.objects
+    # the chunk of own.bin is removed, the shared one is kept
+    assert set(storage.list_objects(CHUNK_PREFIX)) == shared_chunks
+
+
+class SlowCheckpointer:
+    def __init__(self, release):
+        self.release = release
+        self.saves = 0
+        self.last_upload_time = None
+
+    def save(self):
+        self.release.wait()
+        self.saves += 1
+        self.last_upload_time = time.time()
+
+
+def test_background_uploader_coalesces_requests():
+    release = threading.Event()
+    checkpointer = SlowCheckpointer(release)
+    uploader = BackgroundUploader(checkpointer)
+
+    uploader.request()
+    while uploader.queue_depth > 0:
+        time.sleep(0.01)
+    # requests made while the first upload is running are coalesced
+    uploader.request()
+    uploader.request()
+    uploader.request()
+    assert uploader.queue_depth == 3
+    assert uploader.last_upload_time is None
+
+    release.set()
+    uploader.close()
+    assert checkpointer.saves == 2
+    assert uploader.queue_depth == 0
+    assert uploader.last_upload_time is not None
@@ -0,0 +1,88 @@
+import io
+import os
+
+from resutil.chunkstore import ChunkStore, iter_chunks, CHUNK_PREFIX
+
+from conftest import DictStorage
+
+
+def test_iter_chunks_content_defined():
+    data = os.urandom(3 * 1024 * 1024)
+    chunks = list(iter_chunks(io.BytesIO(data), min_size=4096, max_size=65536))
+    assert b"".join(chunks) == data
+    assert all(len(c) <= 65536 for c in chunks)
+
+    # A prefix insertion only changes the first chunks
+    shifted = list(
+        iter_chunks(io.BytesIO(b"x" * 100 + data), min_size=4096, max_size=65536)
+    )
+    assert len(set(chunks) & set(shifted)) > len(chunks) * 0.9
+
+
+def test_iter_chunks_low_entropy():
+    # a sparse float32 tensor, with one in ten values set
+    data = bytearray(2 * 1024 * 1024)
+    for i in range(0, len(data), 40):
+        data[i : i + 4] = os.urandom(4)
+    data = bytes(data)
+    chunks = list(iter_chunks(io.BytesIO(data), min_size=4096, max_size=65536))
+    assert b"".join(chunks) == data
+
+    # cut points do not fall back to max_size offsets, so a one byte
+    # insertion only changes the chunks around it
+    middle = len(data) // 2
+    inserted = data[:middle] + b"\x01" + data[middle:]
+    shifted = list(iter_chunks(io.BytesIO(inserted), min_size=4096, max_size=65536))
+    assert len(set(chunks) & set(shifted)) > len(chunks) * 0.9
+
+
+def test_push_pull_roundtrip(tmp_path):
+    src = tmp_path / "a"
+    os.makedirs(src / "subdir")
+    (src / "test.txt").write_text("Hello World")
+    (src / "subdir" / "data.bin").write_bytes(os.urandom(200000))
+
+    storage = DictStorage()
+    ChunkStore(storage).push("aaaaaa_20240101T000000_a", str(src))
+
+    dst = tmp_path / "b"
+    ChunkStore(storage).pull("aaaaaa_20240101T000000_a", str(dst))
+    assert (dst / "test.txt").read_text() == "Hello World"
+    assert (dst / "subdir" / "data.bin").read_bytes() == (
+        src / "subdir" / "data.bin"
+    ).read_bytes()
+
+
+def test_push_skips_existing_chunks(tmp_path):
+    src = tmp_path / "a"
+    os.makedirs(src)
+    (src / "data.bin").write_bytes(os.urandom(200000))
+
+    storage = DictStorage()
+    ChunkStore(storage).push("aaaaaa_20240101T000000_a", str(src))
+    n_chunks = len(storage.list_objects(CHUNK_PREFIX))
+
+    puts = storage.puts
+    ChunkStore(storage).push("aaaaaa_20240101T000001_b", str(src))
+    # only the manifest of the second experiment is uploaded
+    assert storage.puts == puts + 1
+    assert len(storage.list_objects(CHUNK_PREFIX)) == n_chunks
+
+
+def test_push_creates_listed_missing_chunks_without_lookup(tmp_path):
+    class NewObjectStorage(DictStorage):
+        def __init__(self):
+            super().__init__()
+            self.new_objects = []
+
+        def put_new_object(self, key, data):
+            self.new_objects.append(key)
+            self.put_object(key, data)
+
+    src = tmp_path / "a"
+    os.makedirs(src)
+    (src / "data.bin").write_bytes(os.urandom(200000))
+
+    storage = NewObjectStorage()
+    ChunkStore(storage).push("aaaaaa_20240101T000000_a", str(src))
+    assert sorted(storage.new_objects) == sorted(storage.list_objects(CHUNK_PREFIX))
@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+from resutil.archive import iter_zip_chunks
+from resutil.core import download
+
+from conftest import DictStorage
+
+EX_NAME = "aaaaaa_20240101T000000_test"
+
+
+class ZipStorage(DictStorage):
+    def __init__(self, data, fail_after=None):
+        super().__init__()
+        self.data = data
+        self.fail_after = fail_after
+
+    def download_experiment_stream(self, ex_name):
+        for i in range(0, len(self.data), 1000):
+            if self.fail_after is not None and i >= self.fail_after:
+                raise ConnectionError("connection dropped")
+            yield self.data[i : i + 1000]
+
+
+def make_zip(tmp_path):
+    src = tmp_path / "src"
+    os.makedirs(src / "subdir")
+    (src / "test.txt").write_text("Hello World")
+    (src / "subdir" / "data.bin").write_bytes(os.urandom(100000))
+    return b"".join(iter_zip_chunks(src))
+
+
+def test_download_streams_into_results_dir(tmp_path):
+    results_dir = tmp_path / "results"
+    download(EX_NAME, str(results_dir), ZipStorage(make_zip(tmp_path)))
+
+    assert (results_dir / EX_NAME / "test.txt").read_text() == "Hello World"
+    assert sorted(os.listdir(results_dir)) == [".resutil", EX_NAME]
+    assert os.listdir(results_dir / ".resutil" / "staging") == []
+
+
+def test_interrupted_download_leaves_no_ex_dir(tmp_path):
+    results_dir = tmp_path / "results"
+    storage = ZipStorage(make_zip(tmp_path), fail_after=50000)
+
+    with pytest.raises(ConnectionError):
+        download(EX_NAME, str(results_dir), storage)
+    assert not os.path.exists(results_dir / EX_NAME)
+    assert os.listdir(results_dir / ".resutil" / "staging") == []
+
+
+class SlicedZipStorage(ZipStorage):
+    def use_sliced_download(self, ex_name):
+        return True
+
+    def download_experiment(self, zip_path):
+        with open(zip_path, "wb") as f:
+            f.write(self.data)
+
+    def download_experiment_stream(self, ex_name):
+        raise AssertionError("large archives are not streamed")
+
+
+def test_download_large_archive_as_file(tmp_path):
+    results_dir = tmp_path / "results"
+    download(EX_NAME, str(results_dir), SlicedZipStorage(make_zip(tmp_path)))
+
+    assert (results_dir / EX_NAME / "test.txt").read_text() == "Hello World"
+    assert os.listdir(results_dir / ".resutil" / "staging") == []
@@ -0,0 +1,126 @@
+import mmap
+import os
+
+import pytest
+
+from resutil import open_experiment
+from resutil.archive import iter_zip_chunks
+from resutil.cache import FileCache
+from resutil.core import upload
+from resutil.storage import LocalStorage
+
+from conftest import DictStorage
+
+EX_NAME = "aaaaaa_20240101T000000_test"
+
+
+class RangeZipStorage(DictStorage):
+    def __init__(self, data):
+        super().__init__()
+        self.data = data
+        self.bytes_read = 0
+
+    def experiment_zip_size(self, ex_name):
+        return len(self.data)
+
+    def read_experiment_zip(self, ex_name, offset, length):
+        self.bytes_read += length
+        return self.data[offset : offset + length]
+
+
+@pytest.fixture
+def storage(tmp_path):
+    src = tmp_path / "src"
+    os.makedirs(src / "arrays")
+    (src / "metrics.json").write_text('{"loss": 0.1}')
+    (src / "arrays" / "a.bin").write_bytes(b"a" * 100 + os.urandom(200000))
+    (src / "arrays" / "b.bin").write_bytes(os.urandom(3000000))
+    return RangeZipStorage(b"".join(iter_zip_chunks(src)))
+
+
+def test_listdir(storage, tmp_path):
+    exp = open_experiment(EX_NAME, storage, cache_dir=str(tmp_path / "cache"))
+
+    assert exp.listdir() == ["arrays", "metrics.json"]
+    assert exp.listdir("arrays") == ["a.bin", "b.bin"]
+    assert exp.is_dir("arrays")
+    assert exp.size("arrays/b.bin") == 3000000
+    with pytest.raises(FileNotFoundError):
+        exp.read_bytes("missing.txt")
+
+
+def test_members_are_fetched_on_demand_and_cached(storage, tmp_path):
+    exp = open_experiment(EX_NAME, storage, cache_dir=str(tmp_path / "cache"))
+    opened = storage.bytes_read
+
+    assert exp.read_text("metrics.json") == '{"loss": 0.1}'
+    with open(exp.path("arrays/a.bin"), "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            assert m[:3] == b"aaa" and len(m) == 200100
+    # b.bin was not fetched
+    assert storage.bytes_read - opened < 1000000
+
+    fetched = storage.bytes_read
+    again = open_experiment(EX_NAME, storage, cache_dir=str(tmp_path / "cache"))
+    assert again.read_bytes("arrays/a.bin")[:100] == b"a" * 100
+    # only the central directory is read again
+    assert storage.bytes_read - fetched < 100000
+
+
+def test_nothing_is_cached_when_the_cache_is_disabled(storage, tmp_path, monkeypatch):
+    monkeypatch.setenv("RESUTIL_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr("resutil.cache.archive_cache", None)
+
+    with open_experiment(EX_NAME, storage) as exp:
+        assert exp.read_text("metrics.json") == '{"loss": 0.1}'
+        path = exp.path("arrays/a.bin")
+        with open(path, "rb") as f:
+            assert f.read(3) == b"aaa"
+
+    assert not os.path.exists(path)
+    assert not (tmp_path / "cache").exists()
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = FileCache(str(tmp_path / "cache"), max_bytes=250)
+    a = cache.put("a", {}, lambda f: f.write(b"a" * 100))
+    os.utime(a, (1, 1))
+    b = cache.put("b", {}, lambda f: f.write(b"b" * 100))
+    os.utime(b, (2, 2))
+    # reading a makes b the least recently used entry
+    assert cache.get("a", {}) == a
+
+    cache.put("c", {}, lambda f: f.write(b"c" * 100))
+
+    assert cache.get("a", {}) == a
+    assert cache.get("b", {}) is None
+    assert cache.get("a", {"size": 1}) is None
+
+
+@pytest.mark.parametrize("format", ["directory", "chunked"])
+def test_open_experiment_by_format(tmp_path, format):
+    os.makedirs(tmp_path / "remote")
+    os.makedirs(tmp_path / "results" / EX_NAME / "arrays")
+    (tmp_path / "results" / EX_NAME / "metrics.json").write_text('{"loss": 0.1}')
+    (tmp_path / "results" / EX_NAME / "arrays" / "a.bin").write_bytes(b"a" * 100)
+    storage = LocalStorage({"path": str(tmp_path / "remote"), "format": format}, "p")
+    upload(EX_NAME, str(tmp_path / "results"), storage)
+
+    if format == "chunked":
+        with pytest.raises(ValueError, match="chunked"):
+            open_experiment(EX_NAME, storage, cache_dir=str(tmp_path / "cache"))
+        return
+
+    with open_experiment(EX_NAME, storage) as exp:
+        assert exp.listdir() == ["arrays", "metrics.json"]
+        assert exp.read_text("metrics.json") == '{"loss": 0.1}'
+        assert exp.size("arrays/a.bin") == 100
+        assert exp.path("arrays/a.bin") == str(
+            tmp_path / "remote" / "p" / EX_NAME / "arrays" / "a.bin"
+        )
+        assert list(exp.walk()) == [
+            ("", ["arrays"], ["metrics.json"]),
+            ("arrays", [], ["a.bin"]),
+        ]
+        with pytest.raises(FileNotFoundError):
+            exp.path("arrays")
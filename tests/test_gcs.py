@@ -0,0 +1,190 @@
+import pytest
+from google.api_core.exceptions import NotFound
+
+from resutil.storage.gcs.gcs import GCS
+from resutil.storage.resumable import DEFAULT_SLICE_THRESHOLD
+from resutil.storage.storage import Storage
+
+EX_NAME = "aaaaaa_20240101T000000_test"
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.content_type = None
+        self.size = None
+        self.md5_hash = None
+        self.crc32c = None
+        self.generation = 1
+        self.updated = None
+
+    def compose(self, sources):
+        self.bucket.objects[self.name] = b"".join(
+            self.bucket.objects[blob.name] for blob in sources
+        )
+        self.size = len(self.bucket.objects[self.name])
+
+    def delete(self):
+        if self.name not in self.bucket.objects:
+            raise NotFound(self.name)
+        del self.bucket.objects[self.name]
+
+
+class FakeBucket:
+    def __init__(self):
+        self.objects = {}
+
+
+def make_gcs(fail_part=None, bucket=None, **storage_config):
+    storage = GCS.__new__(GCS)
+    Storage.__init__(storage, storage_config, "proj")
+    storage.index.replace({})
+    storage.max_workers = 4
+    storage.stream_chunk_size = 1000
+    storage.composite_threshold = storage_config.get("composite_threshold", 10000)
+    storage.composite_parts = storage_config.get("composite_parts", 32)
+    storage.composite_part_size = storage_config.get("composite_part_size", 3000)
+    storage.slice_size = storage_config.get("slice_size", 1000)
+    storage.slice_threshold = storage_config.get(
+        "slice_threshold", DEFAULT_SLICE_THRESHOLD
+    )
+    bucket = bucket or FakeBucket()
+    storage._blob = lambda key: FakeBlob(bucket, f"proj/{key}")
+
+    storage.uploaded_keys = []
+
+    def upload_object(key, chunks, state_path=None):
+        storage.uploaded_keys.append(key)
+        data = b"".join(chunks)
+        if fail_part is not None and key.endswith(f".{fail_part:02d}"):
+            raise ConnectionError("connection dropped")
+        bucket.objects[f"proj/{key}"] = data
+        if key.endswith(".zip"):
+            storage.index.add(key[:-4], {"format": "zip", "size": len(data)})
+
+    storage._upload_object = upload_object
+    return storage, bucket
+
+
+def stream(data, size=777):
+    return (data[i : i + size] for i in range(0, len(data), size))
+
+
+def test_small_archive_is_uploaded_as_one_object():
+    storage, bucket = make_gcs()
+    data = bytes(range(256)) * 20
+
+    storage.upload_experiment_stream(EX_NAME, stream(data))
+
+    assert storage.uploaded_keys == [f"{EX_NAME}.zip"]
+    assert bucket.objects == {f"proj/{EX_NAME}.zip": data}
+    assert storage.index.entries[EX_NAME]["size"] == len(data)
+
+
+def test_large_archive_is_composed_from_parts():
+    storage, bucket = make_gcs()
+    data = bytes(range(256)) * 100
+
+    def produce():
+        yield from stream(data[:20000])
+        # the first parts are uploaded while the archive is produced
+        assert storage.uploaded_keys[0].startswith(f".composite/{EX_NAME}/")
+        yield from stream(data[20000:])
+
+    storage.upload_experiment_stream(EX_NAME, produce())
+
+    assert len(storage.uploaded_keys) == 9
+    # the parts are removed after composing
+    assert bucket.objects == {f"proj/{EX_NAME}.zip": data}
+    assert storage.index.entries[EX_NAME]["size"] == len(data)
+
+
+def test_many_parts_are_composed_in_groups():
+    storage, bucket = make_gcs(composite_part_size=100)
+    data = bytes(range(256)) * 100
+
+    storage.upload_experiment_stream(EX_NAME, stream(data))
+
+    assert len(storage.uploaded_keys) == 256
+    assert bucket.objects == {f"proj/{EX_NAME}.zip": data}
+
+
+def test_streamed_parts_are_removed_when_a_part_fails():
+    storage, bucket = make_gcs(fail_part=3)
+
+    with pytest.raises(ConnectionError):
+        storage.upload_experiment_stream(EX_NAME, stream(bytes(range(256)) * 100))
+
+    assert bucket.objects == {}
+
+
+def test_parts_are_removed_when_a_part_fails(tmp_path):
+    storage, bucket = make_gcs(fail_part=3)
+    zip_path = tmp_path / f"{EX_NAME}.zip"
+    zip_path.write_bytes(bytes(range(256)) * 100)
+
+    with pytest.raises(ConnectionError):
+        storage.upload_experiment(str(zip_path))
+
+    assert bucket.objects == {}
+
+
+def test_interrupted_upload_reuses_the_uploaded_parts(tmp_path):
+    storage, bucket = make_gcs(fail_part=3)
+    storage.transfer_state_dir = str(tmp_path)
+    data = bytes(range(256)) * 100
+
+    with pytest.raises(ConnectionError):
+        storage.upload_experiment_stream(EX_NAME, stream(data))
+    kept = {key[len("proj/") :] for key in bucket.objects}
+    assert kept and all(key.startswith(f".composite/{EX_NAME}/") for key in kept)
+
+    storage, bucket = make_gcs(bucket=bucket)
+    storage.transfer_state_dir = str(tmp_path)
+    storage.upload_experiment_stream(EX_NAME, stream(data))
+
+    assert kept.isdisjoint(storage.uploaded_keys)
+    assert len(storage.uploaded_keys) == 9 - len(kept)
+    assert bucket.objects == {f"proj/{EX_NAME}.zip": data}
+    assert not (tmp_path / f"{EX_NAME}.composite.json").exists()
+
+
+def test_changed_parts_are_uploaded_again(tmp_path):
+    storage, bucket = make_gcs(fail_part=3)
+    storage.transfer_state_dir = str(tmp_path)
+    with pytest.raises(ConnectionError):
+        storage.upload_experiment_stream(EX_NAME, stream(bytes(range(256)) * 100))
+
+    storage, bucket = make_gcs(bucket=bucket)
+    storage.transfer_state_dir = str(tmp_path)
+    data = bytes(reversed(range(256))) * 100
+    storage.upload_experiment_stream(EX_NAME, stream(data))
+
+    assert len(storage.uploaded_keys) == 9
+    assert bucket.objects == {f"proj/{EX_NAME}.zip": data}
+
+
+def test_streamed_downloads_are_only_spooled_when_enabled(tmp_path):
+    storage, _ = make_gcs()
+    storage.transfer_state_dir = str(tmp_path)
+    assert storage.download_state_path(EX_NAME) is None
+
+    storage, _ = make_gcs(spool_downloads=True)
+    storage.transfer_state_dir = str(tmp_path)
+    assert storage.download_state_path(EX_NAME) == str(
+        tmp_path / f"{EX_NAME}.download.json"
+    )
+
+
+def test_large_archives_are_streamed_below_the_slice_threshold():
+    storage, _ = make_gcs()
+    storage.index.replace(
+        {
+            EX_NAME: {"format": "zip", "size": 200 * 1024 * 1024},
+            "aaaaab_20240101T000000": {"format": "zip", "size": 2**31},
+        }
+    )
+
+    assert not storage.use_sliced_download(EX_NAME)
+    assert storage.use_sliced_download("aaaaab_20240101T000000")
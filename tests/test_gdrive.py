@@ -0,0 +1,147 @@
+import threading
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from resutil.storage.gdrive.gdrive import GDrive, LIST_PAGE_SIZE
+from resutil.storage.resumable import RetryPolicy
+
+
+class FakeRequest:
+    def __init__(self, result, failures=0):
+        self.result = result
+        self.failures = failures
+
+    def execute(self):
+        if self.failures:
+            self.failures -= 1
+            raise HttpError(httplib2.Response({"status": 429}), b"rate limited")
+        return self.result
+
+
+class FakeFiles:
+    def __init__(self, pages):
+        self.pages = pages
+        self.list_calls = []
+        # of every list request
+        self.failures = 0
+
+    def list(self, **kwargs):
+        self.list_calls.append(kwargs)
+        token = kwargs.get("pageToken")
+        index = 0 if token is None else int(token)
+        result = {"files": self.pages[index]}
+        if index + 1 < len(self.pages):
+            result["nextPageToken"] = str(index + 1)
+        return FakeRequest(result, self.failures)
+
+
+class FakeBatch:
+    def __init__(self, callback):
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request, request_id))
+
+    def execute(self):
+        for request, request_id in self.requests:
+            self.callback(request_id, request.execute(), None)
+
+
+class FakeService:
+    def __init__(self, pages):
+        self.fake_files = FakeFiles(pages)
+        self.batches = []
+
+    def files(self):
+        return self.fake_files
+
+    def new_batch_http_request(self, callback):
+        batch = FakeBatch(callback)
+        self.batches.append(batch)
+        return batch
+
+
+def make_gdrive(pages):
+    storage = GDrive.__new__(GDrive)
+    super(GDrive, storage).__init__({}, "proj")
+    service = FakeService(pages)
+    storage._local = threading.local()
+    storage.build_service = lambda: service
+    storage.folder_lock = threading.RLock()
+    storage.project_dir_id = "proj-id"
+    storage.experiment_file_ids = None
+    storage.list_metadata = False
+    storage.folder_id_cache = {"": "proj-id"}
+    return storage
+
+
+def test_listing_follows_pages():
+    pages = [
+        [{"id": str(i), "name": f"aaaaaa_20240101T0000{i:02d}.zip"} for i in range(3)],
+        [{"id": "3", "name": "aaaaaa_20240101T000003.manifest.json"}],
+    ]
+    storage = make_gdrive(pages)
+
+    names = storage.get_all_experiment_names()
+    assert len(names) == 4
+    calls = storage.service.fake_files.list_calls
+    assert len(calls) == 2
+    assert calls[0]["pageSize"] == LIST_PAGE_SIZE
+    assert storage._find_file_id("aaaaaa_20240101T000003.manifest.json") == "3"
+
+
+def test_listing_with_metadata():
+    pages = [
+        [
+            {
+                "id": "0",
+                "name": "aaaaaa_20240101T000000.zip",
+                "size": "10",
+                "md5Checksum": "abc",
+                "modifiedTime": "2024-01-01T00:00:00.000Z",
+            }
+        ]
+    ]
+    storage = make_gdrive(pages)
+
+    experiments = dict(storage.iter_experiments(with_metadata=True))
+    assert experiments["aaaaaa_20240101T000000"]["size"] == 10
+    assert experiments["aaaaaa_20240101T000000"]["md5"] == "abc"
+    assert "md5Checksum" in storage.service.fake_files.list_calls[0]["fields"]
+
+
+def test_find_file_ids_uses_batch_without_listing():
+    storage = make_gdrive([[{"id": "0", "name": "aaaaaa_20240101T000000.zip"}]])
+
+    file_ids = storage._find_file_ids(
+        ["aaaaaa_20240101T000000.zip", "aaaaaa_20240101T000000.manifest.json"]
+    )
+    assert len(storage.service.batches) == 1
+    assert len(storage.service.batches[0].requests) == 2
+    assert file_ids["aaaaaa_20240101T000000.zip"] == "0"
+    assert storage.experiment_file_ids is None
+
+
+def test_each_thread_gets_its_own_service():
+    storage = make_gdrive([[]])
+    storage.build_service = lambda: FakeService([[]])
+
+    services = []
+    for _ in range(2):
+        thread = threading.Thread(target=lambda: services.append(storage.service))
+        thread.start()
+        thread.join()
+
+    assert services[0] is not services[1]
+    assert storage.service is storage.service
+
+
+def test_throttled_requests_are_retried():
+    storage = make_gdrive([[{"id": "0", "name": "aaaaaa_20240101T000000.zip"}]])
+    storage.retry = RetryPolicy(initial_delay=0)
+    storage.service.fake_files.failures = 2
+
+    assert list(storage.list_experiments()) == ["aaaaaa_20240101T000000"]
+    assert storage.retry.throttles == 2
@@ -0,0 +1,209 @@
+import os
+import subprocess
+from types import SimpleNamespace
+
+import pytest
+
+from resutil.cli.cli_main import command_restore_code
+from resutil.config_file import create_ex_yaml
+from resutil.git import (
+    COPY_DIR_NAME,
+    PATCH_FILE_NAME,
+    GitRepo,
+    parse_status,
+    restore_code,
+)
+
+SHA = "0123456789abcdef0123456789abcdef01234567"
+
+
+def test_parse_status():
+    entries = [
+        f"# branch.oid {SHA}",
+        "# branch.head main",
+        f"1 .M N... 100644 100644 100644 {SHA} {SHA} src/a b.py",
+        f"1 M. N... 100644 100644 100644 {SHA} {SHA} src/staged.py",
+        f"1 MM N... 100644 100644 100644 {SHA} {SHA} both.py",
+        f"1 .D N... 100644 100644 000000 {SHA} {SHA} deleted.py",
+        f"1 D. N... 100644 000000 000000 {SHA} {SHA} removed.py",
+        f"2 R. N... 100644 100644 100644 {SHA} {SHA} R100 new.py",
+        "old.py",
+        f"u UU N... 100644 100644 100644 100644 {SHA} {SHA} {SHA} conflict.py",
+        "? notes.txt",
+        "",
+    ]
+
+    state = parse_status("\0".join(entries).encode())
+
+    assert state.commit == SHA
+    assert state.modified == ["src/a b.py", "both.py", "conflict.py"]
+    assert state.staged == ["src/staged.py", "both.py", "new.py"]
+    assert state.untracked == ["notes.txt"]
+    assert state.uncommitted == [
+        "src/a b.py",
+        "both.py",
+        "conflict.py",
+        "src/staged.py",
+        "new.py",
+    ]
+
+
+def git(*args, cwd):
+    subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True)
+
+
+def test_git_repo(tmp_path, monkeypatch):
+    git("init", "-q", cwd=tmp_path)
+    (tmp_path / "a.py").write_text("a")
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "b.py").write_text("b")
+    git("add", ".", cwd=tmp_path)
+    git(
+        "-c",
+        "user.name=a",
+        "-c",
+        "user.email=a@b",
+        "commit",
+        "-qm",
+        "init",
+        cwd=tmp_path,
+    )
+    (tmp_path / "a.py").write_text("changed")
+    (tmp_path / "sub" / "new.txt").write_text("new")
+    monkeypatch.chdir(tmp_path / "sub")
+
+    repo = GitRepo()
+    commit, uncommitted = repo.get_git_info()
+    state = repo.get_state(untracked=True)
+    repo.store_uncomited_to(tmp_path / "stored")
+
+    assert len(commit) == 40
+    assert uncommitted == ["a.py"]
+    assert state.untracked == ["sub/new.txt"]
+    assert (tmp_path / "stored" / "sub" / "new.txt").read_text() == "new"
+
+
+def test_restore_code_from_patch(tmp_path, monkeypatch):
+    repo_dir = tmp_path / "repo"
+    repo_dir.mkdir()
+    git("init", "-q", cwd=repo_dir)
+    (repo_dir / "a.py").write_text("a\n")
+    (repo_dir / "data.bin").write_bytes(bytes(range(256)))
+    (repo_dir / "gone.py").write_text("gone\n")
+    git("add", ".", cwd=repo_dir)
+    git(
+        "-c",
+        "user.name=a",
+        "-c",
+        "user.email=a@b",
+        "commit",
+        "-qm",
+        "init",
+        cwd=repo_dir,
+    )
+    (repo_dir / "a.py").write_text("a\nchanged\n")
+    (repo_dir / "data.bin").write_bytes(bytes(range(255, -1, -1)))
+    (repo_dir / "gone.py").unlink()
+    (repo_dir / "staged.py").write_text("staged\n")
+    git("add", "staged.py", cwd=repo_dir)
+    (repo_dir / "notes.txt").write_text("notes\n")
+    monkeypatch.chdir(repo_dir)
+
+    repo = GitRepo()
+    state = repo.get_state(untracked=True)
+    ex_dir = tmp_path / "ex"
+    ex_dir.mkdir()
+    assert repo.store_snapshot(ex_dir, state, "patch") == "patch"
+    create_ex_yaml(str(ex_dir), commit_hash=state.commit, snapshot="patch")
+    # only untracked files are copied
+    assert os.listdir(ex_dir / COPY_DIR_NAME) == ["notes.txt"]
+
+    restore_code(ex_dir, str(repo_dir / "restored"))
+
+    restored = repo_dir / "restored"
+    assert sorted(os.listdir(restored)) == [
+        "a.py",
+        "data.bin",
+        "notes.txt",
+        "staged.py",
+    ]
+    assert (restored / "a.py").read_text() == "a\nchanged\n"
+    assert (restored / "data.bin").read_bytes() == bytes(range(255, -1, -1))
+
+
+def test_restore_code_does_not_connect_to_storage(tmp_path, monkeypatch):
+    git("init", "-q", cwd=tmp_path)
+    (tmp_path / "a.py").write_text("a\n")
+    git("add", ".", cwd=tmp_path)
+    git(
+        "-c",
+        "user.name=a",
+        "-c",
+        "user.email=a@b",
+        "commit",
+        "-qm",
+        "init",
+        cwd=tmp_path,
+    )
+    commit = subprocess.run(
+        ["git", "rev-parse", "HEAD"], cwd=tmp_path, capture_output=True, text=True
+    ).stdout.strip()
+    ex_name = "aaaaaa_20240101T000000"
+    (tmp_path / "results" / ex_name).mkdir(parents=True)
+    create_ex_yaml(str(tmp_path / "results" / ex_name), commit_hash=commit)
+    # the key file does not exist, connecting to the storage would fail
+    (tmp_path / "resutil-conf.yaml").write_text(
+        "project_name: proj\n"
+        "results_dir: results\n"
+        "storage_type: gcs\n"
+        "storage_config:\n"
+        "  backet_name: bucket\n"
+        "  key_file_path: missing.json\n"
+    )
+    monkeypatch.chdir(tmp_path)
+
+    command_restore_code(SimpleNamespace(EXPERIMENT=ex_name, output="restored"))
+
+    assert (tmp_path / "restored" / "a.py").read_text() == "a\n"
+
+
+def test_restore_code_of_a_missing_commit(tmp_path, monkeypatch):
+    git("init", "-q", cwd=tmp_path)
+    ex_dir = tmp_path / "ex"
+    ex_dir.mkdir()
+    create_ex_yaml(str(ex_dir), commit_hash=SHA)
+    monkeypatch.chdir(tmp_path)
+
+    with pytest.raises(ValueError, match="not in this repository"):
+        restore_code(ex_dir, str(tmp_path / "restored"))
+
+    assert not (tmp_path / "restored").exists()
+
+
+def test_failed_restore_leaves_no_files(tmp_path, monkeypatch):
+    git("init", "-q", cwd=tmp_path)
+    (tmp_path / "a.py").write_text("a\n")
+    git("add", ".", cwd=tmp_path)
+    git(
+        "-c",
+        "user.name=a",
+        "-c",
+        "user.email=a@b",
+        "commit",
+        "-qm",
+        "init",
+        cwd=tmp_path,
+    )
+    commit = subprocess.run(
+        ["git", "rev-parse", "HEAD"], cwd=tmp_path, capture_output=True, text=True
+    ).stdout.strip()
+    ex_dir = tmp_path / "ex"
+    ex_dir.mkdir()
+    create_ex_yaml(str(ex_dir), commit_hash=commit, snapshot="patch")
+    (ex_dir / PATCH_FILE_NAME).write_text("not a patch\n")
+    monkeypatch.chdir(tmp_path)
+
+    with pytest.raises(subprocess.CalledProcessError):
+        restore_code(ex_dir, str(tmp_path / "restored"))
+
+    assert not (tmp_path / "restored").exists()
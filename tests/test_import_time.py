@@ -0,0 +1,41 @@
+import subprocess
+import sys
+
+import pytest
+
+# Only imported when a backend or feature needs them
+HEAVY_MODULES = [
+    "google.cloud.storage",
+    "googleapiclient.discovery",
+    "git",
+    "prompt_toolkit",
+    "requests",
+]
+# Generous compared to the ~70 ms it takes, the heavy modules take ~400 ms
+IMPORT_TIME_BUDGET_US = 300_000
+
+
+def import_times(module):
+    # {module: cumulative import time in us} from python -X importtime
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize("module", ["resutil", "resutil.cli.cli_main"])
+def test_import_time(module):
+    times = import_times(module)
+
+    assert [m for m in HEAVY_MODULES if m in times] == []
+    assert times[module] < IMPORT_TIME_BUDGET_US
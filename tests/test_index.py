@@ -0,0 +1,50 @@
+from resutil.storage.index import ExperimentIndex
+
+from conftest import DictStorage
+
+
+def test_storage_lists_once_per_ttl():
+    storage = DictStorage()
+    storage.objects["aaaaaa_20240101T000000_a.zip"] = b""
+
+    assert storage.exist_experiment("aaaaaa_20240101T000000_a")
+    assert not storage.exist_experiment("aaaaaa_20240101T000000_b")
+    assert storage.get_all_experiment_names() == ["aaaaaa_20240101T000000_a"]
+    assert storage.listings == 1
+
+    storage.refresh_index()
+    assert storage.listings == 2
+
+    storage.index.ttl = 0
+    storage.index.fetched_at -= 1
+    storage.get_all_experiment_names()
+    assert storage.listings == 3
+
+
+def test_index_updated_in_place():
+    index = ExperimentIndex()
+    index.add("a")
+    assert index.get() is None
+
+    index.replace({"a": {}})
+    index.add("b", {"size": 1})
+    index.rename("a", "c")
+    index.remove("b")
+    assert index.get() == {"c": {}}
+
+
+def test_index_persisted(tmp_path):
+    path = str(tmp_path / ".resutil" / "remote-index.json")
+    identity = {"bucket_name": "bucket", "project_dir": "proj"}
+
+    index = ExperimentIndex()
+    index.attach(path, identity)
+    index.replace({"a": {"size": 1}})
+
+    restored = ExperimentIndex()
+    restored.attach(path, identity)
+    assert restored.get() == {"a": {"size": 1}}
+
+    other = ExperimentIndex()
+    other.attach(path, {"bucket_name": "other", "project_dir": "proj"})
+    assert other.get() is None
@@ -0,0 +1,86 @@
+import os
+
+from resutil.config_file import create_ex_yaml
+from resutil.core import get_past_comments
+from resutil.ex_dir import get_ex_dir_names
+from resutil.local_index import LocalIndex
+from resutil.planner import read_local_dependencies
+
+EX_A = "aaaaaa_20240101T000000_first_run"
+EX_B = "aaaaab_20240102T000000"
+
+
+def make_ex_dir(results_dir, ex_name, dependencies=None):
+    os.makedirs(results_dir / ex_name)
+    (results_dir / ex_name / "result.txt").write_text("0123456789")
+    if dependencies is not None:
+        create_ex_yaml(str(results_dir / ex_name), dependencies, commit_hash="abc")
+
+
+def test_index_reads_experiment_metadata(tmp_path):
+    make_ex_dir(tmp_path, EX_A, dependencies=[])
+    make_ex_dir(tmp_path, EX_B, dependencies=[f"results/{EX_A}"])
+    os.makedirs(tmp_path / "_debug")
+
+    experiments = LocalIndex(str(tmp_path)).experiments()
+
+    assert [e.name for e in experiments] == [EX_A, EX_B]
+    a, b = experiments
+    assert (a.timestamp, a.comment) == ("20240101T000000", "first_run")
+    assert (b.timestamp, b.comment) == ("20240102T000000", "")
+    assert b.dependencies == [f"results/{EX_A}"]
+    assert a.dependencies == []
+    assert os.path.exists(tmp_path / ".resutil" / "index.sqlite3")
+    assert read_local_dependencies(EX_B, str(tmp_path)) == [EX_A]
+    assert get_past_comments(str(tmp_path)) == ["first_run"]
+
+
+def test_index_only_rereads_changed_experiments(tmp_path, monkeypatch):
+    make_ex_dir(tmp_path, EX_A, dependencies=[])
+    make_ex_dir(tmp_path, EX_B)
+    index = LocalIndex(str(tmp_path))
+    index.experiments()
+
+    from resutil import local_index
+
+    read = []
+    original = local_index._read_experiment
+
+    def counting_read(path, name, *mtimes):
+        read.append(name)
+        return original(path, name, *mtimes)
+
+    monkeypatch.setattr(local_index, "_read_experiment", counting_read)
+    assert get_ex_dir_names(str(tmp_path)) == [EX_A, EX_B]
+    assert read == []
+
+    create_ex_yaml(str(tmp_path / EX_B), [EX_A])
+    os.rename(tmp_path / EX_A, tmp_path / "aaaaaa_20240101T000000_renamed")
+    assert get_ex_dir_names(str(tmp_path)) == ["aaaaaa_20240101T000000_renamed", EX_B]
+    assert sorted(read) == ["aaaaaa_20240101T000000_renamed", EX_B]
+    assert index.get(EX_B).dependencies == [EX_A]
+
+
+def test_get_serves_unchanged_experiments_from_the_index(tmp_path, monkeypatch):
+    make_ex_dir(tmp_path, EX_A, dependencies=[])
+    index = LocalIndex(str(tmp_path))
+    assert index.get(EX_A).dependencies == []
+
+    from resutil import local_index
+
+    def fail(*args):
+        raise AssertionError("read again")
+
+    monkeypatch.setattr(local_index, "_read_experiment", fail)
+    monkeypatch.setattr(local_index.os, "walk", fail)
+    assert index.get(EX_A).dependencies == []
+    assert read_local_dependencies(EX_A, str(tmp_path)) == []
+
+
+def test_index_falls_back_to_reading_experiments(tmp_path):
+    make_ex_dir(tmp_path, EX_A)
+    # the index can not be created
+    (tmp_path / ".resutil").write_text("")
+
+    assert get_ex_dir_names(str(tmp_path)) == [EX_A]
+    assert LocalIndex(str(tmp_path)).get(EX_A).comment == "first_run"
@@ -0,0 +1,112 @@
+import os
+
+import pytest
+
+from resutil.chunkstore import ChunkStore, manifest_key
+from resutil.core import upload, download
+from resutil.storage import LocalStorage
+
+from conftest import DictStorage
+
+EX_NAME = "aaaaaa_20240101T000000_test"
+
+
+def make_ex_dir(results_dir):
+    ex_dir = results_dir / EX_NAME
+    os.makedirs(ex_dir / "subdir")
+    (ex_dir / "test.txt").write_text("Hello World")
+    (ex_dir / "subdir" / "data.bin").write_bytes(os.urandom(100000))
+    return ex_dir
+
+
+@pytest.mark.parametrize("format", ["directory", "zip", "chunked"])
+def test_push_pull_roundtrip(tmp_path, format):
+    os.makedirs(tmp_path / "remote")
+    storage = LocalStorage({"path": str(tmp_path / "remote"), "format": format}, "proj")
+    ex_dir = make_ex_dir(tmp_path / "a")
+
+    upload(EX_NAME, str(tmp_path / "a"), storage)
+    assert storage.list_experiments(refresh=True)[EX_NAME]["format"] == format
+    assert storage.exist_experiment(EX_NAME)
+
+    download(EX_NAME, str(tmp_path / "b"), storage)
+    pulled = tmp_path / "b" / EX_NAME
+    assert (pulled / "test.txt").read_text() == "Hello World"
+    assert (pulled / "subdir" / "data.bin").read_bytes() == (
+        ex_dir / "subdir" / "data.bin"
+    ).read_bytes()
+
+
+def test_push_replaces_chunked_upload_without_lookups(tmp_path, mocker):
+    os.makedirs(tmp_path / "remote")
+    remote = str(tmp_path / "remote")
+    make_ex_dir(tmp_path / "a")
+    upload(
+        EX_NAME,
+        str(tmp_path / "a"),
+        LocalStorage({"path": remote, "format": "chunked"}, "proj"),
+    )
+
+    storage = LocalStorage({"path": remote, "format": "zip"}, "proj")
+    exist_object = mocker.spy(storage, "exist_object")
+    upload(EX_NAME, str(tmp_path / "a"), storage)
+    assert storage.list_experiments(refresh=True)[EX_NAME]["format"] == "zip"
+    assert not os.path.exists(tmp_path / "remote" / "proj" / f"{EX_NAME}.manifest.json")
+
+    # the listing tells there is no manifest to remove
+    upload(EX_NAME, str(tmp_path / "a"), storage)
+    assert exist_object.call_count == 0
+
+
+class ReplacingStorage(DictStorage):
+    # like GDrive, removes the experiment, manifest included, before
+    # uploading its zip
+    def upload_experiment_stream(self, ex_name, chunks):
+        self.objects.pop(manifest_key(ex_name), None)
+        self.objects[f"{ex_name}.zip"] = b"".join(chunks)
+        self.index.add(ex_name, {"format": "zip"})
+
+
+def test_push_over_chunked_upload_removed_by_the_backend(tmp_path):
+    storage = ReplacingStorage()
+    storage.list_experiments()
+    make_ex_dir(tmp_path / "a")
+    ChunkStore(storage).push(EX_NAME, str(tmp_path / "a" / EX_NAME))
+    assert storage.list_experiments()[EX_NAME]["format"] == "chunked"
+
+    storage.storage_format = "zip"
+    upload(EX_NAME, str(tmp_path / "a"), storage)
+
+    assert manifest_key(EX_NAME) not in storage.objects
+    assert f"{EX_NAME}.zip" in storage.objects
+
+
+def test_hardlink(tmp_path):
+    os.makedirs(tmp_path / "remote")
+    storage = LocalStorage({"path": str(tmp_path / "remote"), "hardlink": True}, "proj")
+    ex_dir = make_ex_dir(tmp_path / "a")
+
+    upload(EX_NAME, str(tmp_path / "a"), storage)
+    remote_file = tmp_path / "remote" / "proj" / EX_NAME / "test.txt"
+    assert os.stat(remote_file).st_ino == os.stat(ex_dir / "test.txt").st_ino
+
+
+def test_change_comment_and_remove(tmp_path):
+    os.makedirs(tmp_path / "remote")
+    storage = LocalStorage({"path": str(tmp_path / "remote")}, "proj")
+    make_ex_dir(tmp_path / "a")
+    upload(EX_NAME, str(tmp_path / "a"), storage)
+
+    storage.change_comment(EX_NAME, "renamed")
+    new_ex_name = "aaaaaa_20240101T000000_renamed"
+    assert storage.get_all_experiment_names() == [new_ex_name]
+    assert storage.list_experiments(refresh=True).keys() == {new_ex_name}
+
+    storage.remove_experiment(new_ex_name)
+    assert storage.list_experiments(refresh=True) == {}
+    assert os.listdir(tmp_path / "remote" / "proj") == []
+
+
+def test_missing_storage_dir(tmp_path):
+    with pytest.raises(ValueError):
+        LocalStorage({"path": str(tmp_path / "missing")}, "proj")
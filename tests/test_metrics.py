@@ -0,0 +1,73 @@
+import json
+import os
+
+from resutil import metrics
+from resutil.core import upload
+
+from conftest import DictStorage
+
+EX_NAME = "aaaaaa_20240101T000000_test"
+
+
+def test_phase_is_noop_without_hooks():
+    with metrics.phase("upload") as phase:
+        phase.add(bytes=10)
+    assert not phase.enabled
+
+
+def test_storage_methods_are_recorded(tmp_path):
+    ex_dir = tmp_path / EX_NAME
+    os.makedirs(ex_dir)
+    (ex_dir / "a.bin").write_bytes(os.urandom(1000))
+
+    records = []
+    metrics.add_hook(records.append)
+    try:
+        upload(EX_NAME, str(tmp_path), DictStorage())
+    finally:
+        metrics.remove_hook(records.append)
+
+    phases = {r["phase"]: r for r in records}
+    assert phases["upload"]["bytes"] == 1000
+    assert phases["upload"]["files"] == 1
+    assert phases["upload"]["target"] == EX_NAME
+    put = [r for r in records if r["phase"] == "storage.put_object"]
+    assert len(put) == 2  # a chunk and the manifest
+    assert put[0]["backend"] == "DictStorage"
+    assert all(r["ok"] for r in records)
+
+
+def test_metrics_file_and_summary(tmp_path, monkeypatch):
+    path = tmp_path / "metrics.jsonl"
+    monkeypatch.setenv(metrics.METRICS_FILE_ENV, str(path))
+    metrics.configure_from_env()
+    try:
+        with metrics.collect() as summary:
+            storage = DictStorage()
+            storage.put_object("a", b"12345")
+            storage.get_object("a")
+            list(metrics.counting_iter([b"abc", b"de"], "stream"))
+    finally:
+        metrics.remove_hook(metrics._metrics_file)
+        metrics._metrics_file = None
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [r["phase"] for r in lines] == [
+        "storage.put_object",
+        "storage.get_object",
+        "stream",
+    ]
+    assert summary.phases["stream"]["bytes"] == 5
+    assert summary.phases["storage.get_object"]["calls"] == 1
+    assert not metrics.enabled()
+
+
+def test_summary_counts_concurrent_calls_once():
+    summary = metrics.Summary()
+    # two overlapping parts of an upload, and a later one
+    for start in (100.0, 100.5, 110.0):
+        summary(
+            {"phase": "part", "start": start, "seconds": 1.0, "bytes": 10, "files": 0}
+        )
+    assert summary.phases["part"]["seconds"] == 3.0
+    assert summary.wall_seconds("part") == 2.5
@@ -0,0 +1,63 @@
+import threading
+
+from resutil.planner import TransferPlanner, dependency_name
+from resutil.scheduler import TransferScheduler
+from resutil.storage import Storage
+
+
+def make_planner(graph, source, destination=()):
+    return TransferPlanner(
+        "upload",
+        lambda ex_name: graph.get(ex_name, []),
+        lambda ex_name: ex_name in source,
+        lambda ex_name: ex_name in destination,
+    )
+
+
+def test_dependency_name():
+    assert dependency_name("results/aaaaaa_20240101T000000_a") == (
+        "aaaaaa_20240101T000000_a"
+    )
+    assert dependency_name("aaaaaa_20240101T000000_a") == "aaaaaa_20240101T000000_a"
+
+
+def test_diamond_is_transferred_once():
+    graph = {"a": ["b", "c"], "b": ["d"], "c": ["d"]}
+    plan = make_planner(graph, {"a", "b", "c", "d"}).resolve(["a"])
+    assert plan.transfers == ["d", "b", "c", "a"]
+    assert plan.cycles == []
+
+
+def test_skipped_missing_and_cycles():
+    graph = {"a": ["b", "c", "x"], "b": ["a"]}
+    plan = make_planner(graph, {"a", "b", "c"}, destination={"c"}).resolve(["a"])
+    assert plan.transfers == ["b", "a"]
+    assert plan.skipped == ["c"]
+    assert plan.missing == ["x"]
+    assert plan.cycles == [["a", "b", "a"]]
+
+
+def test_execute_expands_unresolved():
+    graph = {"b": ["c"], "c": []}
+    downloaded = set()
+    lock = threading.Lock()
+
+    def read_dependencies(ex_name):
+        return graph.get(ex_name) if ex_name in downloaded else None
+
+    planner = TransferPlanner(
+        "download",
+        read_dependencies,
+        lambda ex_name: True,
+        lambda ex_name: ex_name in downloaded,
+    )
+    plan = planner.resolve(["a", "b"])
+    assert plan.unresolved == ["a", "b"]
+
+    def transfer(ex_name):
+        with lock:
+            assert ex_name not in downloaded
+            downloaded.add(ex_name)
+
+    planner.execute(transfer, TransferScheduler(Storage({"max_transfers": 4}, "proj")))
+    assert downloaded == {"a", "b", "c"}
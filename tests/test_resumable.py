@@ -0,0 +1,284 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hashlib
+import json
+import os
+import threading
+
+import pytest
+import requests
+
+from resutil.storage.resumable import (
+    ResumableUpload,
+    ResumableDownload,
+    ResumeMismatch,
+    RetryPolicy,
+    SlicedDownload,
+    TransferError,
+    CHUNK_ALIGNMENT,
+)
+
+NO_WAIT = RetryPolicy(max_retries=5, initial_delay=0)
+
+
+class FakeServer(ThreadingHTTPServer):
+    # Resumable upload sessions and ranged downloads. Every `drop_every`-th
+    # request loses its connection: uploads before a response is sent,
+    # downloads in the middle of the body.
+    def __init__(self, drop_every=None):
+        super().__init__(("127.0.0.1", 0), FakeHandler)
+        self.drop_every = drop_every
+        self.requests = 0
+        self.sessions = {}
+        self.object = b""
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def should_drop(self):
+        with self.lock:
+            self.requests += 1
+            return self.drop_every is not None and self.requests % self.drop_every == 0
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        session_id = str(len(self.server.sessions))
+        self.server.sessions[session_id] = bytearray()
+        self.send_response(200)
+        self.send_header("Location", f"{self.server.url}/session/{session_id}")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_PUT(self):
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.server.should_drop():
+            self.close_connection = True
+            return
+        committed = self.server.sessions[self.path.split("/")[-1]]
+        span, total = self.headers["Content-Range"][len("bytes ") :].split("/")
+        if span != "*" and int(span.split("-")[0]) == len(committed):
+            committed += data
+            self.server.bytes_received += len(data)
+        if total != "*" and len(committed) == int(total):
+            self.server.object = bytes(committed)
+            body = json.dumps({"id": "1", "size": total}).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self.send_response(308)
+        if len(committed) > 0:
+            self.send_header("Range", f"bytes=0-{len(committed) - 1}")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        data = self.server.object
+        start, end = self.headers["Range"][len("bytes=") :].split("-")
+        body = data[int(start) : int(end) + 1]
+        self.send_response(206)
+        self.send_header(
+            "Content-Range", f"bytes {start}-{int(start) + len(body) - 1}/{len(data)}"
+        )
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.server.should_drop():
+            body = body[: len(body) // 2]
+            self.close_connection = True
+        self.wfile.write(body)
+        self.server.bytes_sent += len(body)
+
+
+@pytest.fixture
+def server():
+    servers = []
+
+    def start(drop_every=None):
+        server = FakeServer(drop_every)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def make_upload(server, state_path=None):
+    def initiate():
+        return requests.post(f"{server.url}/upload").headers["Location"]
+
+    return ResumableUpload(
+        requests.Session(),
+        initiate,
+        target={"name": "test.zip"},
+        state_path=state_path,
+        chunk_size=CHUNK_ALIGNMENT,
+        retry=NO_WAIT,
+    )
+
+
+def make_download(server, tmp_path):
+    return ResumableDownload(
+        requests.Session(),
+        f"{server.url}/object",
+        version={"generation": 1},
+        state_path=str(tmp_path / "state" / "test.download.json"),
+        part_path=str(tmp_path / "state" / "test.download.part"),
+        chunk_size=CHUNK_ALIGNMENT,
+        retry=NO_WAIT,
+    )
+
+
+def split(data, size=100000):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+def interrupted(chunks, after):
+    for i, chunk in enumerate(chunks):
+        if i == after:
+            raise KeyboardInterrupt()
+        yield chunk
+
+
+def test_upload_survives_dropped_connections(server):
+    server = server(drop_every=3)
+    data = os.urandom(4 * CHUNK_ALIGNMENT + 123)
+
+    result = make_upload(server).upload(split(data))
+
+    assert server.object == data
+    assert result == {"id": "1", "size": str(len(data))}
+
+
+def test_upload_of_empty_stream(server):
+    server = server()
+
+    make_upload(server).upload([])
+
+    assert server.object == b""
+
+
+def test_upload_resumes_after_interrupt(server, tmp_path):
+    server = server()
+    data = os.urandom(4 * CHUNK_ALIGNMENT + 123)
+    state_path = str(tmp_path / "test.upload.json")
+
+    with pytest.raises(KeyboardInterrupt):
+        make_upload(server, state_path).upload(interrupted(split(data), 8))
+    assert server.bytes_received == 2 * CHUNK_ALIGNMENT
+    assert os.path.exists(state_path)
+
+    make_upload(server, state_path).upload(split(data))
+
+    assert server.object == data
+    assert len(server.sessions) == 1
+    assert server.bytes_received == len(data)
+    assert not os.path.exists(state_path)
+
+
+def test_resumed_upload_of_different_data(server, tmp_path):
+    server = server()
+    data = os.urandom(4 * CHUNK_ALIGNMENT)
+    state_path = str(tmp_path / "test.upload.json")
+
+    with pytest.raises(KeyboardInterrupt):
+        make_upload(server, state_path).upload(interrupted(split(data), 8))
+
+    with pytest.raises(ResumeMismatch):
+        make_upload(server, state_path).upload(split(os.urandom(len(data))))
+    assert not os.path.exists(state_path)
+
+
+def test_download_survives_dropped_connections(server, tmp_path):
+    server = server(drop_every=2)
+    server.object = os.urandom(4 * CHUNK_ALIGNMENT + 123)
+
+    data = b"".join(make_download(server, tmp_path).iter_chunks())
+
+    assert data == server.object
+    assert os.listdir(tmp_path / "state") == []
+
+
+def test_download_resumes_from_part_file(server, tmp_path):
+    server = server()
+    server.object = os.urandom(4 * CHUNK_ALIGNMENT + 123)
+
+    chunks = make_download(server, tmp_path).iter_chunks()
+    received = next(chunks) + next(chunks)
+    chunks.close()
+    assert os.path.getsize(tmp_path / "state" / "test.download.part") == len(received)
+
+    data = b"".join(make_download(server, tmp_path).iter_chunks())
+
+    assert data == server.object
+    assert server.bytes_sent == len(server.object)
+    assert os.listdir(tmp_path / "state") == []
+
+
+def make_sliced_download(server, tmp_path, checksums=None, retry=NO_WAIT):
+    return SlicedDownload(
+        requests.Session(),
+        f"{server.url}/object",
+        len(server.object),
+        version={"generation": 1},
+        checksums=checksums or {"md5": hashlib.md5(server.object).hexdigest()},
+        state_path=str(tmp_path / "state" / "test.sliced.json"),
+        part_path=str(tmp_path / "state" / "test.sliced.part"),
+        slice_size=CHUNK_ALIGNMENT,
+        workers=1,
+        retry=retry,
+    )
+
+
+def test_sliced_download_survives_dropped_connections(server, tmp_path):
+    server = server(drop_every=2)
+    server.object = os.urandom(4 * CHUNK_ALIGNMENT + 123)
+    zip_path = tmp_path / "test.zip"
+
+    make_sliced_download(server, tmp_path).download(str(zip_path))
+
+    assert zip_path.read_bytes() == server.object
+    assert os.listdir(tmp_path / "state") == []
+
+
+def test_sliced_download_resumes_missing_slices(server, tmp_path):
+    server = server(drop_every=4)
+    server.object = os.urandom(4 * CHUNK_ALIGNMENT + 123)
+    zip_path = tmp_path / "test.zip"
+
+    # the fourth slice fails and is not retried
+    with pytest.raises(requests.RequestException):
+        make_sliced_download(
+            server, tmp_path, retry=RetryPolicy(max_retries=0)
+        ).download(str(zip_path))
+    server.drop_every = None
+    server.bytes_sent = 0
+
+    make_sliced_download(server, tmp_path).download(str(zip_path))
+
+    assert zip_path.read_bytes() == server.object
+    # the last slice may have been downloaded before the failure
+    assert server.bytes_sent in (CHUNK_ALIGNMENT, CHUNK_ALIGNMENT + 123)
+
+
+def test_sliced_download_checks_checksum(server, tmp_path):
+    server = server()
+    server.object = os.urandom(2 * CHUNK_ALIGNMENT)
+    zip_path = tmp_path / "test.zip"
+
+    with pytest.raises(TransferError):
+        make_sliced_download(server, tmp_path, checksums={"md5": "0" * 32}).download(
+            str(zip_path)
+        )
+    assert not zip_path.exists()
+    assert os.listdir(tmp_path / "state") == []
@@ -0,0 +1,88 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from resutil.scheduler import TransferScheduler
+from resutil.storage import Storage
+from resutil.storage.resumable import HTTPStatusError
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.request = SimpleNamespace(method="PUT")
+        self.url = "https://storage.example/upload"
+        self.text = ""
+
+
+def make_storage(max_transfers):
+    return Storage({"max_transfers": max_transfers, "retry_initial_delay": 0}, "proj")
+
+
+def test_concurrency_grows_while_throughput_does():
+    scheduler = TransferScheduler(make_storage(8))
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def transfer(ex_name):
+        # a backend serving each transfer at the same speed
+        with lock:
+            running.append(ex_name)
+            peak.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.remove(ex_name)
+
+    scheduler.run(transfer, [str(i) for i in range(60)])
+
+    assert scheduler.limit > 4
+    assert max(peak) <= 8
+
+
+def test_throttled_transfers_lower_concurrency_without_retries():
+    scheduler = TransferScheduler(make_storage(8))
+    attempts = []
+
+    def transfer(ex_name):
+        attempts.append(ex_name)
+        if ex_name == "a":
+            # the transfer retried its requests already
+            raise HTTPStatusError(FakeResponse(429))
+
+    with pytest.raises(HTTPStatusError):
+        scheduler.run(transfer, ["a", "b"])
+
+    assert sorted(attempts) == ["a", "b"]
+    assert scheduler.ceiling == 3
+    assert scheduler.limit <= 3
+
+
+def test_other_errors_are_raised():
+    scheduler = TransferScheduler(make_storage(2))
+
+    def transfer(ex_name):
+        raise HTTPStatusError(FakeResponse(404))
+
+    with pytest.raises(HTTPStatusError):
+        scheduler.run(transfer, ["a"])
+
+
+def test_failed_transfers_do_not_stop_the_others(capsys):
+    scheduler = TransferScheduler(make_storage(2))
+    transferred = []
+
+    def transfer(ex_name):
+        if ex_name in ("a", "c"):
+            raise ConnectionError(f"{ex_name} dropped")
+        time.sleep(0.01)
+        transferred.append(ex_name)
+
+    with pytest.raises(ConnectionError, match="a dropped"):
+        scheduler.run(transfer, ["a", "b", "c", "d", "e"])
+
+    assert sorted(transferred) == ["b", "d", "e"]
+    out = capsys.readouterr().out
+    assert "a dropped" in out and "c dropped" in out
@@ -0,0 +1,122 @@
+import os
+
+from resutil.archive import (
+    iter_zip_chunks,
+    extract_zip_stream,
+    extract_zip_members,
+    RangedFile,
+)
+from resutil.core import download, download_all, upload
+from resutil.ex_dir import is_partial, find_undownloaded_ex_dirs
+from resutil.utils import FileSelector
+
+from conftest import DictStorage
+
+EX_NAME = "aaaaaa_20240101T000000_test"
+
+
+class RangeZipStorage(DictStorage):
+    def __init__(self, data):
+        super().__init__()
+        self.data = data
+        self.bytes_read = 0
+        self.streamed = False
+        self.objects[f"{EX_NAME}.zip"] = data
+
+    def experiment_zip_size(self, ex_name):
+        return len(self.data)
+
+    def read_experiment_zip(self, ex_name, offset, length):
+        self.bytes_read += length
+        return self.data[offset : offset + length]
+
+    def download_experiment_stream(self, ex_name):
+        self.streamed = True
+        yield self.data
+
+
+def make_zip(tmp_path):
+    src = tmp_path / "src"
+    os.makedirs(src / "metrics")
+    (src / "resutil-exp.yaml").write_text("dependency: []\n")
+    (src / "metrics" / "metrics.json").write_text('{"loss": 0.1}')
+    (src / "metrics" / "model.pt").write_bytes(os.urandom(200000))
+    (src / "checkpoint.pt").write_bytes(os.urandom(3000000))
+    return b"".join(iter_zip_chunks(src))
+
+
+def test_file_selector():
+    select = FileSelector(include=["metrics/*"], exclude=["*.pt"])
+
+    assert select("metrics/metrics.json")
+    assert not select("metrics/model.pt")
+    assert not select("checkpoint.pt")
+    # dependencies are always pulled
+    assert select("resutil-exp.yaml")
+
+
+def test_extract_zip_members_reads_only_selected_members(tmp_path):
+    storage = RangeZipStorage(make_zip(tmp_path))
+    fileobj = RangedFile(
+        len(storage.data),
+        lambda offset, length: storage.read_experiment_zip(EX_NAME, offset, length),
+    )
+
+    extracted = extract_zip_members(
+        fileobj, str(tmp_path / "dst"), FileSelector(include=["metrics/*.json"])
+    )
+
+    assert sorted(extracted) == ["metrics/metrics.json", "resutil-exp.yaml"]
+    assert (tmp_path / "dst" / "metrics" / "metrics.json").read_text() == (
+        '{"loss": 0.1}'
+    )
+    assert not (tmp_path / "dst" / "checkpoint.pt").exists()
+    assert storage.bytes_read < 100000
+
+
+def test_extract_zip_stream_with_selection(tmp_path):
+    data = make_zip(tmp_path)
+
+    extract_zip_stream(
+        [data[i : i + 5000] for i in range(0, len(data), 5000)],
+        str(tmp_path / "dst"),
+        FileSelector(exclude=["*.pt"]),
+    )
+
+    assert sorted(os.listdir(tmp_path / "dst")) == ["metrics", "resutil-exp.yaml"]
+    assert os.listdir(tmp_path / "dst" / "metrics") == ["metrics.json"]
+
+
+def test_partial_pull_is_marked(tmp_path):
+    results_dir = str(tmp_path / "results")
+    storage = RangeZipStorage(make_zip(tmp_path))
+
+    download(EX_NAME, results_dir, storage, FileSelector(include=["metrics/*"]))
+
+    assert not storage.streamed
+    assert is_partial(results_dir, EX_NAME)
+    assert sorted(os.listdir(os.path.join(results_dir, EX_NAME))) == [
+        "metrics",
+        "resutil-exp.yaml",
+    ]
+    assert find_undownloaded_ex_dirs(results_dir, storage) == [EX_NAME]
+
+    # a partial experiment must not replace the remote one
+    upload(EX_NAME, results_dir, storage)
+    assert storage.puts == 0
+
+    download(EX_NAME, results_dir, storage)
+
+    assert not is_partial(results_dir, EX_NAME)
+    assert os.path.exists(os.path.join(results_dir, EX_NAME, "checkpoint.pt"))
+
+
+def test_pull_all_with_selection(tmp_path):
+    results_dir = str(tmp_path / "results")
+    storage = RangeZipStorage(make_zip(tmp_path))
+
+    download_all([EX_NAME], results_dir, storage, FileSelector(exclude=["*.pt"]))
+
+    assert is_partial(results_dir, EX_NAME)
+    assert not os.path.exists(os.path.join(results_dir, EX_NAME, "checkpoint.pt"))
+    assert os.path.exists(os.path.join(results_dir, EX_NAME, "metrics", "metrics.json"))
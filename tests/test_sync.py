@@ -0,0 +1,154 @@
+import hashlib
+import os
+
+from resutil.core import download, upload
+from resutil.storage.storage import experiment_name_from_object_name
+from resutil.sync import plan_sync, sync_experiments
+
+from conftest import DictStorage
+
+EX_A = "aaaaaa_20240101T000000_a"
+EX_B = "aaaaab_20240101T000000_b"
+
+
+class VersionedStorage(DictStorage):
+    # reports an md5 per experiment, like GCS
+    def _list_experiments(self):
+        self.listings += 1
+        experiments = {}
+        for key, data in self.objects.items():
+            ex_name = "/" not in key and experiment_name_from_object_name(key)
+            if ex_name:
+                experiments[ex_name] = {"md5": hashlib.md5(data).hexdigest()}
+        return experiments
+
+    def put_object(self, key, data):
+        super().put_object(key, data)
+        return {"md5": hashlib.md5(data).hexdigest()}
+
+
+def make_ex_dir(results_dir, ex_name, text):
+    os.makedirs(results_dir / ex_name, exist_ok=True)
+    (results_dir / ex_name / "result.txt").write_text(text)
+
+
+def sync(results_dir, storage, adopt=False):
+    plan = plan_sync(str(results_dir), storage, adopt=adopt)
+    sync_experiments(str(results_dir), storage, plan)
+    return plan
+
+
+def test_sync_transfers_missing_experiments_both_ways(tmp_path):
+    storage = VersionedStorage()
+    make_ex_dir(tmp_path / "other", EX_B, "b")
+    upload(EX_B, str(tmp_path / "other"), storage)
+    results_dir = tmp_path / "results"
+    make_ex_dir(results_dir, EX_A, "a")
+
+    plan = sync(results_dir, storage)
+
+    assert (plan.uploads, plan.downloads) == ([EX_A], [EX_B])
+    assert (results_dir / EX_B / "result.txt").read_text() == "b"
+    plan = plan_sync(str(results_dir), storage)
+    assert plan.unchanged == [EX_A, EX_B]
+
+
+def test_sync_transfers_changed_experiments(tmp_path):
+    storage = VersionedStorage()
+    results_dir = tmp_path / "results"
+    other_dir = tmp_path / "other"
+    make_ex_dir(results_dir, EX_A, "a")
+    make_ex_dir(results_dir, EX_B, "b")
+    sync(results_dir, storage)
+    sync(other_dir, storage)
+
+    # A gains a file locally, B is updated from another machine
+    (results_dir / EX_A / "more.txt").write_text("more")
+    make_ex_dir(other_dir, EX_B, "b2")
+    sync(other_dir, storage)
+    plan = sync(results_dir, storage)
+
+    assert (plan.uploads, plan.downloads) == ([EX_A], [EX_B])
+    assert (results_dir / EX_B / "result.txt").read_text() == "b2"
+    assert plan_sync(str(other_dir), storage).downloads == [EX_A]
+
+
+def test_experiments_changed_on_both_sides_are_not_synced(tmp_path):
+    storage = VersionedStorage()
+    results_dir = tmp_path / "results"
+    other_dir = tmp_path / "other"
+    make_ex_dir(results_dir, EX_A, "a")
+    sync(results_dir, storage)
+    sync(other_dir, storage)
+
+    make_ex_dir(other_dir, EX_A, "theirs")
+    sync(other_dir, storage)
+    make_ex_dir(results_dir, EX_A, "ours")
+    (results_dir / EX_A / "result.txt").touch()
+    plan = sync(results_dir, storage)
+
+    assert plan.conflicts == [EX_A]
+    assert (results_dir / EX_A / "result.txt").read_text() == "ours"
+
+
+def test_push_and_pull_are_recorded(tmp_path):
+    storage = VersionedStorage()
+    results_dir = tmp_path / "results"
+    other_dir = tmp_path / "other"
+    make_ex_dir(results_dir, EX_A, "a")
+    upload(EX_A, str(results_dir), storage)
+    download(EX_A, str(other_dir), storage)
+
+    assert plan_sync(str(results_dir), storage).unchanged == [EX_A]
+    assert plan_sync(str(other_dir), storage).unchanged == [EX_A]
+
+    # pushed again between two syncs
+    (results_dir / EX_A / "more.txt").write_text("more")
+    upload(EX_A, str(results_dir), storage)
+    storage.refresh_index()
+
+    assert plan_sync(str(results_dir), storage).unchanged == [EX_A]
+    plan = sync(other_dir, storage)
+    assert plan.downloads == [EX_A]
+    assert (other_dir / EX_A / "more.txt").read_text() == "more"
+
+
+def test_experiments_never_synced_are_conflicts(tmp_path):
+    storage = VersionedStorage()
+    make_ex_dir(tmp_path / "other", EX_A, "theirs")
+    upload(EX_A, str(tmp_path / "other"), storage)
+    results_dir = tmp_path / "results"
+    make_ex_dir(results_dir, EX_A, "ours")
+
+    plan = sync(results_dir, storage)
+
+    assert plan.conflicts == [EX_A]
+    assert (results_dir / EX_A / "result.txt").read_text() == "ours"
+
+
+def test_never_synced_experiments_can_be_adopted(tmp_path):
+    storage = VersionedStorage()
+    results_dir = tmp_path / "results"
+    make_ex_dir(tmp_path / "other", EX_A, "a")
+    upload(EX_A, str(tmp_path / "other"), storage)
+    make_ex_dir(results_dir, EX_A, "a")
+
+    plan = sync(results_dir, storage, adopt=True)
+
+    assert plan.unchanged == [EX_A]
+    (results_dir / EX_A / "more.txt").write_text("more")
+    assert plan_sync(str(results_dir), storage).uploads == [EX_A]
+
+
+def test_push_is_recorded_without_listing_again(tmp_path):
+    storage = VersionedStorage()
+    results_dir = tmp_path / "results"
+    make_ex_dir(results_dir, EX_A, "a")
+    make_ex_dir(results_dir, EX_B, "b")
+    storage.list_experiments()
+
+    upload(EX_A, str(results_dir), storage)
+    upload(EX_B, str(results_dir), storage)
+
+    assert storage.listings == 1
+    assert plan_sync(str(results_dir), storage).unchanged == [EX_A, EX_B]